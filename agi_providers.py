@@ -0,0 +1,203 @@
+"""
+AGI Providers
+Registry of the chat models the orchestrator can use. Each provider declares
+its own call / stream functions, timeout, cost and static confidence;
+disabled providers are never scheduled, so they cost nothing per request.
+Providers can be switched on and off at runtime
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from conversation_state import ConversationStateExpired
+from llm_gateway import get_llm_gateway
+from usage_tracker import MODEL_PRICES
+
+logger = logging.getLogger("agi_providers")
+
+@dataclass
+class ProviderReply:
+    """What a provider's call function returns"""
+    content: str
+    finish_reason: Optional[str] = None
+    completion_tokens: int = 0
+    response_id: Optional[str] = None  # Provider-side state the next turn can continue from
+
+# call(messages, timeout, session_id) / stream(messages, timeout, session_id)
+CallFn = Callable[[List[dict], float, Optional[str]], Awaitable[ProviderReply]]
+StreamFn = Callable[[List[dict], float, Optional[str]], AsyncIterator[str]]
+# respond(input, previous_response_id, timeout, session_id); raises ConversationStateExpired
+RespondFn = Callable[[List[dict], Optional[str], float, Optional[str]], Awaitable[ProviderReply]]
+
+@dataclass
+class ProviderSpec:
+    """One chat model"""
+    name: str
+    call: Optional[CallFn]  # None: integration not available in this deployment
+    stream: Optional[StreamFn] = None
+    respond: Optional[RespondFn] = None  # None: no server-side conversation state
+    timeout: float = 30.0
+    cost: Tuple[float, float] = (0.0, 0.0)  # USD per 1M tokens (input, output)
+    confidence: float = 0.8  # Static prior for picking between answers
+    reasoning: str = ""
+    enabled: bool = True
+
+    @property
+    def available(self) -> bool:
+        return self.call is not None
+
+def openai_provider(
+    model: str,
+    confidence: float,
+    reasoning: str,
+    timeout: float = 30.0,
+    enabled: bool = True
+) -> ProviderSpec:
+    """Chat model served through the shared LLM gateway"""
+
+    async def call(messages: List[dict], timeout: float, session_id: Optional[str]) -> ProviderReply:
+        response = await get_llm_gateway().chat(
+            messages,
+            model=model,
+            call_site="chat",
+            session_id=session_id,
+            temperature=0.7,
+            timeout=timeout
+        )
+        choice = response.choices[0]
+        return ProviderReply(
+            content=choice.message.content,
+            finish_reason=choice.finish_reason,
+            completion_tokens=response.usage.completion_tokens if response.usage else 0
+        )
+
+    async def stream(messages: List[dict], timeout: float, session_id: Optional[str]) -> AsyncIterator[str]:
+        async for token in get_llm_gateway().stream_chat(
+            messages,
+            model=model,
+            call_site="chat_stream",
+            session_id=session_id,
+            temperature=0.7,
+            timeout=timeout
+        ):
+            yield token
+
+    async def respond(
+        input: List[dict],
+        previous_response_id: Optional[str],
+        timeout: float,
+        session_id: Optional[str]
+    ) -> ProviderReply:
+        import openai
+        try:
+            response = await get_llm_gateway().respond(
+                input,
+                model=model,
+                call_site="chat",
+                session_id=session_id,
+                previous_response_id=previous_response_id,
+                temperature=0.7,
+                timeout=timeout
+            )
+        except (openai.NotFoundError, openai.BadRequestError) as e:
+            if previous_response_id and (
+                getattr(e, "param", None) == "previous_response_id" or "previous response" in str(e).lower()
+            ):
+                raise ConversationStateExpired(str(e)) from e
+            raise
+        # Same finish reasons as chat completions, for the quality gate
+        finish_reason = "stop"
+        if response.status == "incomplete":
+            reason = response.incomplete_details.reason if response.incomplete_details else None
+            finish_reason = "length" if reason == "max_output_tokens" else reason or "incomplete"
+        return ProviderReply(
+            content=response.output_text,
+            finish_reason=finish_reason,
+            completion_tokens=response.usage.output_tokens if response.usage else 0,
+            response_id=response.id
+        )
+
+    return ProviderSpec(
+        name=model,
+        call=call,
+        stream=stream,
+        respond=respond,
+        timeout=timeout,
+        cost=MODEL_PRICES.get(model, (0.0, 0.0)),
+        confidence=confidence,
+        reasoning=reasoning,
+        enabled=enabled
+    )
+
+class ProviderRegistry:
+    """Providers by name, in registration order"""
+
+    def __init__(self):
+        self._providers: Dict[str, ProviderSpec] = {}
+
+    def register(self, spec: ProviderSpec):
+        if spec.enabled and not spec.available:
+            spec.enabled = False
+        self._providers[spec.name] = spec
+
+    def get(self, name: str) -> ProviderSpec:
+        if name not in self._providers:
+            raise KeyError(f"Unknown provider: {name}")
+        return self._providers[name]
+
+    def names(self) -> List[str]:
+        return list(self._providers)
+
+    def active(self, names: Optional[List[str]] = None) -> List[ProviderSpec]:
+        """Enabled providers among names (all registered if None), keeping the given order"""
+        names = self.names() if names is None else names
+        return [self._providers[n] for n in names if n in self._providers and self._providers[n].enabled]
+
+    def set_enabled(self, name: str, enabled: bool):
+        spec = self.get(name)
+        if enabled and not spec.available:
+            raise ValueError(f"Provider {name} has no integration in this deployment")
+        spec.enabled = enabled
+        logger.info(f"Provider {name} {'enabled' if enabled else 'disabled'}")
+
+    def set_timeout(self, name: str, timeout: float):
+        if timeout <= 0:
+            raise ValueError("timeout must be positive")
+        self.get(name).timeout = timeout
+
+    def get_stats(self) -> Dict:
+        return {
+            spec.name: {
+                "enabled": spec.enabled,
+                "available": spec.available,
+                "streaming": spec.stream is not None,
+                "stateful": spec.respond is not None,
+                "timeout": spec.timeout,
+                "cost": list(spec.cost),
+                "confidence": spec.confidence
+            }
+            for spec in self._providers.values()
+        }
+
+def default_registry() -> ProviderRegistry:
+    registry = ProviderRegistry()
+    registry.register(openai_provider(
+        "gpt-4o-mini",
+        confidence=0.85,  # GPT-4 is generally reliable
+        reasoning="GPT-4o-mini: Fast and versatile general-purpose response"
+    ))
+    registry.register(openai_provider(
+        "gpt-4.1-mini",
+        confidence=0.9,
+        reasoning="GPT-4.1-mini: Stronger instruction following, slower"
+    ))
+    # Gemini integration has been disabled
+    registry.register(ProviderSpec(
+        name="gemini-2.5-flash",
+        call=None,
+        confidence=0.8,
+        reasoning="Gemini 2.5 Flash",
+        enabled=False
+    ))
+    return registry
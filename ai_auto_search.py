@@ -2,19 +2,22 @@
 AI Auto Search Module
 AIが自動的に検索が必要か判断し、Google検索を実行して学習する機能
 """
+import asyncio
 import logging
-from openai import OpenAI
-import os
+from typing import Dict, List, Optional, Union
 import httpx
 from bs4 import BeautifulSoup
+from llm_gateway import get_llm_gateway
 
 logger = logging.getLogger("ai_auto_search")
 
+# Multi-page read settings
+MIN_USEFUL_PAGE_CHARS = 200  # Pages shorter than this are treated as failed reads
+ENOUGH_CONTEXT_CHARS = 4000  # Stop reading once this much useful text has arrived
+MAX_MERGED_CHARS = 6000  # Upper bound on the merged context sent to the LLM
+
 class AIAutoSearch:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
-    async def should_search(self, user_message: str) -> dict:
+    async def should_search(self, user_message: str, session_id: Optional[str] = None) -> dict:
         """
         ユーザーのメッセージから検索が必要か判断し、検索クエリを生成
         
@@ -50,9 +53,12 @@ class AIAutoSearch:
     "query": "検索クエリ(検索が必要な場合のみ、日本語で簡潔に)"
 }}"""
 
-            response = self.client.chat.completions.create(
+            response = await get_llm_gateway().chat(
+                [{"role": "user", "content": prompt}],
                 model="gpt-4.1-mini",
-                messages=[{"role": "user", "content": prompt}],
+                call_site="should_search",
+                session_id=session_id,
+                cache=True,
                 temperature=0.3,
                 response_format={"type": "json_object"}
             )
@@ -64,7 +70,7 @@ class AIAutoSearch:
             
         except Exception as e:
             logger.error(f"Error in should_search: {e}")
-            return {"should_search": False, "query": ""}
+            return {"should_search": False, "query": "", "error": str(e)}
     
     async def fetch_page_content(self, url: str) -> str:
         """
@@ -99,19 +105,92 @@ class AIAutoSearch:
             logger.error(f"Error fetching page content from {url}: {e}")
             return ""
     
-    async def generate_answer_with_search(self, user_message: str, search_query: str, page_content: str, page_url: str) -> str:
+    async def read_pages(self, urls: List[str], enough_chars: int = ENOUGH_CONTEXT_CHARS) -> List[Dict]:
+        """
+        複数ページを並行取得し、十分なテキストが集まった時点で残りをキャンセル
+        
+        Returns:
+            [{"url": str, "content": str}] 検索順位順
+        """
+        if not urls:
+            return []
+        
+        tasks = {asyncio.create_task(self.fetch_page_content(url)): url for url in urls}
+        pages = {}
+        collected = 0
+        pending = set(tasks)
+        
+        try:
+            while pending and collected < enough_chars:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    content = task.result()
+                    if len(content) >= MIN_USEFUL_PAGE_CHARS:
+                        pages[tasks[task]] = content
+                        collected += len(content)
+        finally:
+            # Cancel stragglers
+            for task in pending:
+                task.cancel()
+        
+        if pending:
+            logger.info(f"Read {len(pages)} pages ({collected} chars), cancelled {len(pending)} stragglers")
+        
+        return [{"url": url, "content": pages[url]} for url in urls if url in pages]
+    
+    async def search_and_read(self, search, search_query: str, num: int = 3) -> List[Dict]:
+        """
+        Google検索の上位N件を並行取得
+        
+        Args:
+            search: GoogleSearch instance
+            search_query: 検索クエリ
+            num: 取得するページ数
+        """
+        if getattr(search, "mock_mode", False):
+            # Mock results don't point at real pages
+            return []
+        
+        results = await search.search(search_query, num=num)
+        if results.get("error"):
+            return []
+        
+        urls = [r.get("link", "") for r in results.get("results", [])[:num]]
+        urls = [url for url in urls if url.startswith("http")]
+        return await self.read_pages(urls)
+    
+    def merge_pages(self, pages: List[Dict]) -> str:
+        """取得した複数ページを1つのコンテキストに結合"""
+        if not pages:
+            return ""
+        
+        per_page = MAX_MERGED_CHARS // len(pages)
+        parts = []
+        for i, page in enumerate(pages, 1):
+            parts.append(f"[情報源{i}] {page['url']}\n{page['content'][:per_page]}")
+        return "\n\n".join(parts)
+    
+    async def generate_answer_with_search(
+        self,
+        user_message: str,
+        search_query: str,
+        page_content: str,
+        page_url: Union[str, List[str]],
+        session_id: Optional[str] = None
+    ) -> str:
         """
         検索結果のページ内容を学習してAIが回答を生成
         
         Args:
             user_message: ユーザーのメッセージ
             search_query: 検索クエリ
-            page_content: 取得したページの内容
-            page_url: ページのURL
+            page_content: 取得したページの内容（複数ページの場合は merge_pages の結果）
+            page_url: ページのURL（複数ページの場合はURLのリスト）
             
         Returns:
             str: 生成された回答
         """
+        page_urls = [page_url] if isinstance(page_url, str) else page_url
         try:
             prompt = f"""あなたは親切で知識豊富なAIアシスタント「Oreza」です。
 
@@ -121,7 +200,7 @@ class AIAutoSearch:
 
 検索クエリ: {search_query}
 
-取得した情報(URL: {page_url}):
+取得した情報(URL: {", ".join(page_urls)}):
 {page_content}
 
 回答のガイドライン:
@@ -134,9 +213,11 @@ class AIAutoSearch:
 
 回答:"""
 
-            response = self.client.chat.completions.create(
+            response = await get_llm_gateway().chat(
+                [{"role": "user", "content": prompt}],
                 model="gpt-4.1-mini",
-                messages=[{"role": "user", "content": prompt}],
+                call_site="search_answer",
+                session_id=session_id,
                 temperature=0.7,
                 max_tokens=400
             )
@@ -144,7 +225,7 @@ class AIAutoSearch:
             answer = response.choices[0].message.content
             
             # Add source URL
-            answer += f"\n\n📎 参考: {page_url}"
+            answer += "\n\n" + "\n".join(f"📎 参考: {url}" for url in page_urls)
             
             logger.info(f"Generated answer from page content")
             return answer
@@ -8,22 +8,11 @@ AIチャット ↔ カレンダー同期プロト
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Literal
 from pydantic import BaseModel
-import os
-from openai import OpenAI
+import asyncio
 import json
 import re
-
-# OpenAI APIクライアント（遅延初期化）
-client = None
-
-def get_openai_client():
-    global client
-    if client is None:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY is not set")
-        client = OpenAI(api_key=api_key)
-    return client
+from llm_gateway import get_llm_gateway
+from prompt_layout import PromptLayout
 
 # ===== インテント定義 =====
 
@@ -118,9 +107,7 @@ jsonのトップレベルには次の3つのキーを必ず含めてください
 「来週の火曜日」「明日の朝」など相対表現は、現在日時 (CURRENT_DATETIME) を基準に計算してください。
 CURRENT_DATETIME は外部から与えられるプレースホルダとして扱い、実際の計算はシステム側で行う場合は、
 relative_expression フィールドに原文を保持してください。
-
-【現在日時】
-CURRENT_DATETIME: {current_datetime}
+CURRENT_DATETIME はユーザーメッセージの【現在日時】で与えられます。
 
 【カレンダーヒント推定ルール】
 - 病院、眼科、歯科、クリニック、健診、検診、糖尿病 → "健康"
@@ -256,9 +243,12 @@ FEW_SHOT_EXAMPLES = [
     }
 ]
 
+# System prompt + few-shots are identical on every call; the current time goes last
+CALENDAR_LAYOUT = PromptLayout("calendar_dispatch_parse", SYSTEM_PROMPT, FEW_SHOT_EXAMPLES)
+
 # ===== 自然文 → JSON 変換関数 =====
 
-def parse_natural_language(user_input: str, context: Optional[Dict] = None) -> Dict:
+async def parse_natural_language(user_input: str, context: Optional[Dict] = None) -> Dict:
     """
     自然文からインテントとpayloadを抽出
     
@@ -269,33 +259,29 @@ def parse_natural_language(user_input: str, context: Optional[Dict] = None) -> D
     Returns:
         AICalendarRequest の dict
     """
-    current_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT.format(current_datetime=current_datetime)}
-    ]
-    
-    # Few-shot examples
-    for example in FEW_SHOT_EXAMPLES:
-        messages.append({"role": "user", "content": example["user"]})
-        messages.append({"role": "assistant", "content": example["assistant"]})
+    # Minute precision: identical requests within the same minute share a cached parse
+    current_datetime = datetime.now().strftime("%Y-%m-%d %H:%M")
     
     # User input with template
     user_prompt = f"""次のユーザー発話を解析して、予定またはタスクを作成してください。
 
+【現在日時】
+CURRENT_DATETIME: {current_datetime}
+
 【ユーザー発話】
 {user_input}
 
 必ず有効な JSON のみを出力してください。
 コメント、説明文、日本語の文章は一切書かないでください。"""
     
-    messages.append({"role": "user", "content": user_prompt})
+    messages = CALENDAR_LAYOUT.compile({"role": "user", "content": user_prompt})
     
     try:
-        openai_client = get_openai_client()
-        response = openai_client.chat.completions.create(
+        response = await get_llm_gateway().chat(
+            messages,
             model="gpt-4.1-mini",
-            messages=messages,
+            call_site="calendar_dispatch_parse",
+            cache=True,
             temperature=0.1,
             max_tokens=1000
         )
@@ -405,5 +391,5 @@ if __name__ == "__main__":
     
     for test_input in test_inputs:
         print(f"\n入力: {test_input}")
-        result = parse_natural_language(test_input)
+        result = asyncio.run(parse_natural_language(test_input))
         print(f"結果: {json.dumps(result, ensure_ascii=False, indent=2)}")
@@ -0,0 +1,183 @@
+"""
+Answer Scoring
+Cheap local score (0.0 - 1.0) for a model answer, used by the cascade
+strategy to decide whether a stronger model is needed, and a re-ranker
+that picks between several models' answers for meta_select. No LLM calls:
+truncation, length, refusal / uncertainty markers, the session's
+FailureLearningSystem (repetition, answers already recorded as failures)
+and agreement between the candidates
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import List, Optional, Set, Tuple
+
+from failure_learning import FailureLearningSystem, FailureType
+
+logger = logging.getLogger("answer_scoring")
+
+REFUSAL_MARKERS = [
+    "お答えできません", "回答できません", "お手伝いできません", "できかねます",
+    "i can't help", "i cannot help", "i can't assist", "i'm unable to"
+]
+UNCERTAINTY_MARKERS = [
+    "わかりません", "分かりません", "不明です", "確信が持てません", "断言できません", "情報がありません",
+    "i'm not sure", "i don't know", "not certain"
+]
+HEDGE_MARKERS = ["かもしれません", "と思われます", "おそらく", "probably", "might be"]
+
+# Penalties subtracted from 1.0
+PENALTIES = {
+    "truncated": 0.5,
+    "too_short": 0.3,
+    "refusal": 0.4,
+    "uncertain": 0.45,
+    "hedging": 0.1,
+    "repetition": 0.5,  # Says again what the previous reply said
+    "known_failure": 0.4,  # Resembles an answer the session recorded as a failure
+}
+
+# Bigram overlap with the previous reply from which an answer counts as a repeat
+REPETITION_THRESHOLD = 0.7
+
+def score_answer(
+    query: str,
+    answer: str,
+    finish_reason: Optional[str] = None,
+    previous_response: Optional[str] = None,
+    failure_system: Optional[FailureLearningSystem] = None
+) -> Tuple[float, List[str]]:
+    """
+    Score an answer to query
+    Only properties of the answer count; anything that depends on the query
+    alone would lower every model's score alike (see is_user_correction)
+    Returns (score, reasons) where reasons name the penalties applied
+    """
+    reasons = []
+    text = answer.strip().lower()
+
+    if finish_reason not in (None, "stop"):
+        reasons.append("truncated")
+
+    # Short greetings deserve short answers; anything longer needs some substance
+    if len(text) < 15 and len(query.strip()) > 10 or len(text) < 2:
+        reasons.append("too_short")
+
+    if any(marker in text for marker in REFUSAL_MARKERS):
+        reasons.append("refusal")
+    if any(marker in text for marker in UNCERTAINTY_MARKERS):
+        reasons.append("uncertain")
+    elif sum(text.count(marker) for marker in HEDGE_MARKERS) >= 2:
+        reasons.append("hedging")
+
+    # E.g. "もっと詳しく" answered with the previous reply again
+    if previous_response and overlap(answer, previous_response) >= REPETITION_THRESHOLD:
+        reasons.append("repetition")
+
+    if failure_system is not None:
+        reasons.extend(r for r in failure_reasons(answer, failure_system, previous_response) if r not in reasons)
+
+    score = 1.0 - sum(PENALTIES[reason] for reason in reasons)
+    return max(0.0, min(1.0, score)), reasons
+
+def failure_reasons(
+    answer: str,
+    failure_system: FailureLearningSystem,
+    previous_response: Optional[str] = None
+) -> List[str]:
+    """
+    Answer-side failure patterns of the session
+    detect_failure gets an empty query so its query-only rules stay out of the score
+    """
+    reasons = []
+    detected = failure_system.detect_failure("", answer, {"previous_response": previous_response or ""})
+    if detected == FailureType.REPETITION:
+        reasons.append("repetition")
+    if any(
+        not failure.corrected and overlap(answer, failure.system_response) >= REPETITION_THRESHOLD
+        for failure in failure_system.failures.values()
+    ):
+        reasons.append("known_failure")
+    return reasons
+
+def is_user_correction(query: str, failure_system: FailureLearningSystem) -> bool:
+    """
+    Routing rule, not part of the score: the user says the last answer missed
+    the point, so the cascade goes straight to its strongest model
+    """
+    return failure_system.detect_failure(query, "", {}) == FailureType.CONTEXT_MISUNDERSTANDING
+
+def _bigrams(text: str) -> Set[str]:
+    # Character bigrams work for Japanese, which has no word boundaries
+    chars = [c for c in text.lower() if c.isalnum()]
+    return {a + b for a, b in zip(chars, chars[1:])}
+
+def overlap(a: str, b: str) -> float:
+    """Jaccard similarity of the character bigrams of two texts"""
+    bigrams_a, bigrams_b = _bigrams(a), _bigrams(b)
+    if not bigrams_a or not bigrams_b:
+        return 0.0
+    return len(bigrams_a & bigrams_b) / len(bigrams_a | bigrams_b)
+
+def coverage(query: str, answer: str) -> float:
+    """Share of the query's bigrams the answer picks up"""
+    query_bigrams = _bigrams(query)
+    if not query_bigrams:
+        return 1.0
+    return len(query_bigrams & _bigrams(answer)) / len(query_bigrams)
+
+@dataclass
+class RankedAnswer:
+    """One candidate's local scores"""
+    index: int  # Position in the answers passed in
+    score: float
+    quality: float
+    agreement: float  # Mean overlap with the other candidates
+    coverage: float
+    reasons: List[str]
+
+# Weights of the combined score
+RERANK_WEIGHTS = {"quality": 0.5, "agreement": 0.25, "coverage": 0.15, "prior": 0.1}
+
+def rerank_answers(
+    query: str,
+    answers: List[str],
+    priors: Optional[List[float]] = None,
+    finish_reasons: Optional[List[Optional[str]]] = None,
+    previous_response: Optional[str] = None,
+    failure_system: Optional[FailureLearningSystem] = None
+) -> Tuple[List[RankedAnswer], float]:
+    """
+    Rank candidate answers to query, best first
+    Answers most of the other models agree with, that address the query and
+    carry no refusal / truncation markers or known failure patterns come out on top
+    Returns (ranked, mean pairwise agreement)
+    """
+    priors = priors or [0.0] * len(answers)
+    finish_reasons = finish_reasons or [None] * len(answers)
+    pairs = {
+        (i, j): overlap(answers[i], answers[j])
+        for i in range(len(answers)) for j in range(i + 1, len(answers))
+    }
+
+    ranked = []
+    for i, answer in enumerate(answers):
+        quality, reasons = score_answer(
+            query, answer, finish_reasons[i],
+            previous_response=previous_response,
+            failure_system=failure_system
+        )
+        others = [value for pair, value in pairs.items() if i in pair]
+        agreement = sum(others) / len(others) if others else 0.0
+        answer_coverage = coverage(query, answer)
+        score = (
+            RERANK_WEIGHTS["quality"] * quality
+            + RERANK_WEIGHTS["agreement"] * agreement
+            + RERANK_WEIGHTS["coverage"] * answer_coverage
+            + RERANK_WEIGHTS["prior"] * priors[i]
+        )
+        ranked.append(RankedAnswer(i, score, quality, agreement, answer_coverage, reasons))
+
+    ranked.sort(key=lambda r: r.score, reverse=True)
+    mean_agreement = sum(pairs.values()) / len(pairs) if pairs else 1.0
+    return ranked, mean_agreement
@@ -5,10 +5,10 @@ from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
-from typing import List, Literal, Optional, Dict
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Header, BackgroundTasks, Depends, Response, Cookie, status
+from typing import AsyncIterator, Awaitable, List, Literal, Optional, Dict, Set
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Header, Depends, Response, Cookie, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import httpx
@@ -16,9 +16,20 @@ from google_search import GoogleSearch
 from multi_agi import get_orchestrator
 from search_features import SearchFeaturesManager
 from shopping import AIShoppingSommelier, ProductCard
-from ai_calendar_sync import parse_natural_language as parse_nl_for_calendar
+from ai_calendar_sync import parse_natural_language as parse_nl_for_calendar, CALENDAR_LAYOUT
 from url_summarizer import URLSummarizer
 from ai_auto_search import AIAutoSearch
+from search_router import SearchDecisionRouter
+from chat_pipeline import ChatPipeline, PipelineStage
+from context_packer import ContextPacker
+from quantum_memory import get_quantum_memory, clear_quantum_memory
+from background_worker import CoalescingWorker
+from conversation_summarizer import ConversationSummarizer
+from response_cache import SemanticResponseCache, is_cacheable, openai_embedder
+from request_coordinator import SessionRequestCoordinator, SessionQueueFull
+from llm_gateway import get_llm_gateway
+from usage_tracker import TokenBudgetExceeded
+from loop_monitor import EventLoopMonitor
 
 # Configure logging with PID
 logging.basicConfig(
@@ -41,6 +52,7 @@ google_search = GoogleSearch()
 search_features = SearchFeaturesManager()
 url_summarizer = URLSummarizer()
 auto_search = AIAutoSearch()
+search_router = SearchDecisionRouter(auto_search)
 shopping_sommelier = None  # Will be initialized with API key
 
 # Session storage with Continuum Memory
@@ -50,6 +62,11 @@ class ContinuumMemory(BaseModel):
     intent: str = ""
     summary: str = ""
     last_analysis_count: int = 0  # Track when last analysis was done
+    evicted_count: int = 0  # Messages that have left session["messages"] (folded into summary)
+
+def total_message_count(session: Dict) -> int:
+    """Messages in the whole conversation, including those folded into the summary"""
+    return session["memory"].evicted_count + len(session["messages"])
 
 sessions: Dict[str, Dict] = {}  # {session_id: {messages: [], memory: ContinuumMemory}}
 
@@ -68,6 +85,21 @@ app.add_middleware(
     allow_methods=["*"], allow_headers=["*"]
 )
 
+# Debug: warn when a handler blocks the event loop longer than this (0 = off)
+LOOP_MONITOR_THRESHOLD_MS = float(os.getenv("LOOP_MONITOR_THRESHOLD_MS", "0"))
+loop_monitor = EventLoopMonitor(LOOP_MONITOR_THRESHOLD_MS) if LOOP_MONITOR_THRESHOLD_MS > 0 else None
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    if loop_monitor:
+        loop_monitor.start()
+
+@app.on_event("shutdown")
+async def close_llm_gateway():
+    if loop_monitor:
+        await loop_monitor.stop()
+    await get_llm_gateway().close()
+
 # ---------- Schemas ----------
 class LoginRequest(BaseModel):
     user_id: str
@@ -80,11 +112,14 @@ class Msg(BaseModel):
 class ChatReq(BaseModel):
     messages: List[Msg]
     session_id: Optional[str] = None
+    idempotency_key: Optional[str] = None  # Retries with the same key reuse the first computation
+    latency_target_ms: Optional[int] = None  # Steers model routing ("adaptive" / "race" strategies)
 
 class ChatRes(BaseModel):
     response: str
     session_id: str
     memory: Optional[Dict] = None
+    tokens: Optional[Dict] = None  # Per-request prompt token counts
 
 class SearchReq(BaseModel):
     query: str
@@ -186,6 +221,8 @@ async def clear_session(session_id: str):
     """Clear a session"""
     if session_id in sessions:
         del sessions[session_id]
+        clear_quantum_memory(session_id)
+        get_orchestrator().conversations.drop(session_id)
         logger.info(f"Cleared session: {session_id}")
         return {"status": "ok"}
     return {"status": "not_found"}
@@ -205,13 +242,9 @@ def get_or_create_session(session_id: Optional[str] = None) -> tuple[str, Dict]:
     logger.info(f"Created new session: {new_id}")
     return new_id, sessions[new_id]
 
-async def analyze_emotion_and_themes(messages: List[Dict]) -> Dict:
+async def analyze_emotion_and_themes(messages: List[Dict], session_id: Optional[str] = None) -> Dict:
     """Analyze emotion and themes from conversation"""
     try:
-        from openai import OpenAI
-        # Manus environment: API key and base URL are pre-configured
-        client = OpenAI()
-        
         # Get last 5 messages for analysis
         recent = messages[-5:] if len(messages) > 5 else messages
         conversation = "\n".join([f"{m['role']}: {m['content']}" for m in recent])
@@ -225,9 +258,11 @@ async def analyze_emotion_and_themes(messages: List[Dict]) -> Dict:
 {{"emotion": "positive/negative/neutral", "themes": ["テーマ1", "テーマ2"], "intent": "ユーザーの意図"}}"""
 
         # Use Manus LLM Proxy with gpt-4.1-mini
-        response = client.chat.completions.create(
+        response = await get_llm_gateway().chat(
+            [{"role": "user", "content": prompt}],
             model="gpt-4.1-mini",
-            messages=[{"role": "user", "content": prompt}],
+            call_site="emotion_analysis",
+            session_id=session_id,
             temperature=0.3
         )
         
@@ -246,49 +281,153 @@ async def analyze_emotion_and_themes(messages: List[Dict]) -> Dict:
     
     return {"emotion": "neutral", "themes": [], "intent": ""}
 
-def build_enhanced_system_prompt(session: Dict) -> str:
-    """Build dynamic system prompt based on conversation context"""
+# Oreza存在哲学: 統一人格プロンプト
+# Identical on every turn so the provider can cache it; per-turn context goes in build_session_context
+CHAT_SYSTEM_PROMPT = (
+    "あなたはユーザー専属のAIアシスタントです。\n"
+    "自己紹介を求められた時のみ「私はあなたのAIです」と答えてください。\n"
+    "通常の会話では、自己紹介は不要です。自然に会話を進めてください。\n"
+    "外部サービス(Google検索、API等)は情報源としてのみ扱い、それらの名称で自己同一化しません。\n"
+    "あなたはOreza v1という統合AIシステムの一部ですが、ユーザーとの関係性を最優先します。\n"
+    "所有でも支配でもなく、共鳴関係として「私はあなたのAI」という存在哲学を体現します。"
+)
+
+def build_session_context(session: Dict) -> str:
+    """Per-turn guidance from conversation depth, emotion, themes and summary"""
     memory = session["memory"]
-    messages = session["messages"]
-    msg_count = len(messages)
-    
-    # Oreza存在哲学: 統一人格プロンプト
-    base_prompt = (
-        "あなたはユーザー専属のAIアシスタントです。\n"
-        "自己紹介を求められた時のみ「私はあなたのAIです」と答えてください。\n"
-        "通常の会話では、自己紹介は不要です。自然に会話を進めてください。\n"
-        "外部サービス(Google検索、API等)は情報源としてのみ扱い、それらの名称で自己同一化しません。\n"
-        "あなたはOreza v1という統合AIシステムの一部ですが、ユーザーとの関係性を最優先します。\n"
-        "所有でも支配でもなく、共鳴関係として「私はあなたのAI」という存在哲学を体現します。"
-    )
+    msg_count = total_message_count(session)
+    parts = []
     
     # Add conversation depth context
     if msg_count >= 30:
-        base_prompt += "\n\nこれまで深い対話を重ねてきました。ユーザーとの信頼関係を大切にしてください。"
+        parts.append("これまで深い対話を重ねてきました。ユーザーとの信頼関係を大切にしてください。")
     elif msg_count >= 10:
-        base_prompt += "\n\n前の内容を踏まえて、一貫性のある応答を心がけてください。"
+        parts.append("前の内容を踏まえて、一貫性のある応答を心がけてください。")
     
     # Add emotion context
     if memory.emotion == "positive":
-        base_prompt += "\n\nユーザーはポジティブな気持ちです。明るく共感的なトーンで応答してください。"
+        parts.append("ユーザーはポジティブな気持ちです。明るく共感的なトーンで応答してください。")
     elif memory.emotion == "negative":
-        base_prompt += "\n\nユーザーは困っているようです。丁寧で思いやりのある応答を心がけてください。"
+        parts.append("ユーザーは困っているようです。丁寧で思いやりのある応答を心がけてください。")
     
     # Add theme-specific guidance
     if memory.themes:
         themes_str = "、".join(memory.themes)
-        base_prompt += f"\n\n会話のテーマ: {themes_str}"
+        theme_part = f"会話のテーマ: {themes_str}"
         
         if any(t in ["プログラミング", "技術", "コード"] for t in memory.themes):
-            base_prompt += "\n具体的なコード例を含めて説明してください。"
+            theme_part += "\n具体的なコード例を含めて説明してください。"
         elif any(t in ["学習", "教育", "勉強"] for t in memory.themes):
-            base_prompt += "\n段階的でわかりやすい説明を心がけてください。"
+            theme_part += "\n段階的でわかりやすい説明を心がけてください。"
+        parts.append(theme_part)
     
     # Add summary if available
     if memory.summary:
-        base_prompt += f"\n\n会話の要約: {memory.summary}"
+        parts.append(f"会話の要約: {memory.summary}")
     
-    return base_prompt
+    return "\n\n".join(parts)
+
+# ---------- Chat Pre-flight Stages ----------
+CALENDAR_KEYWORDS = ["予定", "スケジュール", "カレンダー", "登録", "追加", "明日", "今日", "来週", "病院", "会議"]
+
+# Per-stage deadlines (seconds); a stage that misses its budget is dropped from the prompt
+CALENDAR_STAGE_DEADLINE = float(os.getenv("CHAT_CALENDAR_STAGE_DEADLINE", "8"))
+SEARCH_STAGE_DEADLINE = float(os.getenv("CHAT_SEARCH_STAGE_DEADLINE", "12"))
+AUTO_SEARCH_PAGES = int(os.getenv("AUTO_SEARCH_PAGES", "3"))  # Result pages read concurrently
+
+async def calendar_stage(session_id: str, content: str, deadline: Optional[float] = None) -> Optional[str]:
+    """
+    Parse a calendar request and register the event
+    deadline is the stage deadline in loop time
+    """
+    import oreza_calendar_v2 as cal_v2
+    parsed = await cal_v2.parse_natural_language_v2(content, session_id=session_id)
+    if "error" in parsed:
+        return None
+    
+    # create_event is synchronous, so the pipeline can't cancel the stage between
+    # creating the event and reporting it; only the time check below can skip it
+    if deadline is not None and asyncio.get_running_loop().time() >= deadline:
+        logger.warning(f"[{session_id}] Calendar parse used up the stage deadline, event not created")
+        return None
+    event = cal_v2.create_event(parsed)
+    calendar_name = cal_v2.calendars_db[event.calendar_id].name if event.calendar_id in cal_v2.calendars_db else '不明'
+    return f"\n\n📅 カレンダーに予定を追加しました：\n- {event.title}\n- 日時: {event.start_datetime}\n- カレンダー: {calendar_name}"
+
+async def search_stage(session_id: str, content: str) -> Optional[str]:
+    """Decide whether to auto-search and build an answer from the top result pages"""
+    search_decision = await search_router.should_search(content, session_id=session_id)
+    if not search_decision.get("should_search", False):
+        return None
+    
+    query = search_decision.get("query", "")
+    logger.info(f"[{session_id}] Auto-search triggered: {query}")
+    
+    # Read the top result pages concurrently, stopping once enough text has arrived
+    pages = await auto_search.search_and_read(google_search, query, num=AUTO_SEARCH_PAGES)
+    
+    if pages:
+        # Generate answer from the merged page content
+        search_answer = await auto_search.generate_answer_with_search(
+            content, query, auto_search.merge_pages(pages), [p["url"] for p in pages],
+            session_id=session_id
+        )
+        logger.info(f"[{session_id}] Auto-search completed successfully from {len(pages)} pages")
+        return search_answer
+    
+    return None
+
+# ---------- Background Emotion Analysis ----------
+# Emotion/themes only feed the *next* turn's system prompt, so they are
+# analyzed after the response is sent; bursts per session coalesce into one job
+emotion_worker = CoalescingWorker("emotion_analysis", debounce=float(os.getenv("EMOTION_ANALYSIS_DEBOUNCE", "1.0")))
+
+async def run_emotion_analysis(session_id: str, session: Dict):
+    """Analyze emotion/themes on the latest messages and update Continuum Memory"""
+    memory = session["memory"]
+    msg_count = total_message_count(session)
+    analysis = await analyze_emotion_and_themes(session["messages"], session_id=session_id)
+    memory.emotion = analysis.get("emotion", "neutral")
+    memory.intent = analysis.get("intent", "")
+    
+    # Merge themes (don't overwrite completely)
+    new_themes = analysis.get("themes", [])
+    memory.themes = list(set(memory.themes + new_themes))[:5]  # Keep top 5
+    
+    memory.last_analysis_count = msg_count
+    logger.info(f"[{session_id}] Updated memory: emotion={memory.emotion}, themes={memory.themes}")
+
+async def schedule_emotion_analysis(session_id: str, session: Dict):
+    """Queue emotion analysis (every 3 messages) on the background worker"""
+    msg_count = total_message_count(session)
+    if msg_count - session["memory"].last_analysis_count >= 3:
+        logger.info(f"[{session_id}] Scheduling emotion analysis at message {msg_count}")
+        emotion_worker.submit(session_id, lambda: run_emotion_analysis(session_id, session))
+
+# ---------- Rolling Conversation Summary ----------
+# Turns that fall out of the window are folded into memory.summary, so long
+# sessions send a small, roughly constant prompt while keeping earlier context
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+summarizer = ConversationSummarizer()
+summary_worker = CoalescingWorker("summary", debounce=float(os.getenv("SUMMARY_DEBOUNCE", "1.0")))
+
+async def run_summary_fold(session_id: str, session: Dict):
+    """Summarize only the newly evicted turns and drop them from the session"""
+    memory = session["memory"]
+    evict = len(session["messages"]) - CHAT_HISTORY_WINDOW
+    if evict <= 0:
+        return
+    
+    evicted = session["messages"][:evict]
+    evicted_before = memory.evicted_count
+    memory.summary = await summarizer.fold(memory.summary, evicted, session_id=session_id)
+    
+    # The hard cap may have dropped some of these while we were summarizing
+    already_dropped = memory.evicted_count - evicted_before
+    remaining = max(0, evict - already_dropped)
+    session["messages"] = session["messages"][remaining:]
+    memory.evicted_count += remaining
+    logger.info(f"[{session_id}] Folded {evict} messages into summary")
 
 # ---------- Background Task for AGI Call ----------
 async def call_agi_background(
@@ -304,7 +443,7 @@ async def call_agi_background(
         orchestrator = get_orchestrator(strategy="parallel")
         
         # Call AGI
-        response_text, metadata = await orchestrator.orchestrate(messages, strategy="parallel")
+        response_text, metadata = await orchestrator.orchestrate(messages, strategy="parallel", session_id=session_id)
         result = {"response": response_text, "metadata": metadata}
         
         # Store result
@@ -320,101 +459,237 @@ async def call_agi_background(
         result_container["status"] = "error"
         result_container["error"] = str(e)
 
+# ---------- Context Packing ----------
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "6000"))
+
+def retrieve_memories(session_id: str, session: Dict, query: str, top_k: int = 5) -> List[str]:
+    """Relevant quantum memories that are no longer in the session's recent turns"""
+    recent = {m.get("content") for m in session["messages"]}
+    nodes = get_quantum_memory(session_id).search(query, layers=["short_term", "long_term", "meta"], top_k=top_k)
+    return [
+        f"[{node.timestamp.strftime('%Y-%m-%d %H:%M')}] {node.content}"
+        for node in nodes
+        if node.content not in recent
+    ]
+
+# ---------- Chat Turn Helpers ----------
+async def prepare_chat_turn(req: ChatReq) -> Dict:
+    """
+    Record the user message, run the pre-flight stages and build the AGI messages
+    Shared by /api/chat and /api/chat/stream
+    """
+    # Get or create session
+    session_id, session = get_or_create_session(req.session_id)
+    
+    # Add user message to session
+    user_msg = req.messages[-1]
+    session["messages"].append(user_msg.dict())
+    get_quantum_memory(session_id).add_message("user", user_msg.content)
+    
+    # Run the independent pre-flight stages concurrently
+    stages = []
+    user_text = user_msg.content.lower()
+    if any(keyword in user_text for keyword in CALENDAR_KEYWORDS):
+        calendar_deadline = asyncio.get_running_loop().time() + CALENDAR_STAGE_DEADLINE
+        stages.append(PipelineStage(
+            name="calendar",
+            run=lambda: calendar_stage(session_id, user_msg.content, calendar_deadline),
+            deadline=CALENDAR_STAGE_DEADLINE
+        ))
+    
+    stages.append(PipelineStage(
+        name="search",
+        run=lambda: search_stage(session_id, user_msg.content),
+        deadline=SEARCH_STAGE_DEADLINE
+    ))
+    
+    stage_results = await ChatPipeline(session_id).run(stages)
+    
+    calendar_result = stage_results["calendar"].value if "calendar" in stage_results else None
+    search_info = stage_results["search"].value
+    
+    # Per-turn context (emotion/themes come from the background analysis of earlier turns)
+    session_context = build_session_context(session)
+    
+    # Pack system prompt, context, search info, retrieved memories and recent turns into the token budget
+    packer = ContextPacker(budget=CHAT_CONTEXT_TOKEN_BUDGET)
+    packed = packer.pack(
+        CHAT_SYSTEM_PROMPT,
+        session["messages"],
+        search_info=search_info,
+        memories=retrieve_memories(session_id, session, user_msg.content),
+        context=session_context
+    )
+    messages_for_agi = packed.messages
+    logger.info(f"[{session_id}] Packed context: {packed.tokens}")
+    
+    return {
+        "session_id": session_id,
+        "session": session,
+        "messages_for_agi": messages_for_agi,
+        "calendar_result": calendar_result,
+        "search_info": search_info,
+        "tokens": packed.tokens,
+        "user_message": user_msg.content,
+        "latency_target": req.latency_target_ms / 1000 if req.latency_target_ms else None
+    }
+
+def finish_chat_turn(session_id: str, session: Dict, response_text: str, calendar_result: Optional[str]) -> str:
+    """Append the assistant reply (with calendar annotation) to the session history"""
+    # Add calendar result to response if available
+    if calendar_result:
+        response_text = response_text + calendar_result
+    
+    get_quantum_memory(session_id).add_message("assistant", response_text)
+    
+    # Add assistant message to session
+    session["messages"].append({
+        "role": "assistant",
+        "content": response_text
+    })
+    
+    # Fold turns beyond the window into the rolling summary (in the background)
+    if len(session["messages"]) > CHAT_HISTORY_WINDOW:
+        summary_worker.submit(session_id, lambda: run_summary_fold(session_id, session))
+    
+    # Hard cap in case summarization falls behind (keep last 50)
+    if len(session["messages"]) > 50:
+        overflow = len(session["messages"]) - 50
+        session["messages"] = session["messages"][-50:]
+        session["memory"].evicted_count += overflow
+        logger.warning(f"[{session_id}] Dropped {overflow} unsummarized messages")
+    
+    return response_text
+
+def memory_snapshot(session: Dict) -> Dict:
+    """Continuum Memory summary returned to the client"""
+    memory = session["memory"]
+    return {
+        "emotion": memory.emotion,
+        "themes": memory.themes,
+        "message_count": total_message_count(session)
+    }
+
+def sse_event(event: str, data: Dict) -> str:
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# ---------- Orchestration ----------
+# Non-streaming chat: "parallel" waits for every model, "race" answers with the first good one,
+# "adaptive" calls the model ranked best by live latency / error statistics,
+# "cascade" answers with the cheapest model and escalates only when its answer scores low,
+# "stateful" continues the session's provider-side conversation and uploads only the new turn
+CHAT_ORCHESTRATION_STRATEGY = os.getenv("CHAT_ORCHESTRATION_STRATEGY", "parallel")
+# Seconds a turn may spend on the models; provider calls still running then are cancelled
+CHAT_DEADLINE = float(os.getenv("CHAT_DEADLINE", "30"))
+# Seconds a streamed answer may take in total; longer answers are cut off
+CHAT_STREAM_DEADLINE = float(os.getenv("CHAT_STREAM_DEADLINE", "120"))
+
+# ---------- Response Cache ----------
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+response_cache = SemanticResponseCache(
+    embedder=openai_embedder(os.getenv("RESPONSE_CACHE_EMBEDDING_MODEL", "text-embedding-3-small")),
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+    search_ttl=float(os.getenv("RESPONSE_CACHE_SEARCH_TTL", "300")),
+    similarity_threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+)
+
+def turn_is_cacheable(turn: Dict) -> bool:
+    return RESPONSE_CACHE_ENABLED and is_cacheable(turn["user_message"])
+
+async def orchestrate_with_cache(turn: Dict, deadline: Optional[float] = None) -> tuple[str, Dict]:
+    """Answer from the semantic response cache, or orchestrate and cache the answer"""
+    embedding = None
+    cacheable = turn_is_cacheable(turn)
+    if cacheable:
+        entry, embedding = await response_cache.lookup(turn["user_message"], turn["messages_for_agi"])
+        if entry is not None:
+            logger.info(f"[{turn['session_id']}] Response cache hit")
+            return entry.response, {**entry.metadata, "cache": "hit"}
+    
+    orchestrator = get_orchestrator(strategy=CHAT_ORCHESTRATION_STRATEGY)
+    response_text, metadata = await orchestrator.orchestrate(
+        turn["messages_for_agi"],
+        strategy=CHAT_ORCHESTRATION_STRATEGY,
+        session_id=turn["session_id"],
+        latency_target=turn["latency_target"],
+        deadline=deadline
+    )
+    
+    if cacheable and "error" not in metadata:
+        # Store without holding up the reply (may need an embedding call)
+        run_after_turn(response_cache.store(
+            turn["user_message"],
+            turn["messages_for_agi"],
+            response_text,
+            metadata,
+            used_search=bool(turn["search_info"]),
+            embedding=embedding
+        ))
+    return response_text, metadata
+
+# ---------- Request Coordination ----------
+request_coordinator = SessionRequestCoordinator(
+    max_queue_depth=int(os.getenv("CHAT_SESSION_QUEUE_DEPTH", "3")),
+    result_ttl=float(os.getenv("CHAT_IDEMPOTENCY_TTL", "300"))
+)
+
+# Post-turn work runs as its own task, not on one request's BackgroundTasks:
+# the turn is shared by every retry with the same idempotency key and must
+# finish its follow-up work even if the request that started it is gone
+post_turn_tasks: Set[asyncio.Task] = set()
+
+def _post_turn_done(task: asyncio.Task):
+    post_turn_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Post-turn task failed: {task.exception()}")
+
+def run_after_turn(coro: Awaitable) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    post_turn_tasks.add(task)
+    task.add_done_callback(_post_turn_done)
+    return task
+
+def check_token_budget(session_id: Optional[str]):
+    """Reject the turn up front instead of failing halfway through its LLM calls"""
+    try:
+        get_llm_gateway().usage.check_budget(session_id)
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+def session_queue_key(req: ChatReq) -> str:
+    """Requests without a session can't collide with each other"""
+    return req.session_id or req.idempotency_key or str(uuid.uuid4())
+
 # ---------- Chat Endpoint ----------
 @app.post("/api/chat", response_model=ChatRes, dependencies=[Depends(require_login)])
-async def chat(req: ChatReq, background_tasks: BackgroundTasks):
+async def chat(req: ChatReq):
     """Chat endpoint with background task processing"""
+    check_token_budget(req.session_id)
     try:
-        # Get or create session
-        session_id, session = get_or_create_session(req.session_id)
-        
-        # Add user message to session
-        user_msg = req.messages[-1]
-        session["messages"].append(user_msg.dict())
-        
-        # Check if message is calendar-related and process it
-        calendar_result = None
-        user_text = user_msg.content.lower()
-        calendar_keywords = ["予定", "スケジュール", "カレンダー", "登録", "追加", "明日", "今日", "来週", "病院", "会議"]
-        if any(keyword in user_text for keyword in calendar_keywords):
-            try:
-                import oreza_calendar_v2 as cal_v2
-                parsed = cal_v2.parse_natural_language(user_msg.content)
-                if "error" not in parsed:
-                    event = cal_v2.create_event(parsed)
-                    calendar_result = f"\n\n📅 カレンダーに予定を追加しました：\n- {event.title}\n- 日時: {event.start_datetime}\n- カレンダー: {cal_v2.calendars_db.get(event.calendar_id, {}).name if event.calendar_id in cal_v2.calendars_db else '不明'}"
-            except Exception as e:
-                logger.warning(f"Calendar sync attempt failed: {e}")
-        
-        # Check if we need to analyze emotion (every 3 messages)
-        msg_count = len(session["messages"])
-        memory = session["memory"]
-        
-        if msg_count - memory.last_analysis_count >= 3:
-            logger.info(f"[{session_id}] Triggering emotion analysis at message {msg_count}")
-            try:
-                analysis = await analyze_emotion_and_themes(session["messages"])
-                memory.emotion = analysis.get("emotion", "neutral")
-                memory.intent = analysis.get("intent", "")
-                
-                # Merge themes (don't overwrite completely)
-                new_themes = analysis.get("themes", [])
-                memory.themes = list(set(memory.themes + new_themes))[:5]  # Keep top 5
-                
-                memory.last_analysis_count = msg_count
-                logger.info(f"[{session_id}] Updated memory: emotion={memory.emotion}, themes={memory.themes}")
-            except Exception as e:
-                logger.error(f"[{session_id}] Emotion analysis failed: {e}")
-        
-        # Build system prompt
-        system_prompt = build_enhanced_system_prompt(session)
-        
-        # Check if auto-search is needed
-        search_info = None
-        try:
-            search_decision = await auto_search.should_search(user_msg.content)
-            if search_decision.get("should_search", False):
-                query = search_decision.get("query", "")
-                logger.info(f"[{session_id}] Auto-search triggered: {query}")
-                
-                # Perform Google search
-                search_results = google_search.search(query, num_results=1)
-                
-                if search_results and len(search_results) > 0:
-                    first_result = search_results[0]
-                    page_url = first_result.get("link", "")
-                    
-                    # Fetch page content
-                    page_content = await auto_search.fetch_page_content(page_url)
-                    
-                    if page_content:
-                        # Generate answer from page content
-                        search_answer = await auto_search.generate_answer_with_search(
-                            user_msg.content, query, page_content, page_url
-                        )
-                        search_info = search_answer
-                        logger.info(f"[{session_id}] Auto-search completed successfully")
-        except Exception as e:
-            logger.error(f"[{session_id}] Auto-search failed: {e}")
-        
-        # Prepare messages for AGI
-        messages_for_agi = [{"role": "system", "content": system_prompt}]
-        
-        # Add search info to context if available
-        if search_info:
-            messages_for_agi.append({
-                "role": "system",
-                "content": f"検索結果から取得した情報:\n{search_info}\n\nこの情報を参考にして、ユーザーの質問に答えてください。"
-            })
-        
-        messages_for_agi.extend(session["messages"][-10:])  # Last 10 messages for context
+        return await request_coordinator.run(
+            session_queue_key(req),
+            req.idempotency_key,
+            lambda: chat_turn(req)
+        )
+    except SessionQueueFull:
+        raise HTTPException(status_code=429, detail="Too many pending requests for this session")
+
+async def chat_turn(req: ChatReq) -> ChatRes:
+    """One chat turn; runs in the session's turn via the request coordinator"""
+    try:
+        turn = await prepare_chat_turn(req)
+        session_id = turn["session_id"]
+        session = turn["session"]
         
-        # Call AGI with timeout
+        # Call AGI with timeout; provider calls get the deadline so they are cut off in time,
+        # wait_for also bounds the response cache lookup
         try:
-            orchestrator = get_orchestrator(strategy="parallel")
+            deadline = asyncio.get_running_loop().time() + CHAT_DEADLINE
             response_text, metadata = await asyncio.wait_for(
-                orchestrator.orchestrate(messages_for_agi, strategy="parallel"),
-                timeout=30.0
+                orchestrate_with_cache(turn, deadline),
+                timeout=CHAT_DEADLINE
             )
             result = {"response": response_text, "metadata": metadata}
             
@@ -432,34 +707,125 @@ async def chat(req: ChatReq, background_tasks: BackgroundTasks):
             response_text = f"申し訳ございません。エラーが発生しました: {str(e)}"
             provider = "error"
         
-        # Add calendar result to response if available
-        if calendar_result:
-            response_text = response_text + calendar_result
-        
-        # Add assistant message to session
-        session["messages"].append({
-            "role": "assistant",
-            "content": response_text
-        })
-        
-        # Trim messages if too many (keep last 50)
-        if len(session["messages"]) > 50:
-            session["messages"] = session["messages"][-50:]
+        response_text = finish_chat_turn(session_id, session, response_text, turn["calendar_result"])
+        await schedule_emotion_analysis(session_id, session)
         
         return ChatRes(
             response=response_text,
             session_id=session_id,
-            memory={
-                "emotion": memory.emotion,
-                "themes": memory.themes,
-                "message_count": len(session["messages"])
-            }
+            memory=memory_snapshot(session),
+            tokens=turn["tokens"]
         )
         
     except Exception as e:
         logger.error(f"Chat endpoint error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+# ---------- Streaming Chat Endpoint (SSE) ----------
+@app.post("/api/chat/stream", dependencies=[Depends(require_login)])
+async def chat_stream(req: ChatReq):
+    """
+    Chat endpoint that streams tokens as Server-Sent Events
+    Events: token, calendar, search, done (or error)
+    """
+    check_token_budget(req.session_id)
+    session_key = session_queue_key(req)
+    try:
+        request_coordinator.check_capacity(session_key)
+    except SessionQueueFull:
+        raise HTTPException(status_code=429, detail="Too many pending requests for this session")
+    
+    async def event_generator():
+        # Hold the session's turn for the whole stream
+        try:
+            async with request_coordinator.session_slot(session_key):
+                async for event in stream_chat_turn(req):
+                    yield event
+        except SessionQueueFull:
+            yield sse_event("error", {"message": "Too many pending requests for this session"})
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"X-Accel-Buffering": "no"}
+    )
+
+async def stream_chat_turn(req: ChatReq) -> AsyncIterator[str]:
+    """SSE events for one streamed chat turn"""
+    try:
+        turn = await prepare_chat_turn(req)
+    except Exception as e:
+        logger.error(f"Chat stream endpoint error: {e}", exc_info=True)
+        yield sse_event("error", {"message": f"申し訳ございません。エラーが発生しました: {str(e)}"})
+        return
+    
+    session_id = turn["session_id"]
+    session = turn["session"]
+    
+    chunks = []
+    metadata = {}
+    embedding = None
+    cacheable = turn_is_cacheable(turn)
+    try:
+        entry = None
+        if cacheable:
+            entry, embedding = await response_cache.lookup(turn["user_message"], turn["messages_for_agi"])
+        if entry is not None:
+            logger.info(f"[{session_id}] Response cache hit")
+            chunks.append(entry.response)
+            metadata = {**entry.metadata, "cache": "hit"}
+            yield sse_event("token", {"content": entry.response})
+        else:
+            orchestrator = get_orchestrator(strategy="parallel")
+            deadline = asyncio.get_running_loop().time() + CHAT_STREAM_DEADLINE
+            async for event in orchestrator.orchestrate_stream(
+                turn["messages_for_agi"], session_id=session_id, deadline=deadline
+            ):
+                if event["type"] == "token":
+                    chunks.append(event["content"])
+                    yield sse_event("token", {"content": event["content"]})
+                elif event["type"] == "done":
+                    metadata = event.get("metadata", {})
+    except Exception as e:
+        logger.error(f"[{session_id}] AGI stream failed: {e}")
+        metadata = {"error": str(e)}
+        yield sse_event("error", {"message": f"申し訳ございません。エラーが発生しました: {str(e)}"})
+    
+    response_text = "".join(chunks)
+    if not response_text:
+        response_text = "申し訳ございません。一時的なエラーが発生しました。"
+        metadata.setdefault("error", "empty_response")
+    
+    # Streamed reply lands in the session history like /api/chat
+    finish_chat_turn(session_id, session, response_text, turn["calendar_result"])
+    logger.info(f"[{session_id}] AGI stream completed from {metadata.get('selected_model', 'unknown')}")
+    
+    # Trailing annotations
+    if turn["calendar_result"]:
+        yield sse_event("calendar", {"content": turn["calendar_result"]})
+    if turn["search_info"]:
+        yield sse_event("search", {"content": turn["search_info"]})
+    
+    yield sse_event("done", {
+        "session_id": session_id,
+        "memory": memory_snapshot(session),
+        "metadata": metadata,
+        "tokens": turn["tokens"]
+    })
+    
+    await schedule_emotion_analysis(session_id, session)
+    
+    if cacheable and "error" not in metadata and metadata.get("cache") != "hit":
+        await response_cache.store(
+            turn["user_message"],
+            turn["messages_for_agi"],
+            "".join(chunks),
+            metadata,
+            used_search=bool(turn["search_info"]),
+            embedding=embedding
+        )
+
+
 # ---------- Search Endpoint ----------
 @app.post("/api/search", dependencies=[Depends(require_login)])
 async def search(req: SearchReq):
@@ -528,15 +894,14 @@ async def analyze_search_results(req: SearchAnalysisReq):
 自然で読みやすい文章で回答してください。"""
         
         # Call AI for analysis
-        from openai import OpenAI
-        client = OpenAI()
-        
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
+        response = await get_llm_gateway().chat(
+            [
                 {"role": "system", "content": "あなたはユーザー専属のAIアシスタントです。検索結果を分析し、ユーザーに価値ある情報を提供します。"},
                 {"role": "user", "content": analysis_prompt}
             ],
+            model="gpt-4.1-mini",
+            call_site="search_analysis",
+            session_id=session_id,
             temperature=0.7
         )
         
@@ -564,20 +929,18 @@ async def analyze_image(req: ImageAnalysisReq):
         # Get or create session
         session_id, session = get_or_create_session(req.session_id)
         
-        # Use OpenAI client (Manus integrated)
-        from openai import OpenAI
-        client = OpenAI()  # Manus environment auto-configures API key and base URL
-        
         # Analyze image with GPT-4 Vision
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",  # Manus supported model
-            messages=[{
+        response = await get_llm_gateway().chat(
+            [{
                 "role": "user",
                 "content": [
                     {"type": "text", "text": "この画像について詳しく説明してください。何が写っていますか？特徴や詳細を教えてください。"},
                     {"type": "image_url", "image_url": {"url": req.image_data}}
                 ]
             }],
+            model="gpt-4.1-mini",  # Manus supported model
+            call_site="image_analysis",
+            session_id=session_id,
             max_tokens=500
         )
         
@@ -597,6 +960,73 @@ async def analyze_image(req: ImageAnalysisReq):
         logger.error(f"Image analysis error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ---------- Metrics Endpoint ----------
+@app.get("/api/metrics", dependencies=[Depends(require_login)])
+async def get_metrics():
+    """Performance counters for tuning the chat pipeline"""
+    return {
+        "search_router": search_router.get_stats(),
+        "emotion_worker": emotion_worker.get_stats(),
+        "summary_worker": summary_worker.get_stats(),
+        "response_cache": response_cache.get_stats(),
+        "request_coordinator": request_coordinator.get_stats(),
+        "llm_gateway": get_llm_gateway().get_stats(),
+        "orchestrator": get_orchestrator().get_stats(),
+        "loop_monitor": loop_monitor.get_stats() if loop_monitor else None,
+        "prompt_cache": {
+            "cached_share": {
+                site: usage["cached_share"]
+                for site, usage in get_llm_gateway().usage.get_stats()["by_call_site"].items()
+            },
+            "layouts": {"calendar_dispatch_parse": CALENDAR_LAYOUT.get_stats()}
+        }
+    }
+
+# ---------- Provider Admin Endpoints ----------
+class ProviderUpdateReq(BaseModel):
+    enabled: Optional[bool] = None
+    timeout: Optional[float] = None  # Seconds
+
+@app.get("/api/admin/providers", dependencies=[Depends(require_login)])
+async def list_providers():
+    """Registered AGI providers and their state"""
+    return get_orchestrator().registry.get_stats()
+
+@app.post("/api/admin/providers/{name}", dependencies=[Depends(require_login)])
+async def update_provider(name: str, req: ProviderUpdateReq):
+    """Enable / disable a provider or change its timeout without a redeploy"""
+    registry = get_orchestrator().registry
+    try:
+        if req.enabled is not None:
+            registry.set_enabled(name, req.enabled)
+        if req.timeout is not None:
+            registry.set_timeout(name, req.timeout)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return registry.get_stats()[name]
+
+# ---------- LLM Usage Endpoints ----------
+class UsageBudgetReq(BaseModel):
+    session_id: str
+    tokens: Optional[int] = None  # None restores the default budget
+
+@app.get("/api/usage", dependencies=[Depends(require_login)])
+async def get_usage(session_id: Optional[str] = None):
+    """LLM tokens, cost and latency per call site and model, or for one session"""
+    usage = get_llm_gateway().usage
+    if session_id:
+        return {"session_id": session_id, "usage": usage.get_session_usage(session_id)}
+    return usage.get_stats()
+
+@app.post("/api/usage/budget", dependencies=[Depends(require_login)])
+async def set_usage_budget(req: UsageBudgetReq):
+    """Set a per-session token budget"""
+    usage = get_llm_gateway().usage
+    usage.set_budget(req.session_id, req.tokens)
+    return {"session_id": req.session_id, "usage": usage.get_session_usage(req.session_id)}
+
 # ---------- Ping Endpoint (Keep-Alive) ----------
 @app.post("/api/ping")
 async def ping():
@@ -679,6 +1109,7 @@ class ProductAnalysisReq(BaseModel):
     product_title: str
     product_price: str
     user_context: Optional[str] = None
+    session_id: Optional[str] = None
 
 class FashionFitReq(BaseModel):
     product_url: str
@@ -687,6 +1118,7 @@ class FashionFitReq(BaseModel):
     body_type: str = "標準"
     style_preference: str = "カジュアル"
     size_concerns: str = "なし"
+    session_id: Optional[str] = None
 
 @app.post("/api/shopping/search")
 async def shopping_search(req: ProductSearchReq):
@@ -739,7 +1171,7 @@ async def shopping_analyze(req: ProductAnalysisReq):
         )
         
         # Analyze product
-        analysis = await shopping_sommelier.analyze_product(product, req.user_context)
+        analysis = await shopping_sommelier.analyze_product(product, req.user_context, session_id=req.session_id)
         
         return {"analysis": analysis}
         
@@ -772,7 +1204,7 @@ async def shopping_fashion_fit(req: FashionFitReq):
         }
         
         # Analyze fashion fit
-        analysis = await shopping_sommelier.analyze_fashion_fit(product, user_profile)
+        analysis = await shopping_sommelier.analyze_fashion_fit(product, user_profile, session_id=req.session_id)
         
         return {"analysis": analysis}
         
@@ -821,7 +1253,7 @@ async def parse_natural_language(req: dict):
         if not text:
             raise HTTPException(status_code=400, detail="Text is required")
         
-        parsed = oreza_calendar.parse_natural_language(text)
+        parsed = await oreza_calendar.parse_natural_language(text)
         
         # Create event or task
         if parsed.get("type") == "event":
@@ -873,7 +1305,7 @@ async def create_from_search(req: dict):
         if not title or not url:
             raise HTTPException(status_code=400, detail="Title and URL are required")
         
-        parsed = oreza_calendar.parse_search_result(title, url, snippet)
+        parsed = await oreza_calendar.parse_search_result(title, url, snippet)
         
         # Create event or task
         if parsed.get("type") == "event":
@@ -1013,7 +1445,7 @@ async def ai_calendar_dispatch(req: dict):
             raise HTTPException(status_code=400, detail="user_input is required")
         
         # 自然文 → JSON変換
-        parsed = parse_nl_for_calendar(user_input, context)
+        parsed = await parse_nl_for_calendar(user_input, context)
         
         if parsed.get("intent") == "UNKNOWN":
             return {
@@ -1215,12 +1647,13 @@ if __name__ == "__main__":
 # ---------- URL Summarizer Endpoint ----------
 class URLSummaryReq(BaseModel):
     url: str
+    session_id: Optional[str] = None
 
 @app.post("/api/url/summarize", dependencies=[Depends(require_login)])
 async def summarize_url(req: URLSummaryReq):
     """Summarize URL content with AI and safety check"""
     try:
-        result = await url_summarizer.summarize_url(req.url)
+        result = await url_summarizer.summarize_url(req.url, session_id=req.session_id)
         return result
     except Exception as e:
         logger.error(f"URL summarization error: {e}")
@@ -0,0 +1,62 @@
+"""
+Coalescing Background Worker
+Runs per-key jobs off the request path; submissions that arrive while a job
+for the same key is queued or running are merged into a single follow-up run
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict
+
+logger = logging.getLogger("background_worker")
+
+JobFactory = Callable[[], Awaitable[None]]
+
+class CoalescingWorker:
+    """
+    At most one job runs per key (e.g. session_id) at a time.
+    While a job is queued or running, newer submissions replace the pending
+    one, so a burst of messages collapses into one job on the latest state.
+    """
+
+    def __init__(self, name: str, debounce: float = 0.5):
+        self.name = name
+        self.debounce = debounce  # Seconds to wait for more submissions before running
+        self._pending: Dict[str, JobFactory] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.stats = {"submitted": 0, "coalesced": 0, "completed": 0, "failed": 0}
+
+    def submit(self, key: str, job: JobFactory):
+        """Queue a job for key, merging with any job already queued for it"""
+        self.stats["submitted"] += 1
+        if key in self._pending:
+            self.stats["coalesced"] += 1
+        self._pending[key] = job
+
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._drain(key))
+
+    async def _drain(self, key: str):
+        """Run queued jobs for key until none are left"""
+        try:
+            while True:
+                await asyncio.sleep(self.debounce)
+                job = self._pending.pop(key, None)
+                if job is None:
+                    break
+                try:
+                    await job()
+                    self.stats["completed"] += 1
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    logger.error(f"[{self.name}] Job for {key} failed: {e}")
+        finally:
+            self._tasks.pop(key, None)
+
+    def get_stats(self) -> Dict:
+        """Worker counters plus current queue state"""
+        return {
+            **self.stats,
+            "pending": len(self._pending),
+            "running": len(self._tasks)
+        }
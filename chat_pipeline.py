@@ -0,0 +1,87 @@
+"""
+Chat Pipeline Stage Scheduler
+Runs the independent /api/chat pre-flight stages concurrently,
+each under its own deadline
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger("chat_pipeline")
+
+@dataclass
+class PipelineStage:
+    """A single pre-flight stage (calendar, search, ...)"""
+    name: str
+    run: Callable[[], Awaitable[Any]]  # Coroutine factory
+    deadline: float  # Seconds before the stage is dropped
+
+@dataclass
+class StageResult:
+    """Outcome of a single stage"""
+    name: str
+    status: str  # "ok", "timeout", "error"
+    value: Any = None
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+class ChatPipeline:
+    """
+    Schedules pre-flight stages concurrently
+    A stage that misses its deadline is cancelled and dropped from the prompt
+    instead of holding up the response
+    """
+
+    def __init__(self, session_id: str = ""):
+        self.session_id = session_id
+
+    async def _run_stage(self, stage: PipelineStage) -> StageResult:
+        """Run one stage under its deadline"""
+        start = time.monotonic()
+        try:
+            value = await asyncio.wait_for(stage.run(), timeout=stage.deadline)
+            return StageResult(
+                name=stage.name,
+                status="ok",
+                value=value,
+                elapsed=time.monotonic() - start
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"[{self.session_id}] Stage '{stage.name}' missed its {stage.deadline}s deadline, dropped")
+            return StageResult(
+                name=stage.name,
+                status="timeout",
+                elapsed=time.monotonic() - start
+            )
+        except Exception as e:
+            logger.error(f"[{self.session_id}] Stage '{stage.name}' failed: {e}")
+            return StageResult(
+                name=stage.name,
+                status="error",
+                elapsed=time.monotonic() - start,
+                error=str(e)
+            )
+
+    async def run(self, stages: List[PipelineStage]) -> Dict[str, StageResult]:
+        """
+        Run all stages concurrently
+
+        Returns:
+            {stage_name: StageResult}
+        """
+        if not stages:
+            return {}
+
+        results = await asyncio.gather(*(self._run_stage(s) for s in stages))
+
+        timings = ", ".join(f"{r.name}={r.status}/{r.elapsed:.2f}s" for r in results)
+        logger.info(f"[{self.session_id}] Pre-flight stages: {timings}")
+
+        return {r.name: r for r in results}
@@ -0,0 +1,188 @@
+"""
+Context Packer
+Fills a token budget for the AGI call from the system prompt, search info,
+retrieved memories and recent turns, in that priority order, and emits them
+in prompt-cache order (see prompt_layout): static system prompt, history,
+then the per-turn context right before the latest turn
+"""
+
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("context_packer")
+
+DEFAULT_ENCODING = "o200k_base"  # gpt-4o / gpt-4.1 family
+MESSAGE_OVERHEAD_TOKENS = 4  # Per-message framing in the chat format
+TRUNCATION_MARKER = "…(省略)"
+
+_encoder = None
+_encoder_failed = False
+
+def _get_encoder():
+    """Load the tiktoken encoder once; None if tiktoken is unavailable"""
+    global _encoder, _encoder_failed
+    if _encoder is None and not _encoder_failed:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding(os.getenv("TOKENIZER_ENCODING", DEFAULT_ENCODING))
+        except Exception as e:
+            # tiktoken missing or encoding file not downloadable: fall back to estimates
+            _encoder_failed = True
+            logger.warning(f"tiktoken unavailable, using estimated token counts: {e}")
+    return _encoder
+
+def counter_name() -> str:
+    """Which token counter is in use"""
+    return "tiktoken" if _get_encoder() is not None else "estimate"
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text"""
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+
+    # Estimate: CJK characters are roughly one token each, ASCII about four characters per token
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+def count_message_tokens(message: Dict) -> int:
+    """Count tokens for a single chat message"""
+    return count_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Trim text so it fits in max_tokens"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+
+    encoder = _get_encoder()
+    if encoder is not None:
+        tokens = encoder.encode(text)
+        return encoder.decode(tokens[:max(0, max_tokens - count_tokens(TRUNCATION_MARKER))]) + TRUNCATION_MARKER
+
+    # Binary search on characters for the estimator
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid] + TRUNCATION_MARKER) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + TRUNCATION_MARKER
+
+@dataclass
+class PackedContext:
+    """Result of packing: messages for the AGI plus per-section token counts"""
+    messages: List[Dict]
+    tokens: Dict = field(default_factory=dict)
+
+class ContextPacker:
+    """
+    Packs prompt sections into a token budget
+
+    Priority:
+    1. System prompt and session context (always)
+    2. Latest user turn (always, truncated if it alone exceeds the budget)
+    3. Search info
+    4. Retrieved memories (capped at memory_share of the budget)
+    5. Older turns, newest first, until the budget is used up
+    """
+
+    def __init__(self, budget: int = 6000, reserved: int = 0, memory_share: float = 0.15):
+        self.budget = budget
+        self.reserved = reserved  # Tokens added downstream, outside the packed messages
+        self.memory_share = memory_share  # Max share of the budget for retrieved memories
+
+    def pack(
+        self,
+        system_prompt: str,
+        turns: List[Dict],
+        search_info: Optional[str] = None,
+        memories: Optional[List[str]] = None,
+        context: Optional[str] = None
+    ) -> PackedContext:
+        """
+        system_prompt must not change between turns; per-turn text (emotion,
+        themes, summary) goes in context so the cached prefix stays valid
+        """
+        remaining = self.budget - self.reserved
+        tokens = {"budget": self.budget, "reserved": self.reserved}
+
+        # 1. System prompt
+        system_msg = {"role": "system", "content": system_prompt}
+        tokens["system"] = count_message_tokens(system_msg)
+        remaining -= tokens["system"]
+
+        context_msgs = []
+        tokens["context"] = 0
+        if context:
+            context_msgs = [{"role": "system", "content": context}]
+            tokens["context"] = count_message_tokens(context_msgs[0])
+            remaining -= tokens["context"]
+
+        # 2. Latest turn
+        latest = []
+        if turns:
+            last = dict(turns[-1])
+            last_tokens = count_message_tokens(last)
+            if last_tokens > remaining:
+                last["content"] = truncate_to_tokens(last["content"], remaining - MESSAGE_OVERHEAD_TOKENS)
+                last_tokens = count_message_tokens(last)
+                logger.info(f"Latest turn truncated to {last_tokens} tokens")
+            latest = [last]
+            remaining -= last_tokens
+
+        # 3. Search info
+        search_msgs = []
+        tokens["search"] = 0
+        if search_info and remaining > MESSAGE_OVERHEAD_TOKENS:
+            content = f"検索結果から取得した情報:\n{search_info}\n\nこの情報を参考にして、ユーザーの質問に答えてください。"
+            search_msg = {"role": "system", "content": truncate_to_tokens(content, remaining - MESSAGE_OVERHEAD_TOKENS)}
+            tokens["search"] = count_message_tokens(search_msg)
+            remaining -= tokens["search"]
+            search_msgs = [search_msg]
+
+        # 4. Retrieved memories not already present in the recent turns
+        memory_msgs = []
+        tokens["memories"] = 0
+        if memories:
+            recent = {t.get("content") for t in turns}
+            memory_budget = min(remaining, int(self.budget * self.memory_share))
+            lines = ["関連する記憶:"]
+            used = count_tokens(lines[0]) + MESSAGE_OVERHEAD_TOKENS
+            for memory in memories:
+                if memory in recent:
+                    continue
+                t = count_tokens(memory) + 1
+                if used + t > memory_budget:
+                    break
+                lines.append(memory)
+                used += t
+            if len(lines) > 1:
+                memory_msgs = [{"role": "system", "content": "\n".join(lines)}]
+                tokens["memories"] = count_message_tokens(memory_msgs[0])
+                remaining -= tokens["memories"]
+
+        # 5. Older turns, newest first (contiguous, stop at the first that doesn't fit)
+        history = []
+        for turn in reversed(turns[:-1]):
+            t = count_message_tokens(turn)
+            if t > remaining:
+                break
+            history.insert(0, turn)
+            remaining -= t
+        tokens["turns"] = sum(count_message_tokens(t) for t in history + latest)
+        tokens["turns_included"] = len(history) + len(latest)
+        tokens["turns_dropped"] = len(turns) - tokens["turns_included"]
+
+        tokens["total"] = tokens["system"] + tokens["context"] + tokens["search"] + tokens["memories"] + tokens["turns"]
+        tokens["counter"] = counter_name()
+
+        # Stable prefix first; everything that changes per turn sits at the end
+        messages = [system_msg] + history + context_msgs + search_msgs + memory_msgs + latest
+        return PackedContext(messages=messages, tokens=tokens)
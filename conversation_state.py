@@ -0,0 +1,145 @@
+"""
+Conversation State
+Per-session pointer to a provider-side conversation (Responses API
+previous_response_id). While the chain is valid, a turn uploads only the
+new user message plus system context the chain hasn't seen yet; otherwise
+the full packed conversation is sent and a new chain starts
+"""
+
+import time
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from context_packer import count_message_tokens
+
+logger = logging.getLogger("conversation_state")
+
+class ConversationStateExpired(Exception):
+    """The provider no longer has the response a turn tried to continue from"""
+    pass
+
+def _tokens(messages: List[Dict]) -> int:
+    return sum(count_message_tokens(m) for m in messages)
+
+def _fingerprint(message: Dict) -> str:
+    return hashlib.sha256(f"{message['role']}\n{message['content']}".encode("utf-8")).hexdigest()
+
+@dataclass
+class ConversationState:
+    """The provider-side chain of one session"""
+    model: str
+    response_id: str
+    last_reply: str  # Our last answer; the next turn's history must end with it
+    sent_context: Set[str] = field(default_factory=set)  # Fingerprints of system messages in the chain
+    turns: int = 1
+    updated_at: float = 0.0
+
+class ConversationStateStore:
+    """
+    Chains by session id
+    A chain is abandoned (full resend) when it is older than ttl, has
+    max_turns turns (the server-side history isn't trimmed by the context
+    packer), belongs to another model, or the local history no longer ends
+    with the chain's last answer (e.g. a turn was served from the response cache)
+    """
+
+    def __init__(self, ttl: float = 3600.0, max_turns: int = 20):
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self._states: Dict[str, ConversationState] = {}
+        self.stats = {
+            "turns": 0,
+            "continued": 0,
+            "full_sends": 0,
+            "expired": 0,  # Local TTL ran out
+            "turn_limit_resets": 0,
+            "history_mismatches": 0,
+            "server_expired": 0,  # Provider had dropped the response; resent in full
+            "tokens_sent": 0,
+            "tokens_full": 0  # What full resends of every turn would have uploaded
+        }
+
+    def _usable(self, session_id: str, model: str, messages: List[Dict]) -> Optional[ConversationState]:
+        state = self._states.get(session_id)
+        if state is None:
+            return None
+        if state.model != model:
+            return None
+        if time.monotonic() - state.updated_at > self.ttl:
+            self.stats["expired"] += 1
+            return None
+        if state.turns >= self.max_turns:
+            self.stats["turn_limit_resets"] += 1
+            return None
+        previous = next((m["content"] for m in reversed(messages[:-1]) if m["role"] == "assistant"), None)
+        if previous is None or not previous.startswith(state.last_reply):
+            self.stats["history_mismatches"] += 1
+            return None
+        return state
+
+    def plan(
+        self,
+        session_id: str,
+        model: str,
+        messages: List[Dict],
+        retry: bool = False
+    ) -> Tuple[List[Dict], Optional[str], Set[str]]:
+        """
+        Input for this turn's call
+        messages is the full packed conversation ending with the new user message;
+        retry=True when the same turn is planned again after the chain expired
+        Returns (input messages, previous_response_id or None, system fingerprints the chain will hold)
+        """
+        if not retry:
+            self.stats["turns"] += 1
+            self.stats["tokens_full"] += _tokens(messages)
+        state = self._usable(session_id, model, messages)
+
+        if state is None:
+            self._states.pop(session_id, None)
+            self.stats["full_sends"] += 1
+            self.stats["tokens_sent"] += _tokens(messages)
+            sent = {_fingerprint(m) for m in messages if m["role"] == "system"}
+            return messages, None, sent
+
+        # Only system context that changed since the chain saw it, then the new message
+        fresh = [
+            m for m in messages[:-1]
+            if m["role"] == "system" and _fingerprint(m) not in state.sent_context
+        ]
+        items = fresh + [messages[-1]]
+        self.stats["continued"] += 1
+        self.stats["tokens_sent"] += _tokens(items)
+        return items, state.response_id, state.sent_context | {_fingerprint(m) for m in fresh}
+
+    def save(self, session_id: str, model: str, response_id: str, reply: str, sent_context: Set[str], continued: bool):
+        state = self._states.get(session_id) if continued else None
+        self._states[session_id] = ConversationState(
+            model=model,
+            response_id=response_id,
+            last_reply=reply,
+            sent_context=sent_context,
+            turns=state.turns + 1 if state else 1,
+            updated_at=time.monotonic()
+        )
+
+    def expire(self, session_id: str):
+        """The provider rejected the chain; the retry of this turn counts as a full send"""
+        if self._states.pop(session_id, None) is not None:
+            self.stats["server_expired"] += 1
+            logger.info(f"[{session_id}] Provider-side conversation expired, resending in full")
+
+    def drop(self, session_id: str):
+        self._states.pop(session_id, None)
+
+    def get_stats(self) -> Dict:
+        full = self.stats["tokens_full"] or 1
+        return {
+            **self.stats,
+            "sessions": len(self._states),
+            "upload_saved_share": 1 - self.stats["tokens_sent"] / full if self.stats["tokens_full"] else 0.0,
+            "ttl": self.ttl,
+            "max_turns": self.max_turns
+        }
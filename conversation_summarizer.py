@@ -0,0 +1,54 @@
+"""
+Rolling Conversation Summarizer
+Folds turns that fall out of the chat window into ContinuumMemory.summary,
+summarizing only the newly evicted turns
+"""
+
+import logging
+from typing import Dict, List, Optional
+
+from llm_gateway import get_llm_gateway
+
+logger = logging.getLogger("conversation_summarizer")
+
+class ConversationSummarizer:
+    """Incremental summarizer: previous summary + evicted turns -> new summary"""
+
+    def __init__(self, model: str = "gpt-4.1-mini", max_chars: int = 400):
+        self.model = model
+        self.max_chars = max_chars
+
+    def _build_prompt(self, summary: str, evicted: List[Dict]) -> str:
+        conversation = "\n".join(f"{m['role']}: {m['content']}" for m in evicted)
+        return f"""あなたは会話の要約を更新するアシスタントです。
+
+これまでの要約:
+{summary or "(なし)"}
+
+要約に追加する会話:
+{conversation}
+
+これまでの要約に新しい会話の内容を統合し、更新された要約を{self.max_chars}文字以内で出力してください。
+ユーザーの目的、決定事項、好み、未解決の質問を優先して残してください。
+要約本文のみを出力してください。"""
+
+    async def fold(self, summary: str, evicted: List[Dict], session_id: Optional[str] = None) -> str:
+        """
+        Fold evicted turns into the running summary
+        Raises on failure so the caller keeps the turns for the next attempt
+        """
+        if not evicted:
+            return summary
+
+        response = await get_llm_gateway().chat(
+            [{"role": "user", "content": self._build_prompt(summary, evicted)}],
+            model=self.model,
+            call_site="conversation_summary",
+            session_id=session_id,
+            temperature=0.3,
+            max_tokens=600
+        )
+
+        new_summary = response.choices[0].message.content.strip()
+        logger.info(f"Folded {len(evicted)} turns into summary ({len(new_summary)} chars)")
+        return new_summary[:self.max_chars * 2]
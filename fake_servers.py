@@ -0,0 +1,446 @@
+"""
+Fake Servers
+Local stand-ins for the OpenAI and Google Custom Search APIs, for load tests
+that must not burn real quota:
+- POST /v1/chat/completions  (including streaming with stream_options.include_usage)
+- POST /v1/responses         (stored responses, continued with previous_response_id)
+- POST /v1/embeddings
+- GET  /customsearch/v1      (web and image search)
+- GET  /pages/{page_id}      (HTML pages the search results link to)
+Outputs are deterministic per request; latency follows a configurable
+distribution and errors are injected at a configurable rate
+
+Run:
+    python fake_servers.py --port 8900
+Point the app at it:
+    LLM_BASE_URL=http://127.0.0.1:8900/v1
+    GOOGLE_SEARCH_BASE_URL=http://127.0.0.1:8900/customsearch/v1
+    GOOGLE_API_KEY=fake GOOGLE_CSE_ID=fake
+"""
+
+import os
+import re
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import argparse
+import logging
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, fields
+from typing import AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+
+from context_packer import count_tokens
+
+logger = logging.getLogger("fake_servers")
+
+# Providers cache prompt prefixes from 1024 tokens on, in 128-token steps
+PREFIX_CACHE_MIN_TOKENS = 1024
+PREFIX_CACHE_BLOCK = 128
+
+# (pattern, content) for the app's JSON-returning prompts, checked in order
+DEFAULT_CANNED = [
+    (r"検索が必要かどうかを判断", '{"should_search": true, "query": "負荷試験 検索"}'),
+    (r"感情とテーマを抽出", '{"emotion": "neutral", "themes": ["テスト"], "intent": "負荷試験"}'),
+    (r"スケジュールAI", '{"intent": "LIST_AGENDA", "request_id": "req-fake", "payload": {}}'),
+    (r"予定・タスク抽出|予定・タスクを抽出", '{"type": "task", "title": "テストタスク", "due_date": "2030-01-01", "priority": "medium"}'),
+    (r"予定情報を抽出", '{"title": "テスト予定", "start_datetime": "2030-01-01 10:00", "location": "", "description": "", "is_all_day": false}'),
+    (r"商品について、AIソムリエとして分析", '{"strengths": ["テスト"], "silhouette": "", "cautions": "", "suitable_for": "", "not_suitable_for": "", "one_line_summary": "テスト商品"}'),
+    (r"ページのタイトル", '{"title": "テストページ", "summary": "負荷試験用のページです。", "safety": "safe", "safety_note": ""}'),
+]
+
+FILLER = "了解しました。これは負荷試験用の固定応答です。"
+
+@dataclass
+class Behavior:
+    """Latency / error / output settings for one API"""
+    latency_ms: float = 300.0  # Median time to the response (or first token)
+    latency_dist: str = "lognormal"  # lognormal / uniform / fixed
+    latency_sigma: float = 0.5  # lognormal: sigma of log-latency; uniform: +/- fraction of latency_ms
+    error_rate: float = 0.0  # Share of requests answered with error_status
+    error_status: int = 500
+    token_delay_ms: float = 15.0  # Streaming: delay between chunks
+    completion_chars: int = 200  # Length of default chat answers
+    embedding_dims: int = 1536
+
+    @classmethod
+    def from_env(cls, prefix: str, **defaults) -> "Behavior":
+        """Read <prefix>LATENCY_MS, <prefix>ERROR_RATE, ... over the given defaults"""
+        behavior = cls(**defaults)
+        for f in fields(cls):
+            value = os.getenv(prefix + f.name.upper())
+            if value is not None:
+                setattr(behavior, f.name, type(getattr(behavior, f.name))(value))
+        return behavior
+
+    def update(self, values: Dict):
+        for name, value in values.items():
+            if name in {f.name for f in fields(self)}:
+                setattr(self, name, type(getattr(self, name))(value))
+
+    def sample_latency(self, rng: random.Random) -> float:
+        """Seconds"""
+        median = self.latency_ms / 1000
+        if self.latency_dist == "fixed":
+            return median
+        if self.latency_dist == "uniform":
+            return max(0.0, rng.uniform(median * (1 - self.latency_sigma), median * (1 + self.latency_sigma)))
+        return median * math.exp(rng.gauss(0, self.latency_sigma))
+
+def digest(payload) -> str:
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def message_text(message: Dict) -> str:
+    """Text of a chat message (content may be a list of parts for vision requests)"""
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+class FakeServers:
+    """State shared by the fake endpoints: behaviour, RNG, prefix cache and counters"""
+
+    def __init__(
+        self,
+        llm: Optional[Behavior] = None,
+        search: Optional[Behavior] = None,
+        seed: Optional[int] = None,
+        public_url: str = "http://127.0.0.1:8900",
+        canned: Optional[List] = None,
+        response_ttl: float = 3600.0
+    ):
+        self.llm = llm or Behavior()
+        self.search = search or Behavior(latency_ms=150.0)
+        self.rng = random.Random(seed)
+        self.public_url = public_url.rstrip("/")
+        self.canned = [(re.compile(pattern), content) for pattern, content in (canned or DEFAULT_CANNED)]
+        self._prefixes: "OrderedDict[str, None]" = OrderedDict()
+        self.max_prefixes = 10000
+        # Stored responses: id -> (stored_at, conversation including the answer)
+        self._responses: "OrderedDict[str, tuple]" = OrderedDict()
+        self.response_ttl = response_ttl
+        self.max_responses = 10000
+        self.stats = {
+            "chat": 0,
+            "responses": 0,
+            "responses_continued": 0,
+            "responses_expired": 0,
+            "streams": 0,
+            "embeddings": 0,
+            "searches": 0,
+            "pages": 0,
+            "errors_injected": 0,
+            "prompt_tokens": 0,
+            "cached_prompt_tokens": 0
+        }
+
+    async def delay(self, behavior: Behavior):
+        await asyncio.sleep(behavior.sample_latency(self.rng))
+
+    def injected_error(self, behavior: Behavior) -> Optional[JSONResponse]:
+        if behavior.error_rate <= 0 or self.rng.random() >= behavior.error_rate:
+            return None
+        self.stats["errors_injected"] += 1
+        return JSONResponse(
+            status_code=behavior.error_status,
+            content={"error": {"message": "Injected fake error", "type": "server_error", "code": None}}
+        )
+
+    def answer(self, model: str, messages: List[Dict]) -> str:
+        """Canned JSON for known prompts, otherwise filler text tagged with the request digest"""
+        text = "\n".join(message_text(m) for m in messages)
+        for pattern, content in self.canned:
+            if pattern.search(text):
+                return content
+        tag = digest([model, messages])[:8]
+        body = (FILLER * (self.llm.completion_chars // len(FILLER) + 1))[:self.llm.completion_chars]
+        return f"[{model}:{tag}] {body}"
+
+    def cached_tokens(self, messages: List[Dict]) -> int:
+        """Longest previously seen message prefix, the way a provider prompt cache would count it"""
+        cached = 0
+        used = 0
+        running = hashlib.sha256()
+        for message in messages:
+            running.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+            used += count_tokens(message_text(message)) + 4
+            key = running.hexdigest()
+            if key in self._prefixes:
+                self._prefixes.move_to_end(key)
+                cached = used
+            else:
+                self._prefixes[key] = None
+        while len(self._prefixes) > self.max_prefixes:
+            self._prefixes.popitem(last=False)
+        if cached < PREFIX_CACHE_MIN_TOKENS:
+            return 0
+        return cached - cached % PREFIX_CACHE_BLOCK
+
+    def usage(self, messages: List[Dict], completion: str) -> Dict:
+        prompt_tokens = sum(count_tokens(message_text(m)) + 4 for m in messages)
+        cached = self.cached_tokens(messages)
+        completion_tokens = count_tokens(completion)
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["cached_prompt_tokens"] += cached
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached}
+        }
+
+    async def stream_chunks(self, model: str, content: str, usage: Optional[Dict]) -> AsyncIterator[str]:
+        completion_id = f"chatcmpl-fake-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        def chunk(delta: Dict, finish_reason: Optional[str] = None, choices: bool = True, **extra) -> str:
+            body = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if choices else [],
+                **extra
+            }
+            return f"data: {json.dumps(body, ensure_ascii=False)}\n\n"
+
+        yield chunk({"role": "assistant", "content": ""})
+        for start in range(0, len(content), 4):
+            await asyncio.sleep(self.llm.token_delay_ms / 1000)
+            yield chunk({"content": content[start:start + 4]})
+        yield chunk({}, finish_reason="stop")
+        if usage is not None:
+            yield chunk({}, choices=False, usage=usage)
+        yield "data: [DONE]\n\n"
+
+    def stored_conversation(self, response_id: str) -> Optional[List[Dict]]:
+        """Conversation behind a stored response; None once it is unknown or older than response_ttl"""
+        stored = self._responses.get(response_id)
+        if stored is None or time.monotonic() - stored[0] > self.response_ttl:
+            return None
+        return stored[1]
+
+    def store_response(self, response_id: str, messages: List[Dict]):
+        self._responses[response_id] = (time.monotonic(), messages)
+        while len(self._responses) > self.max_responses:
+            self._responses.popitem(last=False)
+
+    def get_stats(self) -> Dict:
+        prompt = self.stats["prompt_tokens"] or 1
+        return {
+            **self.stats,
+            "cached_share": self.stats["cached_prompt_tokens"] / prompt,
+            "llm": asdict(self.llm),
+            "search": asdict(self.search)
+        }
+
+def create_app(servers: Optional[FakeServers] = None) -> FastAPI:
+    servers = servers or FakeServers()
+    app = FastAPI(title="Oreza fake OpenAI / Google CSE")
+    app.state.servers = servers
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "gpt-4o-mini")
+        messages = body.get("messages", [])
+        await servers.delay(servers.llm)
+        error = servers.injected_error(servers.llm)
+        if error is not None:
+            return error
+
+        content = servers.answer(model, messages)
+        usage = servers.usage(messages, content)
+        if body.get("stream"):
+            servers.stats["streams"] += 1
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            return StreamingResponse(
+                servers.stream_chunks(model, content, usage if include_usage else None),
+                media_type="text/event-stream"
+            )
+
+        servers.stats["chat"] += 1
+        return {
+            "id": f"chatcmpl-fake-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+                "logprobs": None
+            }],
+            "usage": usage
+        }
+
+    @app.post("/v1/responses")
+    async def responses(request: Request):
+        body = await request.json()
+        model = body.get("model", "gpt-4o-mini")
+        items = body.get("input", [])
+        items = [{"role": "user", "content": items}] if isinstance(items, str) else items
+        await servers.delay(servers.llm)
+        error = servers.injected_error(servers.llm)
+        if error is not None:
+            return error
+
+        history = []
+        previous_id = body.get("previous_response_id")
+        if previous_id:
+            history = servers.stored_conversation(previous_id)
+            if history is None:
+                servers.stats["responses_expired"] += 1
+                return JSONResponse(status_code=400, content={"error": {
+                    "message": f"Previous response with id '{previous_id}' not found.",
+                    "type": "invalid_request_error",
+                    "param": "previous_response_id",
+                    "code": "previous_response_not_found"
+                }})
+            servers.stats["responses_continued"] += 1
+        messages = history + [{"role": m.get("role", "user"), "content": message_text(m)} for m in items]
+
+        servers.stats["responses"] += 1
+        content = servers.answer(model, messages)
+        # The provider bills the whole conversation, however little was uploaded
+        usage = servers.usage(messages, content)
+        response_id = f"resp_fake{uuid.uuid4().hex[:24]}"
+        if body.get("store", True):
+            servers.store_response(response_id, messages + [{"role": "assistant", "content": content}])
+        return {
+            "id": response_id,
+            "object": "response",
+            "created_at": time.time(),
+            "model": model,
+            "status": "completed",
+            "previous_response_id": previous_id,
+            "output": [{
+                "type": "message",
+                "id": f"msg_fake{uuid.uuid4().hex[:24]}",
+                "status": "completed",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": content, "annotations": []}]
+            }],
+            "parallel_tool_calls": True,
+            "tool_choice": "auto",
+            "tools": [],
+            "usage": {
+                "input_tokens": usage["prompt_tokens"],
+                "input_tokens_details": {"cached_tokens": usage["prompt_tokens_details"]["cached_tokens"]},
+                "output_tokens": usage["completion_tokens"],
+                "output_tokens_details": {"reasoning_tokens": 0},
+                "total_tokens": usage["total_tokens"]
+            }
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input", "")
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        await servers.delay(servers.llm)
+        error = servers.injected_error(servers.llm)
+        if error is not None:
+            return error
+
+        servers.stats["embeddings"] += 1
+        data = []
+        for index, text in enumerate(inputs):
+            # Same text, same unit vector
+            vector_rng = random.Random(int(digest(text)[:16], 16))
+            vector = [vector_rng.gauss(0, 1) for _ in range(servers.llm.embedding_dims)]
+            norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+            data.append({"object": "embedding", "index": index, "embedding": [x / norm for x in vector]})
+        tokens = sum(count_tokens(str(text)) for text in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        }
+
+    @app.get("/customsearch/v1")
+    async def custom_search(q: str = "", num: int = 10, searchType: Optional[str] = None):
+        await servers.delay(servers.search)
+        error = servers.injected_error(servers.search)
+        if error is not None:
+            return error
+
+        servers.stats["searches"] += 1
+        tag = digest(q)[:8]
+        items = []
+        for i in range(min(max(num, 1), 10)):
+            page_url = f"{servers.public_url}/pages/{tag}-{i}"
+            item = {
+                "kind": "customsearch#result",
+                "title": f"{q} - テスト結果 {i + 1}",
+                "link": page_url,
+                "displayLink": "fake.local",
+                "snippet": f"「{q}」に関する負荷試験用の検索結果 {i + 1} です。"
+            }
+            if searchType == "image":
+                item["link"] = f"{page_url}.png"
+                item["image"] = {"contextLink": page_url, "thumbnailLink": f"{page_url}.png", "width": 300, "height": 200}
+            items.append(item)
+        return {
+            "kind": "customsearch#search",
+            "queries": {"request": [{"searchTerms": q, "count": len(items)}]},
+            "searchInformation": {"totalResults": str(len(items))},
+            "items": items
+        }
+
+    @app.get("/pages/{page_id}", response_class=HTMLResponse)
+    async def page(page_id: str):
+        await servers.delay(servers.search)
+        servers.stats["pages"] += 1
+        paragraphs = "".join(f"<p>{FILLER}（{page_id} 段落 {i + 1}）</p>" for i in range(20))
+        return f"<html><head><title>テストページ {page_id}</title></head><body><h1>テストページ {page_id}</h1>{paragraphs}</body></html>"
+
+    @app.get("/fake/stats")
+    async def fake_stats():
+        return servers.get_stats()
+
+    @app.post("/fake/config")
+    async def fake_config(request: Request):
+        """Change behaviour mid-run, e.g. {"llm": {"error_rate": 0.2}}"""
+        body = await request.json()
+        servers.llm.update(body.get("llm", {}))
+        servers.search.update(body.get("search", {}))
+        return servers.get_stats()
+
+    return app
+
+def servers_from_env(public_url: str) -> FakeServers:
+    canned = None
+    canned_path = os.getenv("FAKE_LLM_CANNED")
+    if canned_path:
+        # JSON list of {"match": regex, "content": answer}, checked before the defaults
+        with open(canned_path, encoding="utf-8") as f:
+            canned = [(rule["match"], rule["content"]) for rule in json.load(f)] + DEFAULT_CANNED
+    seed = os.getenv("FAKE_SEED")
+    return FakeServers(
+        llm=Behavior.from_env("FAKE_LLM_"),
+        search=Behavior.from_env("FAKE_SEARCH_", latency_ms=150.0),
+        seed=int(seed) if seed else None,
+        public_url=public_url,
+        canned=canned,
+        response_ttl=float(os.getenv("FAKE_RESPONSE_TTL", "3600"))
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI and Google Custom Search servers for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    args = parser.parse_args()
+
+    import uvicorn
+    logging.basicConfig(level=logging.INFO)
+    public_url = os.getenv("FAKE_PUBLIC_URL", f"http://{args.host}:{args.port}")
+    uvicorn.run(create_app(servers_from_env(public_url)), host=args.host, port=args.port, log_level="warning")
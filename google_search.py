@@ -13,7 +13,8 @@ class GoogleSearch:
     """Google Custom Search API wrapper"""
     
     def __init__(self):
-        self.base_url = "https://www.googleapis.com/customsearch/v1"
+        # Overridable to point load tests at fake_servers.py
+        self.base_url = os.getenv("GOOGLE_SEARCH_BASE_URL", "https://www.googleapis.com/customsearch/v1")
         self.api_key = os.getenv("GOOGLE_API_KEY")
         self.cx = os.getenv("GOOGLE_CSE_ID")
         
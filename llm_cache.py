@@ -0,0 +1,191 @@
+"""
+LLM Result Cache
+Persistent cache for deterministic (low-temperature extraction) LLM calls.
+Key: sha256 of model + messages + parameters.
+Stored in SQLite (WAL) so results survive restarts and are shared across
+uvicorn workers; identical concurrent requests share one upstream call
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger("llm_cache")
+
+# Default TTL (seconds) per call site; override with LLM_CACHE_TTL_<CALL_SITE>
+CALL_SITE_TTLS = {
+    "calendar_dispatch_parse": 3600,  # Prompt carries the current minute
+    "calendar_parse_v2": 3600,
+    "calendar_parse": 3600,
+    "calendar_from_search": 86400,
+    "should_search": 3600,
+    "summarize_url": 21600,
+    "sommelier_analyze": 604800,  # Filled in bulk by shopping_batch.py
+}
+DEFAULT_TTL = 3600
+
+# Parameters that don't change the result
+NON_KEY_PARAMS = {"timeout"}
+
+def ttl_for(call_site: str) -> float:
+    """TTL for a call site"""
+    env = os.getenv(f"LLM_CACHE_TTL_{call_site.upper()}")
+    if env:
+        return float(env)
+    return CALL_SITE_TTLS.get(call_site, DEFAULT_TTL)
+
+def make_key(model: str, messages: List[Dict], params: Dict) -> str:
+    """Stable hash of everything that determines the completion"""
+    payload = {
+        "model": model,
+        "messages": messages,
+        "params": {k: v for k, v in params.items() if k not in NON_KEY_PARAMS}
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class LLMResultCache:
+    """SQLite-backed result cache with in-process single-flight"""
+
+    def __init__(self, path: str = "./data/llm_cache.db"):
+        self.path = path
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._initialized = False
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "stores": 0,
+            "expired": 0,
+            "errors": 0,
+            "by_call_site": {}
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")  # Concurrent readers across workers
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, call_site TEXT, value TEXT, "
+                "created_at REAL, expires_at REAL)"
+            )
+            conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def _get_sync(self, key: str) -> Optional[str]:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at < time.time():
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                conn.commit()
+                self.stats["expired"] += 1
+                return None
+            return value
+        finally:
+            conn.close()
+
+    def _set_sync(self, key: str, call_site: str, value: str, ttl: float):
+        conn = self._connect()
+        try:
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, call_site, value, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, call_site, value, now, now + ttl)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    async def get(self, key: str) -> Optional[str]:
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(None, self._get_sync, key)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"LLM cache read failed: {e}")
+            return None
+
+    async def set(self, key: str, call_site: str, value: str, ttl: float):
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self._set_sync, key, call_site, value, ttl)
+            self.stats["stores"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"LLM cache write failed: {e}")
+
+    def _count(self, call_site: str, outcome: str):
+        site = self.stats["by_call_site"].setdefault(call_site, {"hits": 0, "misses": 0})
+        site[outcome] += 1
+
+    async def get_or_compute(
+        self,
+        key: str,
+        call_site: str,
+        compute: Callable[[], Awaitable[Optional[str]]],
+        ttl: Optional[float] = None
+    ) -> Optional[str]:
+        """
+        Cached value for key, or compute() it once
+        compute returns the serialized result, or None for results that must not be cached
+        """
+        inflight = self._inflight.get(key)
+        while inflight is not None:
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The leading request was cancelled; take over
+                inflight = self._inflight.get(key)
+
+        future = asyncio.get_event_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self.get(key)
+            if value is not None:
+                self.stats["hits"] += 1
+                self._count(call_site, "hits")
+            else:
+                self.stats["misses"] += 1
+                self._count(call_site, "misses")
+                value = await compute()
+                if value is not None:
+                    await self.set(key, call_site, value, ttl if ttl is not None else ttl_for(call_site))
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Followers see the exception; mark it retrieved so an unawaited future isn't logged
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def get_stats(self) -> Dict:
+        lookups = (self.stats["hits"] + self.stats["misses"]) or 1
+        return {
+            **self.stats,
+            "by_call_site": {k: dict(v) for k, v in self.stats["by_call_site"].items()},
+            "hit_rate": self.stats["hits"] / lookups,
+            "inflight": len(self._inflight),
+            "path": self.path
+        }
@@ -0,0 +1,351 @@
+"""
+LLM Gateway
+One process-wide async OpenAI client on a pooled keep-alive httpx client,
+with a global concurrency limit on outbound LLM calls, retries / circuit
+breaking / hedging per model, an optional persistent result cache for
+deterministic calls, and usage accounting per call site and session
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from llm_cache import LLMResultCache, make_key
+from llm_resilience import ResilientCaller
+from usage_tracker import UsageTracker
+
+logger = logging.getLogger("llm_gateway")
+
+# Chat traffic goes to OpenAI unless LLM_BASE_URL says otherwise. Passing
+# base_url=None would let the SDK pick up OPENAI_BASE_URL, which hosting
+# environments may preset to their own proxy
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+class LLMGateway:
+    """
+    Shared entry point for chat completions, streaming, stored responses and embeddings
+    Every call holds a slot of the global semaphore while it talks to the provider
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: str = DEFAULT_BASE_URL,
+        max_concurrency: int = 16,
+        max_connections: int = 32,
+        keepalive_expiry: float = 60.0,
+        timeout: float = 60.0,
+        cache: Optional[LLMResultCache] = None,
+        resilience: Optional[ResilientCaller] = None,
+        usage: Optional[UsageTracker] = None
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.cache = cache  # None: result caching disabled
+        self.resilience = resilience or ResilientCaller()
+        self.usage = usage or UsageTracker()
+        self._client = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+        self.in_flight = 0
+        self.stats = {
+            "calls": 0,
+            "streams": 0,
+            "embeddings": 0,
+            "responses": 0,
+            "errors": 0,
+            "queued": 0,  # Calls that had to wait for a concurrency slot
+            "max_in_flight": 0,
+            "clients_created": 0
+        }
+
+    def _ensure_client(self):
+        """
+        Create the pooled client and semaphore for the running event loop
+        Both are bound to a loop; a new loop (e.g. asyncio.run in a script) gets fresh ones
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is not None and self._loop is loop:
+            return self._client
+
+        from openai import AsyncOpenAI
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            timeout=self.timeout
+        )
+        self._client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=http_client,
+            max_retries=0  # Retries are handled by self.resilience
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._loop = loop
+        self.stats["clients_created"] += 1
+        logger.info(f"LLM client pool created (concurrency={self.max_concurrency}, connections={self.max_connections})")
+        return self._client
+
+    async def _acquire(self):
+        if self._semaphore.locked():
+            self.stats["queued"] += 1
+        await self._semaphore.acquire()
+        self.in_flight += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def _record_usage(self, call_site: Optional[str], session_id: Optional[str], model: str,
+                      usage, start: float, error: bool = False, cache_hit: bool = False):
+        # Chat completions report prompt / completion tokens, the Responses API input / output tokens
+        details = getattr(usage, "prompt_tokens_details", None) or getattr(usage, "input_tokens_details", None)
+        self.usage.record(
+            call_site,
+            session_id,
+            model,
+            prompt_tokens=getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", 0) or 0,
+            cached_prompt_tokens=getattr(details, "cached_tokens", 0) or 0,
+            latency=time.monotonic() - start,
+            error=error,
+            cache_hit=cache_hit
+        )
+
+    async def chat(
+        self,
+        messages: List[Dict],
+        model: str = "gpt-4o-mini",
+        call_site: Optional[str] = None,
+        session_id: Optional[str] = None,
+        cache: bool = False,
+        **params
+    ):
+        """
+        Chat completion
+        params are passed through to chat.completions.create (temperature, max_tokens, timeout, ...)
+        call_site / session_id tag the call for usage accounting and per-session budgets
+        cache=True serves repeated identical calls from the result cache, with call_site's TTL
+        """
+        self.usage.check_budget(session_id)
+        start = time.monotonic()
+        try:
+            if cache and self.cache is not None and call_site:
+                response, cache_hit = await self._cached_chat(messages, model, call_site, params)
+            else:
+                response, cache_hit = await self._chat(messages, model, params), False
+        except Exception:
+            self._record_usage(call_site, session_id, model, None, start, error=True)
+            raise
+        # Cache hits cost no tokens
+        self._record_usage(call_site, session_id, model, None if cache_hit else response.usage, start, cache_hit=cache_hit)
+        return response
+
+    async def _cached_chat(self, messages: List[Dict], model: str, call_site: str, params: Dict):
+        from openai.types.chat import ChatCompletion
+
+        fresh = []
+
+        async def compute() -> Optional[str]:
+            response = await self._chat(messages, model, params)
+            fresh.append(response)
+            # Truncated or filtered completions aren't worth replaying
+            if response.choices and response.choices[0].finish_reason == "stop":
+                return response.model_dump_json()
+            return None
+
+        key = make_key(model, messages, params)
+        value = await self.cache.get_or_compute(key, call_site, compute)
+        if fresh:
+            return fresh[0], False
+        if value is None:
+            # Coalesced onto an uncacheable result; ask on our own
+            return await self._chat(messages, model, params), False
+        return ChatCompletion.model_validate_json(value), True
+
+    async def _chat(self, messages: List[Dict], model: str, params: Dict):
+        client = self._ensure_client()
+
+        async def attempt():
+            await self._acquire()
+            try:
+                self.stats["calls"] += 1
+                return await client.chat.completions.create(model=model, messages=messages, **params)
+            except Exception:
+                self.stats["errors"] += 1
+                raise
+            finally:
+                self._release()
+
+        return await self.resilience.call(model, attempt)
+
+    async def respond(
+        self,
+        input: List[Dict],
+        model: str = "gpt-4o-mini",
+        call_site: Optional[str] = None,
+        session_id: Optional[str] = None,
+        previous_response_id: Optional[str] = None,
+        **params
+    ):
+        """
+        Responses API call stored on the provider, so the next turn can continue
+        from it with previous_response_id and send only what is new
+        """
+        self.usage.check_budget(session_id)
+        client = self._ensure_client()
+        start = time.monotonic()
+
+        async def attempt():
+            await self._acquire()
+            try:
+                self.stats["responses"] += 1
+                return await client.responses.create(
+                    model=model,
+                    input=input,
+                    previous_response_id=previous_response_id,
+                    store=True,
+                    **params
+                )
+            except Exception:
+                self.stats["errors"] += 1
+                raise
+            finally:
+                self._release()
+
+        try:
+            response = await self.resilience.call(model, attempt)
+        except Exception:
+            self._record_usage(call_site, session_id, model, None, start, error=True)
+            raise
+        self._record_usage(call_site, session_id, model, response.usage, start)
+        return response
+
+    async def stream_chat(
+        self,
+        messages: List[Dict],
+        model: str = "gpt-4o-mini",
+        call_site: Optional[str] = None,
+        session_id: Optional[str] = None,
+        **params
+    ) -> AsyncIterator[str]:
+        """
+        Streamed chat completion; holds its concurrency slot until the stream ends
+        Opening the stream is retried; once tokens flow, errors go to the caller
+        """
+        self.usage.check_budget(session_id)
+        client = self._ensure_client()
+        start = time.monotonic()
+        usage = None
+        error = False
+        await self._acquire()
+        try:
+            self.stats["streams"] += 1
+            stream = await self.resilience.call(
+                model,
+                lambda: client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},  # Final chunk carries token usage
+                    **params
+                ),
+                hedge=False
+            )
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception:
+            self.stats["errors"] += 1
+            error = True
+            raise
+        finally:
+            self._release()
+            self._record_usage(call_site, session_id, model, usage, start, error=error)
+
+    async def embed(
+        self,
+        text: str,
+        model: str = "text-embedding-3-small",
+        call_site: Optional[str] = None,
+        session_id: Optional[str] = None
+    ) -> List[float]:
+        """Embedding for a single text"""
+        self.usage.check_budget(session_id)
+        client = self._ensure_client()
+        start = time.monotonic()
+        await self._acquire()
+        try:
+            self.stats["embeddings"] += 1
+            response = await self.resilience.call(
+                model,
+                lambda: client.embeddings.create(model=model, input=text),
+                hedge=False
+            )
+        except Exception:
+            self.stats["errors"] += 1
+            self._record_usage(call_site, session_id, model, None, start, error=True)
+            raise
+        finally:
+            self._release()
+        self._record_usage(call_site, session_id, model, response.usage, start)
+        return response.data[0].embedding
+
+    async def close(self):
+        """Close the pooled connections"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            self._loop = None
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "cache": self.cache.get_stats() if self.cache is not None else None,
+            "resilience": self.resilience.get_stats()
+        }
+
+# Global gateway instance
+_gateway = None
+
+def get_llm_gateway() -> LLMGateway:
+    """Get or create the process-wide LLM gateway"""
+    global _gateway
+    if _gateway is None:
+        cache = None
+        if os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true":
+            cache = LLMResultCache(os.getenv("LLM_CACHE_PATH", "./data/llm_cache.db"))
+        _gateway = LLMGateway(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("LLM_BASE_URL") or DEFAULT_BASE_URL,
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "32")),
+            timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+            cache=cache,
+            resilience=ResilientCaller(
+                max_attempts=int(os.getenv("LLM_MAX_ATTEMPTS", "3")),
+                failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+                reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30")),
+                hedge=os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+            ),
+            usage=UsageTracker(
+                session_token_budget=int(os.getenv("LLM_SESSION_TOKEN_BUDGET", "0")) or None
+            )
+        )
+    return _gateway
@@ -0,0 +1,239 @@
+"""
+LLM Resilience
+Wraps each LLM request with:
+- bounded retries with jittered exponential backoff (transient errors only)
+- a per-model circuit breaker that fails fast while the provider is degraded
+- optional hedging: a second request after the observed p95 latency,
+  first response wins and the other is cancelled
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+logger = logging.getLogger("llm_resilience")
+
+T = TypeVar("T")
+
+class CircuitOpenError(Exception):
+    """The model's circuit is open; the call was not attempted"""
+    pass
+
+def is_retryable(exc: BaseException) -> bool:
+    """Timeouts, connection errors, rate limits and 5xx are transient; 4xx are not"""
+    if isinstance(exc, asyncio.TimeoutError):
+        return True
+    try:
+        import openai
+    except ImportError:
+        return False
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500
+    return False
+
+class CircuitBreaker:
+    """
+    closed -> open after failure_threshold consecutive failures
+    open -> half_open after reset_timeout; one probe request is let through
+    half_open -> closed on success, back to open on failure
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+            self._probe_in_flight = False
+        # half_open: one probe at a time
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """The probe was cancelled before it could tell us anything"""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def get_stats(self) -> Dict:
+        return {"state": self.state, "failures": self.failures, "times_opened": self.times_opened}
+
+class LatencyWindow:
+    """Rolling window of successful call latencies"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """None until min_samples have been seen"""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class ResilientCaller:
+    """Runs request factories with retry, circuit breaking and hedging per model"""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, LatencyWindow] = {}
+        self.stats = {
+            "calls": 0,
+            "retries": 0,
+            "circuit_rejections": 0,
+            "hedges": 0,
+            "hedge_wins": 0,  # Hedged request answered first
+            "gave_up": 0
+        }
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return self._breakers[model]
+
+    def is_open(self, model: str) -> bool:
+        """Whether calls to model currently fail fast"""
+        breaker = self._breakers.get(model)
+        return (
+            breaker is not None
+            and breaker.state == "open"
+            and time.monotonic() - breaker.opened_at < breaker.reset_timeout
+        )
+
+    def latency(self, model: str) -> LatencyWindow:
+        if model not in self._latencies:
+            self._latencies[model] = LatencyWindow()
+        return self._latencies[model]
+
+    def _backoff(self, attempt: int) -> float:
+        """Full jitter: uniform in [0, min(max_delay, base * 2^(attempt-1))]"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def call(self, model: str, factory: Callable[[], Awaitable[T]], hedge: bool = True) -> T:
+        """
+        Run factory() for model with retries
+        hedge=False for requests that can't be duplicated (e.g. streams); those
+        also stay out of the latency window so they don't skew the hedge delay
+        """
+        self.stats["calls"] += 1
+        breaker = self.breaker(model)
+
+        for attempt in range(1, self.max_attempts + 1):
+            if not breaker.allow():
+                self.stats["circuit_rejections"] += 1
+                raise CircuitOpenError(f"Circuit open for {model}")
+            try:
+                result = await (self._hedged(model, factory) if hedge else factory())
+                breaker.record_success()
+                return result
+            except asyncio.CancelledError:
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    # The request itself is wrong; says nothing about provider health
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if attempt == self.max_attempts:
+                    self.stats["gave_up"] += 1
+                    raise
+                delay = self._backoff(attempt)
+                self.stats["retries"] += 1
+                logger.warning(f"{model} attempt {attempt} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _timed(self, model: str, factory: Callable[[], Awaitable[T]]) -> T:
+        start = time.monotonic()
+        result = await factory()
+        self.latency(model).record(time.monotonic() - start)
+        return result
+
+    async def _hedged(self, model: str, factory: Callable[[], Awaitable[T]]) -> T:
+        delay = self.latency(model).percentile(self.hedge_quantile) if self.hedge else None
+        if delay is None:
+            return await self._timed(model, factory)
+
+        primary = asyncio.create_task(self._timed(model, factory))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.stats["hedges"] += 1
+                tasks.add(asyncio.create_task(self._timed(model, factory)))
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def get_stats(self) -> Dict:
+        models = {}
+        for model in set(self._breakers) | set(self._latencies):
+            window = self.latency(model)
+            models[model] = {
+                **self.breaker(model).get_stats(),
+                "p50": window.percentile(0.5),
+                "p95": window.percentile(0.95)
+            }
+        return {**self.stats, "hedging": self.hedge, "models": models}
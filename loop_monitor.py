@@ -0,0 +1,67 @@
+"""
+Event Loop Monitor
+Debug mode that warns when the event loop is blocked:
+- a heartbeat task measures how late it wakes up (lag)
+- asyncio debug mode logs the slow callback itself, which names the culprit
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger("loop_monitor")
+
+class EventLoopMonitor:
+    """Warns when the loop is blocked for longer than threshold_ms"""
+
+    def __init__(self, threshold_ms: float = 100, interval: float = 0.25):
+        self.threshold_ms = threshold_ms
+        self.interval = interval  # Heartbeat period in seconds
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "heartbeats": 0,
+            "blocked": 0,
+            "max_lag_ms": 0.0,
+            "last_blocked_at": None
+        }
+
+    def start(self):
+        """Start monitoring the running loop"""
+        if self._task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        # asyncio logs "Executing <Handle ...> took N seconds" for callbacks over this duration
+        loop.slow_callback_duration = self.threshold_ms / 1000
+        loop.set_debug(True)
+        self._task = asyncio.create_task(self._heartbeat())
+        logger.info(f"Event loop monitor started (threshold={self.threshold_ms:.0f}ms)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag_ms = (time.monotonic() - expected) * 1000
+            self.stats["heartbeats"] += 1
+            self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], lag_ms)
+            if lag_ms > self.threshold_ms:
+                self.stats["blocked"] += 1
+                self.stats["last_blocked_at"] = time.time()
+                logger.warning(f"Event loop blocked for {lag_ms:.0f}ms (threshold {self.threshold_ms:.0f}ms)")
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "threshold_ms": self.threshold_ms,
+            "running": self._task is not None
+        }
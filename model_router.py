@@ -0,0 +1,138 @@
+"""
+Model Router
+Live per-model health for the orchestrator (EWMA latency, error rate,
+timeouts, output tokens per second) and a ranking of models against a
+request's latency target, so traffic moves off a degraded model on its own
+"""
+
+import time
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger("model_router")
+
+@dataclass
+class ModelHealth:
+    """Smoothed observations for one model"""
+    calls: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    latency_ewma: Optional[float] = None  # Seconds; None until the first success
+    error_ewma: float = 0.0
+    tokens_per_sec_ewma: Optional[float] = None
+    updated_at: float = 0.0
+
+class ModelRouter:
+    """
+    Ranks models by health, then fit to the latency target, then quality
+
+    The error rate decays with error_half_life while a model gets no traffic,
+    so a model that was shunned after an outage is tried again later
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.2,
+        error_alpha: float = 0.3,
+        max_error_rate: float = 0.5,
+        error_half_life: float = 60.0,
+        is_circuit_open: Optional[Callable[[str], bool]] = None
+    ):
+        self.alpha = alpha  # EWMA weight of the newest sample
+        self.error_alpha = error_alpha  # Reacts faster: two straight failures mark a clean model degraded
+        self.max_error_rate = max_error_rate  # Above this a model counts as degraded
+        self.error_half_life = error_half_life
+        self.is_circuit_open = is_circuit_open or (lambda model: False)
+        self._health: Dict[str, ModelHealth] = {}
+        self.stats = {"rankings": 0, "primary_changes": 0}
+        self._last_primary: Optional[str] = None
+
+    def health(self, model: str) -> ModelHealth:
+        if model not in self._health:
+            self._health[model] = ModelHealth()
+        return self._health[model]
+
+    def _ewma(self, current: Optional[float], sample: float, alpha: Optional[float] = None) -> float:
+        alpha = self.alpha if alpha is None else alpha
+        return sample if current is None else (1 - alpha) * current + alpha * sample
+
+    def _update_error(self, health: ModelHealth, model: str, sample: float):
+        current = self.error_rate(model) if health.calls else None
+        health.error_ewma = self._ewma(current, sample, self.error_alpha)
+
+    def record_success(self, model: str, latency: float, completion_tokens: int = 0):
+        health = self.health(model)
+        self._update_error(health, model, 0.0)
+        health.calls += 1
+        health.latency_ewma = self._ewma(health.latency_ewma, latency)
+        if completion_tokens and latency > 0:
+            health.tokens_per_sec_ewma = self._ewma(health.tokens_per_sec_ewma, completion_tokens / latency)
+        health.updated_at = time.monotonic()
+
+    def record_failure(self, model: str, latency: float, timeout: bool = False):
+        health = self.health(model)
+        self._update_error(health, model, 1.0)
+        health.calls += 1
+        health.errors += 1
+        health.timeouts += int(timeout)
+        if timeout:
+            # A timeout says the model is at least this slow
+            health.latency_ewma = self._ewma(health.latency_ewma, latency)
+        health.updated_at = time.monotonic()
+
+    def error_rate(self, model: str) -> float:
+        """Error EWMA, decayed by the time since the last observation"""
+        health = self.health(model)
+        if not health.error_ewma:
+            return 0.0
+        age = time.monotonic() - health.updated_at
+        return health.error_ewma * 0.5 ** (age / self.error_half_life)
+
+    def is_healthy(self, model: str) -> bool:
+        return self.error_rate(model) < self.max_error_rate and not self.is_circuit_open(model)
+
+    def rank(
+        self,
+        models: List[str],
+        quality: Optional[Dict[str, float]] = None,
+        latency_target: Optional[float] = None
+    ) -> List[str]:
+        """
+        Best first: healthy models, then those expected within latency_target
+        (unmeasured models count as within), then higher quality, then faster
+        """
+        quality = quality or {}
+
+        def key(model: str):
+            latency = self.health(model).latency_ewma
+            within = latency_target is None or latency is None or latency <= latency_target
+            return (
+                not self.is_healthy(model),
+                not within,
+                -quality.get(model, 0.0),
+                latency if latency is not None else 0.0
+            )
+
+        ranked = sorted(models, key=key)
+        self.stats["rankings"] += 1
+        if ranked and ranked[0] != self._last_primary:
+            if self._last_primary is not None:
+                self.stats["primary_changes"] += 1
+                logger.warning(f"Primary model changed: {self._last_primary} -> {ranked[0]}")
+            self._last_primary = ranked[0]
+        return ranked
+
+    def get_stats(self) -> Dict:
+        models = {}
+        for model, health in self._health.items():
+            models[model] = {
+                "calls": health.calls,
+                "errors": health.errors,
+                "timeouts": health.timeouts,
+                "latency_ewma": health.latency_ewma,
+                "error_rate": self.error_rate(model),
+                "tokens_per_sec": health.tokens_per_sec_ewma,
+                "healthy": self.is_healthy(model)
+            }
+        return {**self.stats, "primary": self._last_primary, "models": models}
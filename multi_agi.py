@@ -4,39 +4,115 @@ Integrates multiple AGI models (GPT-4, Gemini) with meta-AI selection
 """
 
 import os
+import time
 import asyncio
 import logging
-from typing import List, Dict, Optional, Tuple
+from typing import AsyncIterator, Awaitable, Callable, List, Dict, Optional, Tuple
 from dataclasses import dataclass
-from enum import Enum
 
-logger = logging.getLogger("multi_agi")
+from agi_providers import ProviderRegistry, ProviderReply, ProviderSpec, default_registry
+from answer_scoring import is_user_correction, rerank_answers, score_answer
+from conversation_state import ConversationStateExpired, ConversationStateStore
+from failure_learning import get_failure_system
+from llm_gateway import get_llm_gateway
+from model_router import ModelRouter
 
-class AGIModel(Enum):
-    """Available AGI models"""
-    GPT4 = "gpt-4o-mini"
-    GEMINI = "gemini-2.5-flash"
+logger = logging.getLogger("multi_agi")
 
 @dataclass
 class AGIResponse:
     """Response from a single AGI model"""
-    model: AGIModel
+    model: str  # Provider name
     content: str
     confidence: float  # 0.0 to 1.0
     reasoning: str  # Why this response was generated
     metadata: Dict = None
 
+def is_timeout(exc: BaseException) -> bool:
+    if isinstance(exc, asyncio.TimeoutError):
+        return True
+    try:
+        import openai
+    except ImportError:
+        return False
+    return isinstance(exc, openai.APITimeoutError)
+
 class MultiAGIOrchestrator:
     """
     Orchestrates multiple AGI models in parallel
     Uses meta-AI to select or combine the best response
     """
     
-    def __init__(self, openai_api_key: str):
+    def __init__(
+        self,
+        openai_api_key: str,
+        registry: Optional[ProviderRegistry] = None,
+        default_models: Optional[List[str]] = None,
+        race_models: Optional[List[str]] = None,
+        race_grace: float = 0.3,
+        race_min_chars: int = 2,
+        routed_models: Optional[List[str]] = None,
+        latency_target: Optional[float] = None,
+        cascade_models: Optional[List[str]] = None,
+        cascade_threshold: float = 0.6,
+        meta_agreement_threshold: float = 0.25,
+        meta_margin: float = 0.1,
+        conversations: Optional[ConversationStateStore] = None
+    ):
         self.openai_api_key = openai_api_key
-        self.enabled_models = [AGIModel.GPT4, AGIModel.GEMINI]
         
-        # Oreza存在哲学: 統一人格プロンプト
+        # Providers by name; only enabled ones are ever scheduled
+        self.registry = registry or default_registry()
+        # Pool for "parallel", "sequential", "meta_select" and streaming
+        self.default_models = default_models or ["gpt-4o-mini", "gemini-2.5-flash"]
+        
+        # "race" strategy: first answer through the quality gate wins
+        self.race_models = race_models or ["gpt-4o-mini", "gpt-4.1-mini"]
+        self.race_grace = race_grace  # Seconds to wait for a higher-confidence model after the first good answer
+        self.race_min_chars = race_min_chars
+        
+        # "adaptive" strategy and race order: ranked by live latency / error statistics
+        self.routed_models = routed_models or ["gpt-4o-mini", "gpt-4.1-mini"]
+        self.latency_target = latency_target  # Seconds; default when a request doesn't set one
+        self.router = ModelRouter(is_circuit_open=lambda model: get_llm_gateway().resilience.is_open(model))
+        
+        # "cascade" strategy: cheapest model first, escalate only on a low local score
+        self.cascade_models = cascade_models or ["gpt-4o-mini", "gpt-4.1-mini"]
+        self.cascade_threshold = cascade_threshold
+        
+        # "meta_select": candidates are re-ranked locally; the LLM judge only runs when they
+        # disagree (mean overlap below meta_agreement_threshold) and no answer leads by meta_margin
+        self.meta_agreement_threshold = meta_agreement_threshold
+        self.meta_margin = meta_margin
+        
+        # "stateful" strategy: conversation kept on the provider, only new input is sent
+        self.conversations = conversations or ConversationStateStore()
+        
+        self.stats = {
+            "races": 0,
+            "race_winners": {},
+            "race_cancelled": 0,  # Outstanding calls cancelled after a winner
+            "race_rejected": 0,  # Answers that failed the quality gate
+            "grace_waits": 0,
+            "grace_upgrades": 0,  # A higher-confidence model answered within the grace window
+            "race_all_failed": 0,
+            "cascades": 0,
+            "cascade_escalations": 0,
+            "cascade_routed_strong": 0,  # User corrections sent straight to the strongest model
+            "cascade_answered_by": {},
+            "cascade_low_score_reasons": {},
+            "cascade_latency_saved_s": 0.0,  # Net, against calling the strongest model directly
+            "deadline_timeouts": 0,  # Provider calls cut off by their timeout / the request deadline
+            "deadline_skipped": 0,  # Calls not started because the deadline had already passed
+            "abandoned_calls": 0,  # In-flight calls cancelled (timeout, race loser, request gone)
+            "abandoned_by_model": {},
+            "meta_selects": 0,
+            "meta_local_picks": 0,
+            "meta_judge_calls": 0
+        }
+        
+        # Oreza存在哲学: 統一人格プロンプト (meta-AI only; chat messages arrive with
+        # app.CHAT_SYSTEM_PROMPT already in place)
         self.system_prompt = (
             "あなたはユーザー専属のAIアシスタントです。\n"
             "自己紹介を求められた時のみ「私はあなたのAIです」と答えてください。\n"
@@ -46,70 +122,94 @@ class MultiAGIOrchestrator:
             "所有でも支配でもなく、共鳴関係として「私はあなたのAI」という存在哲学を体現します。"
         )
         
-    async def call_gpt4(self, messages: List[dict], timeout: int = 30) -> AGIResponse:
-        """Call GPT-4o-mini (Direct OpenAI API)"""
+    def _budget(self, spec: ProviderSpec, deadline: Optional[float]) -> float:
+        """Seconds the provider may take: its own timeout, capped by the request deadline (loop time)"""
+        if deadline is None:
+            return spec.timeout
+        return min(spec.timeout, deadline - asyncio.get_running_loop().time())
+    
+    def _abandon(self, model: str):
+        self.stats["abandoned_calls"] += 1
+        abandoned = self.stats["abandoned_by_model"]
+        abandoned[model] = abandoned.get(model, 0) + 1
+    
+    def _error_response(self, model: str, error: str) -> AGIResponse:
+        return AGIResponse(
+            model=model,
+            content=f"エラー: {error}",
+            confidence=0.0,
+            reasoning="Error occurred",
+            metadata={"error": error}
+        )
+    
+    async def call_provider(
+        self,
+        spec: ProviderSpec,
+        messages: List[dict],
+        session_id: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> AGIResponse:
+        """
+        Call one provider within its timeout, capped by deadline (loop time)
+        The whole call (retries included) is cancelled when the budget runs out,
+        which closes its HTTP request; failures come back as a zero-confidence AGIResponse
+        """
+        return await self._guarded_call(
+            spec,
+            lambda budget: spec.call(messages, budget, session_id),
+            deadline
+        )
+    
+    async def _guarded_call(
+        self,
+        spec: ProviderSpec,
+        invoke: Callable[[float], Awaitable[ProviderReply]],
+        deadline: Optional[float] = None
+    ) -> AGIResponse:
+        """Budget, cancellation and health bookkeeping around invoke(budget)"""
+        budget = self._budget(spec, deadline)
+        if budget <= 0:
+            self.stats["deadline_skipped"] += 1
+            return self._error_response(spec.name, "deadline exceeded")
+        
+        start = time.monotonic()
         try:
-            from openai import OpenAI
-            # Use user-provided OpenAI API key directly
-            client = OpenAI(
-                api_key=self.openai_api_key,
-                base_url="https://api.openai.com/v1"
-            )
-            
-            # システムプロンプトを先頭に追加
-            messages_with_system = [
-                {"role": "system", "content": self.system_prompt}
-            ] + messages
-            
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages_with_system,
-                    temperature=0.7,
-                )
-            )
-            
-            content = response.choices[0].message.content
+            reply = await asyncio.wait_for(invoke(budget), timeout=budget)
+            self.router.record_success(spec.name, time.monotonic() - start, reply.completion_tokens)
             
             return AGIResponse(
-                model=AGIModel.GPT4,
-                content=content,
-                confidence=0.85,  # GPT-4 is generally reliable
-                reasoning="GPT-4o-mini: Fast and versatile general-purpose response",
-                metadata={"finish_reason": response.choices[0].finish_reason}
+                model=spec.name,
+                content=reply.content,
+                confidence=spec.confidence,
+                reasoning=spec.reasoning,
+                metadata={"finish_reason": reply.finish_reason, "response_id": reply.response_id}
             )
             
+        except ConversationStateExpired:
+            # Not the model's fault; the caller resends the turn in full
+            raise
+        except asyncio.CancelledError:
+            # The caller gave up on us (race lost, request timed out or went away)
+            self._abandon(spec.name)
+            raise
+        except asyncio.TimeoutError:
+            logger.error(f"{spec.name} exceeded its {budget:.1f}s budget, call cancelled")
+            self.stats["deadline_timeouts"] += 1
+            self._abandon(spec.name)
+            self.router.record_failure(spec.name, time.monotonic() - start, timeout=True)
+            return self._error_response(spec.name, f"timeout after {budget:.1f}s")
         except Exception as e:
-            logger.error(f"GPT-4 error: {str(e)}")
-            return AGIResponse(
-                model=AGIModel.GPT4,
-                content=f"エラー: {str(e)}",
-                confidence=0.0,
-                reasoning="Error occurred",
-                metadata={"error": str(e)}
-            )
-    
-    async def call_gemini(self, messages: List[dict], timeout: int = 30) -> AGIResponse:
-        """Call Gemini 2.5 Flash (Disabled - using OpenAI only)"""
-        # Gemini is disabled, return error response
-        logger.info("Gemini is disabled, using GPT-4 only")
-        return AGIResponse(
-            model=AGIModel.GEMINI,
-            content="Gemini is disabled",
-            confidence=0.0,
-            reasoning="Gemini disabled",
-            metadata={"error": "disabled"}
-        )
-        
-        # Original code (disabled)
-        # Gemini functionality has been disabled
+            logger.error(f"{spec.name} error: {str(e)}")
+            self.router.record_failure(spec.name, time.monotonic() - start, timeout=is_timeout(e))
+            return self._error_response(spec.name, str(e))
     
     async def orchestrate(
         self, 
         messages: List[dict],
-        strategy: str = "parallel"  # "parallel", "sequential", "meta_select"
+        strategy: str = "parallel",  # "parallel", "sequential", "meta_select", "race", "adaptive", "cascade", "stateful"
+        session_id: Optional[str] = None,
+        latency_target: Optional[float] = None,
+        deadline: Optional[float] = None
     ) -> Tuple[str, Dict]:
         """
         Orchestrate multiple AGI models
@@ -119,31 +219,116 @@ class MultiAGIOrchestrator:
             strategy: Orchestration strategy
                 - "parallel": Run all models in parallel, select best
                 - "sequential": Try models in order until success
-                - "meta_select": Use meta-AI to combine responses
+                - "meta_select": Re-rank responses locally; meta-AI combines them only when they disagree
+                - "race": First response through the quality gate wins, the rest are cancelled
+                - "adaptive": Try models ranked by live health and latency until one succeeds
+                - "cascade": Cheapest model first, escalate to a stronger one only on a low local score
+                - "stateful": Best-ranked model continues the session's provider-side conversation,
+                    uploading only the new message and changed system context
+            session_id: Session the LLM usage is accounted to
+            latency_target: Seconds the answer should take; ranks models for "adaptive" and "race"
+            deadline: Loop time (asyncio.get_running_loop().time()) by which the answer is needed;
+                provider calls still running then are cancelled
         
         Returns:
             (final_response, metadata)
         """
         
         if strategy == "parallel":
-            return await self._parallel_strategy(messages)
+            return await self._parallel_strategy(messages, session_id, deadline)
         elif strategy == "sequential":
-            return await self._sequential_strategy(messages)
+            return await self._sequential_strategy(messages, session_id, deadline)
         elif strategy == "meta_select":
-            return await self._meta_select_strategy(messages)
+            return await self._meta_select_strategy(messages, session_id, deadline)
+        elif strategy == "race":
+            return await self._race_strategy(messages, session_id, latency_target, deadline)
+        elif strategy == "adaptive":
+            return await self._adaptive_strategy(messages, session_id, latency_target, deadline)
+        elif strategy == "cascade":
+            return await self._cascade_strategy(messages, session_id, deadline)
+        elif strategy == "stateful":
+            return await self._stateful_strategy(messages, session_id, latency_target, deadline)
         else:
             raise ValueError(f"Unknown strategy: {strategy}")
     
-    async def _parallel_strategy(self, messages: List[dict]) -> Tuple[str, Dict]:
+    async def orchestrate_stream(
+        self,
+        messages: List[dict],
+        session_id: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Stream a response token by token
+        spec.timeout bounds each read; deadline (loop time) bounds the whole stream,
+        which is cancelled and closed when it passes
+        
+        Yields:
+            {"type": "token", "content": str} for each token, then
+            {"type": "done", "metadata": dict}
+        """
+        logger.info("🔄 Running streaming AGI orchestration...")
+        
+        # Streaming uses the best-ranked enabled provider that supports it
+        streaming = [spec.name for spec in self.registry.active(self.default_models) if spec.stream is not None]
+        if not streaming:
+            raise RuntimeError("No streaming-capable model is enabled")
+        spec = self.registry.get(self.rank_models(streaming)[0])
+        
+        loop = asyncio.get_running_loop()
+        if deadline is not None and deadline <= loop.time():
+            self.stats["deadline_skipped"] += 1
+            raise asyncio.TimeoutError("deadline exceeded before the stream started")
+        
+        start = time.monotonic()
+        tokens = spec.stream(messages, spec.timeout, session_id).__aiter__()
+        try:
+            while True:
+                remaining = None if deadline is None else max(0.0, deadline - loop.time())
+                try:
+                    token = await asyncio.wait_for(tokens.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    break
+                yield {"type": "token", "content": token}
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client went away mid-stream; closing the generator closes the HTTP stream
+            self._abandon(spec.name)
+            raise
+        except asyncio.TimeoutError as e:
+            self.stats["deadline_timeouts"] += 1
+            self._abandon(spec.name)
+            self.router.record_failure(spec.name, time.monotonic() - start, timeout=True)
+            raise asyncio.TimeoutError(f"{spec.name} stream exceeded the request deadline") from e
+        except Exception as e:
+            self.router.record_failure(spec.name, time.monotonic() - start, timeout=is_timeout(e))
+            raise
+        finally:
+            await tokens.aclose()
+        self.router.record_success(spec.name, time.monotonic() - start)
+        
+        logger.info(f"✅ {spec.name} stream completed")
+        yield {
+            "type": "done",
+            "metadata": {
+                "selected_model": spec.name,
+                "strategy": "stream"
+            }
+        }
+    
+    async def _parallel_strategy(
+        self,
+        messages: List[dict],
+        session_id: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[str, Dict]:
         """
         Run all models in parallel and select the best response
         """
         logger.info("🔄 Running parallel AGI orchestration...")
         
-        # Run all models in parallel
+        # Run all enabled models in parallel
         tasks = [
-            self.call_gpt4(messages),
-            self.call_gemini(messages)
+            self.call_provider(spec, messages, session_id=session_id, deadline=deadline)
+            for spec in self.registry.active(self.default_models)
         ]
         
         responses = await asyncio.gather(*tasks, return_exceptions=True)
@@ -158,57 +343,338 @@ class MultiAGIOrchestrator:
         # Select best response based on confidence
         best_response = max(valid_responses, key=lambda r: r.confidence)
         
-        logger.info(f"✅ Selected {best_response.model.value}: {best_response.reasoning}")
+        logger.info(f"✅ Selected {best_response.model}: {best_response.reasoning}")
         
         metadata = {
-            "selected_model": best_response.model.value,
+            "selected_model": best_response.model,
             "confidence": best_response.confidence,
             "reasoning": best_response.reasoning,
-            "all_models": [r.model.value for r in valid_responses]
+            "all_models": [r.model for r in valid_responses]
         }
         
         return best_response.content, metadata
     
-    async def _sequential_strategy(self, messages: List[dict]) -> Tuple[str, Dict]:
+    async def _sequential_strategy(
+        self,
+        messages: List[dict],
+        session_id: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[str, Dict]:
         """
         Try models sequentially until one succeeds
         """
         logger.info("🔄 Running sequential AGI orchestration...")
         
-        for model in self.enabled_models:
+        for spec in self.registry.active(self.default_models):
             try:
-                if model == AGIModel.GPT4:
-                    response = await self.call_gpt4(messages)
-                elif model == AGIModel.GEMINI:
-                    response = await self.call_gemini(messages)
-                else:
-                    continue
+                response = await self.call_provider(spec, messages, session_id=session_id, deadline=deadline)
                 
                 if response.confidence > 0:
-                    logger.info(f"✅ {model.value} succeeded")
+                    logger.info(f"✅ {spec.name} succeeded")
                     metadata = {
-                        "selected_model": model.value,
+                        "selected_model": spec.name,
                         "confidence": response.confidence,
                         "reasoning": response.reasoning
                     }
                     return response.content, metadata
                     
             except Exception as e:
-                logger.error(f"{model.value} failed: {str(e)}")
+                logger.error(f"{spec.name} failed: {str(e)}")
                 continue
         
         return "申し訳ございません。一時的なエラーが発生しました。", {"error": "all_failed"}
     
-    async def _meta_select_strategy(self, messages: List[dict]) -> Tuple[str, Dict]:
+    def passes_quality_gate(self, response: AGIResponse) -> bool:
+        """Cheap checks that an answer is usable as-is: no error, not truncated or filtered, not empty"""
+        if response.confidence <= 0:
+            return False
+        if (response.metadata or {}).get("finish_reason") not in (None, "stop"):
+            return False
+        return len(response.content.strip()) >= self.race_min_chars
+    
+    def rank_models(self, models: List[str], latency_target: Optional[float] = None) -> List[str]:
+        """Enabled providers among models, ordered by live health, fit to the latency target and static confidence"""
+        specs = self.registry.active(models)
+        quality = {spec.name: spec.confidence for spec in specs}
+        target = latency_target if latency_target is not None else self.latency_target
+        return self.router.rank([spec.name for spec in specs], quality, target)
+    
+    async def _adaptive_strategy(
+        self,
+        messages: List[dict],
+        session_id: Optional[str] = None,
+        latency_target: Optional[float] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[str, Dict]:
+        """
+        Call the best-ranked model; on failure fall through to the next
+        A degraded primary drops down the ranking, so traffic shifts without a redeploy
+        """
+        logger.info("🔄 Running adaptive AGI orchestration...")
+        ranked = self.rank_models(self.routed_models, latency_target)
+        
+        for position, model in enumerate(ranked):
+            response = await self.call_provider(self.registry.get(model), messages, session_id=session_id, deadline=deadline)
+            if response.confidence > 0:
+                logger.info(f"✅ {model} succeeded (rank {position + 1})")
+                metadata = {
+                    "selected_model": model,
+                    "confidence": response.confidence,
+                    "reasoning": response.reasoning,
+                    "strategy": "adaptive",
+                    "ranking": ranked,
+                    "fallbacks": position
+                }
+                return response.content, metadata
+        
+        return "申し訳ございません。一時的なエラーが発生しました。", {"error": "all_failed"}
+    
+    async def _cascade_strategy(
+        self,
+        messages: List[dict],
+        session_id: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[str, Dict]:
         """
-        Use meta-AI to evaluate and combine multiple responses
+        Answer with the cheapest cascade model; score the answer locally and only
+        escalate to the next (more expensive) model when the score is below
+        cascade_threshold. If no answer reaches the threshold, the highest-scoring
+        one is returned
+        Routing rule: when the user says the last answer was wrong, start at the
+        strongest model
+        """
+        logger.info("🔄 Running cascade AGI orchestration...")
+        # Cheapest first; cost ties go to the higher static confidence
+        chain = sorted(
+            self.registry.active(self.cascade_models),
+            key=lambda spec: (sum(spec.cost), -spec.confidence)
+        )
+        if not chain:
+            return "申し訳ございません。一時的なエラーが発生しました。", {"error": "all_failed"}
+        self.stats["cascades"] += 1
+        
+        query = messages[-1]["content"] if messages else ""
+        previous = next((m["content"] for m in reversed(messages[:-1]) if m["role"] == "assistant"), None)
+        failure_system = get_failure_system(session_id) if session_id else None
+        if failure_system is not None and is_user_correction(query, failure_system):
+            self.stats["cascade_routed_strong"] += 1
+            chain = chain[-1:]
+        start = time.monotonic()
+        best: Optional[Tuple[float, AGIResponse]] = None
+        trail = []
+        
+        for level, spec in enumerate(chain):
+            response = await self.call_provider(spec, messages, session_id=session_id, deadline=deadline)
+            if response.confidence <= 0:
+                trail.append({"model": spec.name, "error": True})
+                continue
+            score, reasons = score_answer(
+                query,
+                response.content,
+                (response.metadata or {}).get("finish_reason"),
+                previous_response=previous,
+                failure_system=failure_system
+            )
+            trail.append({"model": spec.name, "score": round(score, 2), "reasons": reasons})
+            if best is None or score > best[0]:
+                best = (score, response)
+            if score >= self.cascade_threshold:
+                break
+            if level < len(chain) - 1:
+                logger.info(f"⤴️ Escalating from {spec.name} (score {score:.2f}: {', '.join(reasons)})")
+                for reason in reasons:
+                    counts = self.stats["cascade_low_score_reasons"]
+                    counts[reason] = counts.get(reason, 0) + 1
+        
+        elapsed = time.monotonic() - start
+        escalated = len(trail) > 1
+        self.stats["cascade_escalations"] += int(escalated)
+        # Latency saved: what the strongest model usually takes, minus what this turn took
+        # (negative when the cheap attempt was wasted)
+        strongest = self.router.health(chain[-1].name).latency_ewma
+        if strongest is not None:
+            self.stats["cascade_latency_saved_s"] += strongest - elapsed
+        
+        if best is None:
+            logger.error("All AGI models failed")
+            return "申し訳ございません。一時的なエラーが発生しました。", {"error": "all_failed"}
+        
+        score, response = best
+        answered_by = self.stats["cascade_answered_by"]
+        answered_by[response.model] = answered_by.get(response.model, 0) + 1
+        logger.info(f"✅ Cascade answered by {response.model} (score {score:.2f}, {len(trail)} call(s))")
+        
+        metadata = {
+            "selected_model": response.model,
+            "confidence": response.confidence,
+            "reasoning": response.reasoning,
+            "strategy": "cascade",
+            "score": round(score, 2),
+            "escalated": escalated,
+            "cascade": trail
+        }
+        return response.content, metadata
+    
+    async def _stateful_strategy(
+        self,
+        messages: List[dict],
+        session_id: Optional[str] = None,
+        latency_target: Optional[float] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[str, Dict]:
+        """
+        Continue the session's conversation on the provider (previous_response_id)
+        Only the new user message and system context the chain hasn't seen are sent;
+        when the chain is unusable or the provider has dropped it, the full packed
+        conversation is sent and a new chain starts. Falls back to "adaptive"
+        without a session or a model that keeps state
+        """
+        ranked = [
+            model for model in self.rank_models(self.routed_models, latency_target)
+            if self.registry.get(model).respond is not None
+        ]
+        if session_id is None or not ranked:
+            return await self._adaptive_strategy(messages, session_id, latency_target, deadline)
+        
+        logger.info("🔄 Running stateful AGI orchestration...")
+        spec = self.registry.get(ranked[0])
+        items, previous, sent = self.conversations.plan(session_id, spec.name, messages)
+        try:
+            response = await self._guarded_call(
+                spec, lambda budget: spec.respond(items, previous, budget, session_id), deadline
+            )
+        except ConversationStateExpired:
+            self.conversations.expire(session_id)
+            items, previous, sent = self.conversations.plan(session_id, spec.name, messages, retry=True)
+            response = await self._guarded_call(
+                spec, lambda budget: spec.respond(items, previous, budget, session_id), deadline
+            )
+        
+        if response.confidence <= 0:
+            # Nothing stored for this turn; the next one starts a new chain
+            self.conversations.drop(session_id)
+            return await self._adaptive_strategy(messages, session_id, latency_target, deadline)
+        
+        self.conversations.save(
+            session_id, spec.name, response.metadata["response_id"], response.content, sent, continued=previous is not None
+        )
+        logger.info(f"✅ {spec.name} answered ({'continued' if previous else 'new'} conversation, {len(items)} input messages)")
+        metadata = {
+            "selected_model": spec.name,
+            "confidence": response.confidence,
+            "reasoning": response.reasoning,
+            "strategy": "stateful",
+            "continued": previous is not None,
+            "input_messages": len(items)
+        }
+        return response.content, metadata
+    
+    async def _race_strategy(
+        self,
+        messages: List[dict],
+        session_id: Optional[str] = None,
+        latency_target: Optional[float] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[str, Dict]:
+        """
+        Run the race models concurrently and answer with the first response that
+        passes the quality gate; the outstanding calls are cancelled
+        If a model with higher static confidence is still running, wait up to
+        race_grace seconds (never past the latency target) for it before settling
+        """
+        logger.info("🔄 Running race AGI orchestration...")
+        self.stats["races"] += 1
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        
+        # Degraded models sit the race out unless nothing else is left
+        target = latency_target if latency_target is not None else self.latency_target
+        ranked = self.rank_models(self.race_models, target)
+        contestants = [m for m in ranked if self.router.is_healthy(m)] or ranked[:1]
+        tasks = {
+            asyncio.create_task(
+                self.call_provider(self.registry.get(model), messages, session_id=session_id, deadline=deadline)
+            ): model
+            for model in contestants
+        }
+        pending = set(tasks)
+        best: Optional[AGIResponse] = None
+        first_good_at = None
+        grace_deadline = None
+        try:
+            while pending:
+                timeout = None if grace_deadline is None else max(0.0, grace_deadline - loop.time())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break  # Grace window over
+                for task in done:
+                    response = task.result() if task.exception() is None else None
+                    if response is None or not self.passes_quality_gate(response):
+                        self.stats["race_rejected"] += 1
+                        continue
+                    if best is None:
+                        first_good_at = loop.time()
+                    elif response.confidence > best.confidence:
+                        self.stats["grace_upgrades"] += 1
+                    if best is None or response.confidence > best.confidence:
+                        best = response
+                if best is None:
+                    continue
+                # Only worth waiting for a model that could beat the current answer
+                better = [
+                    tasks[task] for task in pending
+                    if self.registry.get(tasks[task]).confidence > best.confidence
+                ]
+                if not better or self.race_grace <= 0:
+                    break
+                if grace_deadline is None:
+                    self.stats["grace_waits"] += 1
+                    grace_deadline = loop.time() + self.race_grace
+                    if target is not None:
+                        # Never wait past the request's latency target
+                        grace_deadline = min(grace_deadline, start + target)
+                    if deadline is not None:
+                        grace_deadline = min(grace_deadline, deadline)
+        finally:
+            for task in pending:
+                task.cancel()
+            self.stats["race_cancelled"] += len(pending)
+        
+        if best is None:
+            self.stats["race_all_failed"] += 1
+            logger.error("All AGI models failed")
+            return "申し訳ございません。一時的なエラーが発生しました。", {"error": "all_failed"}
+        
+        winners = self.stats["race_winners"]
+        winners[best.model] = winners.get(best.model, 0) + 1
+        logger.info(f"✅ Race won by {best.model} ({len(pending)} cancelled)")
+        
+        metadata = {
+            "selected_model": best.model,
+            "confidence": best.confidence,
+            "reasoning": best.reasoning,
+            "strategy": "race",
+            "first_answer_s": round(first_good_at - start, 3),
+            "cancelled": [tasks[task] for task in pending]
+        }
+        return best.content, metadata
+    
+    async def _meta_select_strategy(
+        self,
+        messages: List[dict],
+        session_id: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[str, Dict]:
+        """
+        Pick the best of several responses with the local re-ranker; use meta-AI
+        to evaluate and combine them only when the candidates really disagree
         """
         logger.info("🔄 Running meta-AI selection orchestration...")
         
-        # Run all models in parallel
+        # Run all enabled models in parallel
         tasks = [
-            self.call_gpt4(messages),
-            self.call_gemini(messages)
+            self.call_provider(spec, messages, session_id=session_id, deadline=deadline)
+            for spec in self.registry.active(self.default_models)
         ]
         
         responses = await asyncio.gather(*tasks, return_exceptions=True)
@@ -223,28 +689,59 @@ class MultiAGIOrchestrator:
             # Only one response, use it directly
             response = valid_responses[0]
             metadata = {
-                "selected_model": response.model.value,
+                "selected_model": response.model,
                 "confidence": response.confidence,
                 "reasoning": response.reasoning
             }
             return response.content, metadata
         
-        # Use meta-AI to evaluate responses
+        # Re-rank locally first: agreement, coverage of the query, failure patterns
+        self.stats["meta_selects"] += 1
+        query = messages[-1]["content"] if messages else ""
+        previous = next((m["content"] for m in reversed(messages[:-1]) if m["role"] == "assistant"), None)
+        ranked, agreement = rerank_answers(
+            query,
+            [r.content for r in valid_responses],
+            priors=[r.confidence for r in valid_responses],
+            finish_reasons=[(r.metadata or {}).get("finish_reason") for r in valid_responses],
+            previous_response=previous,
+            failure_system=get_failure_system(session_id) if session_id else None
+        )
+        best_response = valid_responses[ranked[0].index]
+        local_scores = {valid_responses[r.index].model: round(r.score, 3) for r in ranked}
+        margin = ranked[0].score - ranked[1].score
+        
+        if agreement >= self.meta_agreement_threshold or margin >= self.meta_margin:
+            self.stats["meta_local_picks"] += 1
+            logger.info(f"✅ Local re-ranker picked {best_response.model} (agreement {agreement:.2f}, margin {margin:.2f})")
+            metadata = {
+                "selected_model": best_response.model,
+                "confidence": best_response.confidence,
+                "reasoning": best_response.reasoning,
+                "strategy": "meta_select",
+                "models_used": [r.model for r in valid_responses],
+                "local_scores": local_scores,
+                "agreement": round(agreement, 3),
+                "judge": False
+            }
+            return best_response.content, metadata
+        
+        # The candidates really disagree: use meta-AI to evaluate responses
+        self.stats["meta_judge_calls"] += 1
         meta_prompt = self._build_meta_prompt(messages, valid_responses)
         
         try:
-            # Use GPT-4 as meta-AI
-            from openai import OpenAI
-            client = OpenAI(api_key=self.openai_api_key)
-            
-            loop = asyncio.get_event_loop()
-            meta_response = await loop.run_in_executor(
-                None,
-                lambda: client.chat.completions.create(
+            # Use GPT-4 as meta-AI; past the deadline fall back to the best single answer
+            remaining = None if deadline is None else max(0.0, deadline - asyncio.get_running_loop().time())
+            meta_response = await asyncio.wait_for(
+                get_llm_gateway().chat(
+                    [{"role": "user", "content": meta_prompt}],
                     model="gpt-4o-mini",
-                    messages=[{"role": "user", "content": meta_prompt}],
+                    call_site="meta_select",
+                    session_id=session_id,
                     temperature=0.3,  # Lower temperature for evaluation
-                )
+                ),
+                timeout=remaining
             )
             
             final_content = meta_response.choices[0].message.content
@@ -253,22 +750,44 @@ class MultiAGIOrchestrator:
             
             metadata = {
                 "strategy": "meta_select",
-                "models_used": [r.model.value for r in valid_responses],
-                "meta_ai": "gpt-4o-mini"
+                "models_used": [r.model for r in valid_responses],
+                "meta_ai": "gpt-4o-mini",
+                "local_scores": local_scores,
+                "agreement": round(agreement, 3),
+                "judge": True
             }
             
             return final_content, metadata
             
         except Exception as e:
             logger.error(f"Meta-AI failed: {str(e)}, falling back to best response")
-            best_response = max(valid_responses, key=lambda r: r.confidence)
             metadata = {
-                "selected_model": best_response.model.value,
+                "selected_model": best_response.model,
                 "confidence": best_response.confidence,
                 "fallback": True
             }
             return best_response.content, metadata
     
+    def get_stats(self) -> Dict:
+        cascades = self.stats["cascades"]
+        return {
+            **self.stats,
+            "race_winners": dict(self.stats["race_winners"]),
+            "race_models": self.race_models,
+            "race_grace": self.race_grace,
+            "cascade_answered_by": dict(self.stats["cascade_answered_by"]),
+            "cascade_low_score_reasons": dict(self.stats["cascade_low_score_reasons"]),
+            "cascade_escalation_rate": self.stats["cascade_escalations"] / cascades if cascades else 0.0,
+            "cascade_latency_saved_s": round(self.stats["cascade_latency_saved_s"], 3),
+            "abandoned_by_model": dict(self.stats["abandoned_by_model"]),
+            "meta_judge_rate": self.stats["meta_judge_calls"] / self.stats["meta_selects"] if self.stats["meta_selects"] else 0.0,
+            "cascade_models": self.cascade_models,
+            "cascade_threshold": self.cascade_threshold,
+            "routing": self.router.get_stats(),
+            "conversations": self.conversations.get_stats(),
+            "providers": self.registry.get_stats()
+        }
+    
     def _build_meta_prompt(self, original_messages: List[dict], responses: List[AGIResponse]) -> str:
         """Build prompt for meta-AI to evaluate responses"""
         
@@ -288,7 +807,7 @@ class MultiAGIOrchestrator:
         
         for i, response in enumerate(responses, 1):
             prompt += f"""
-【応答 {i}】 ({response.model.value})
+【応答 {i}】 ({response.model})
 信頼度: {response.confidence}
 理由: {response.reasoning}
 内容:
@@ -318,6 +837,34 @@ def get_orchestrator(strategy: str = "parallel") -> MultiAGIOrchestrator:
     global _orchestrator
     if _orchestrator is None:
         openai_api_key = os.getenv("OPENAI_API_KEY", "")
-        _orchestrator = MultiAGIOrchestrator(openai_api_key)
+        race_models = [m.strip() for m in os.getenv("RACE_MODELS", "gpt-4o-mini,gpt-4.1-mini").split(",") if m.strip()]
+        routed_models = [m.strip() for m in os.getenv("ROUTED_MODELS", "gpt-4o-mini,gpt-4.1-mini").split(",") if m.strip()]
+        cascade_models = [m.strip() for m in os.getenv("CASCADE_MODELS", "gpt-4o-mini,gpt-4.1-mini").split(",") if m.strip()]
+        latency_target_ms = float(os.getenv("CHAT_LATENCY_TARGET_MS", "0"))
+        registry = default_registry()
+        for name in os.getenv("AGI_DISABLED_PROVIDERS", "").split(","):
+            name = name.strip()
+            if not name:
+                continue
+            if name not in registry.names():
+                logger.warning(f"AGI_DISABLED_PROVIDERS: unknown provider '{name}' ignored (known: {registry.names()})")
+                continue
+            registry.set_enabled(name, False)
+        _orchestrator = MultiAGIOrchestrator(
+            openai_api_key,
+            registry=registry,
+            race_models=race_models,
+            race_grace=float(os.getenv("RACE_GRACE_MS", "300")) / 1000,
+            routed_models=routed_models,
+            latency_target=latency_target_ms / 1000 if latency_target_ms > 0 else None,
+            cascade_models=cascade_models,
+            cascade_threshold=float(os.getenv("CASCADE_THRESHOLD", "0.6")),
+            meta_agreement_threshold=float(os.getenv("META_AGREEMENT_THRESHOLD", "0.25")),
+            meta_margin=float(os.getenv("META_MARGIN", "0.1")),
+            conversations=ConversationStateStore(
+                ttl=float(os.getenv("CONVERSATION_STATE_TTL", "3600")),
+                max_turns=int(os.getenv("CONVERSATION_STATE_MAX_TURNS", "20"))
+            )
+        )
     return _orchestrator
 
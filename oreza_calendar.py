@@ -3,12 +3,11 @@ Oreza AIカレンダー v1
 自然文から予定・タスクを作成し、検索結果から予定に変換する機能を提供
 """
 
-import os
 import json
 import logging
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
-from openai import OpenAI
+from llm_gateway import get_llm_gateway
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,14 +16,10 @@ class OrezaCalendar:
     """Oreza AIカレンダーのコアクラス"""
     
     def __init__(self):
-        self.client = OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            base_url="https://api.openai.com/v1"
-        )
         self.events = []  # v1では in-memory（将来的にDB化）
         self.tasks = []
         
-    def parse_natural_language(self, text: str) -> Dict:
+    async def parse_natural_language(self, text: str) -> Dict:
         """
         自然文を解析してイベント/タスクのJSONに変換
         
@@ -59,12 +54,14 @@ class OrezaCalendar:
 """
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
+            response = await get_llm_gateway().chat(
+                [
                     {"role": "system", "content": "あなたは予定・タスク抽出の専門家です。"},
                     {"role": "user", "content": prompt}
                 ],
+                model="gpt-4o-mini",
+                call_site="calendar_parse",
+                cache=True,
                 temperature=0.3
             )
             
@@ -90,7 +87,7 @@ class OrezaCalendar:
                 "priority": "medium"
             }
     
-    def parse_search_result(self, title: str, url: str, snippet: str) -> Dict:
+    async def parse_search_result(self, title: str, url: str, snippet: str) -> Dict:
         """
         検索結果から予定/タスクのテンプレートを生成
         
@@ -124,12 +121,14 @@ URL: {url}
 """
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
+            response = await get_llm_gateway().chat(
+                [
                     {"role": "system", "content": "あなたは検索結果から予定・タスクを抽出する専門家です。"},
                     {"role": "user", "content": prompt}
                 ],
+                model="gpt-4o-mini",
+                call_site="calendar_from_search",
+                cache=True,
                 temperature=0.3
             )
             
@@ -7,16 +7,9 @@ Oreza AIカレンダー v2
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 from pydantic import BaseModel
-import os
-from openai import OpenAI
 import json
 import re
-
-# OpenAI APIクライアント
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url="https://api.openai.com/v1"
-)
+from llm_gateway import get_llm_gateway
 
 # ===== データモデル =====
 
@@ -164,7 +157,7 @@ def learn_from_event(event: Event):
 
 # ===== 自然文パーサー（AI） =====
 
-def parse_natural_language_v2(text: str) -> Dict:
+async def parse_natural_language_v2(text: str, session_id: Optional[str] = None) -> Dict:
     """
     自然文から予定情報を抽出（v2: カレンダー推定付き）
     """
@@ -186,12 +179,15 @@ JSON形式で返してください。
 """
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
+        response = await get_llm_gateway().chat(
+            [
                 {"role": "system", "content": "あなたは予定情報を抽出する専門家です。"},
                 {"role": "user", "content": prompt}
             ],
+            model="gpt-4o-mini",
+            call_site="calendar_parse_v2",
+            session_id=session_id,
+            cache=True,
             temperature=0.3
         )
         
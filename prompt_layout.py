@@ -0,0 +1,53 @@
+"""
+Prompt Layout
+Orders chat messages so the provider's prompt cache can reuse the prefix:
+1. Static instructions and few-shot examples (byte-identical on every call)
+2. Conversation history (append-only, so earlier turns keep their position)
+3. Volatile context (current time, emotion, themes, summary, search info, memories)
+4. The new user message
+Anything that changes per call must go in 3 or 4; a single changed byte in
+the prefix invalidates the cache for everything after it
+"""
+
+import hashlib
+import logging
+from typing import Dict, List, Sequence
+
+from context_packer import count_message_tokens
+
+logger = logging.getLogger("prompt_layout")
+
+# Providers only cache prompts from this length on (OpenAI: 1024 tokens)
+MIN_CACHEABLE_PREFIX_TOKENS = 1024
+
+class PromptLayout:
+    """Fixed static prefix (system prompt + few-shots) for one call site"""
+
+    def __init__(self, name: str, system_prompt: str, few_shots: Sequence[Dict] = ()):
+        self.name = name
+        self.static: List[Dict] = [{"role": "system", "content": system_prompt}]
+        for example in few_shots:
+            self.static.append({"role": "user", "content": example["user"]})
+            self.static.append({"role": "assistant", "content": example["assistant"]})
+        self.prefix_tokens = sum(count_message_tokens(m) for m in self.static)
+        self.prefix_hash = hashlib.sha256(
+            "\x00".join(m["content"] for m in self.static).encode("utf-8")
+        ).hexdigest()[:16]
+        if self.prefix_tokens < MIN_CACHEABLE_PREFIX_TOKENS:
+            logger.info(
+                f"[{name}] Static prefix is {self.prefix_tokens} tokens; "
+                f"provider caching starts at {MIN_CACHEABLE_PREFIX_TOKENS}"
+            )
+
+    def compile(
+        self,
+        latest: Dict,
+        volatile: Sequence[str] = (),
+        history: Sequence[Dict] = ()
+    ) -> List[Dict]:
+        """Static prefix, history, volatile system notes, then the new message"""
+        notes = [{"role": "system", "content": text} for text in volatile if text]
+        return [dict(m) for m in self.static] + list(history) + notes + [latest]
+
+    def get_stats(self) -> Dict:
+        return {"prefix_tokens": self.prefix_tokens, "prefix_hash": self.prefix_hash}
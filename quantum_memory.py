@@ -9,6 +9,8 @@ from dataclasses import dataclass, field
 from datetime import datetime
 import json
 
+from context_packer import count_tokens
+
 logger = logging.getLogger("quantum_memory")
 
 @dataclass
@@ -33,19 +35,62 @@ class MemoryNode:
         # Importance increases with access, but with diminishing returns
         self.importance = min(1.0, self.importance + 0.1 / (1 + self.access_count * 0.1))
 
+def index_terms(text: str) -> Set[str]:
+    """
+    Character unigrams and bigrams of lowercased text
+    Any substring of length >= 2 contains only bigrams of the text, so
+    postings can narrow down a substring search without word boundaries (Japanese)
+    """
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
 @dataclass
 class QuantumMemoryLayer:
     """
     A layer of quantum memory (immediate, short-term, long-term, meta)
+    Keeps an inverted index (character unigrams / bigrams -> node ids),
+    updated incrementally on add and prune
     """
     name: str
     capacity: int  # Maximum number of nodes
     decay_rate: float  # How quickly memories fade (0.0 to 1.0)
     nodes: Dict[str, MemoryNode] = field(default_factory=dict)
+    _postings: Dict[str, Set[str]] = field(default_factory=dict, init=False, repr=False)
+    _lowered: Dict[str, str] = field(default_factory=dict, init=False, repr=False)
+    _order: Dict[str, int] = field(default_factory=dict, init=False, repr=False)  # Insertion order, for ties
+    _added: int = field(default=0, init=False, repr=False)
+    
+    def __post_init__(self):
+        for node in self.nodes.values():
+            self._index(node)
+    
+    def _index(self, node: MemoryNode):
+        content_lower = node.content.lower()
+        self._lowered[node.id] = content_lower
+        if node.id not in self._order:
+            self._order[node.id] = self._added
+            self._added += 1
+        for term in index_terms(content_lower):
+            self._postings.setdefault(term, set()).add(node.id)
+    
+    def _unindex(self, node_id: str):
+        content_lower = self._lowered.pop(node_id, None)
+        if content_lower is None:
+            return
+        if node_id not in self.nodes:
+            self._order.pop(node_id, None)
+        for term in index_terms(content_lower):
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.discard(node_id)
+                if not posting:
+                    del self._postings[term]
     
     def add(self, node: MemoryNode):
         """Add a memory node to this layer"""
+        if node.id in self.nodes:
+            self._unindex(node.id)
         self.nodes[node.id] = node
+        self._index(node)
         
         # If over capacity, remove least important memories
         if len(self.nodes) > self.capacity:
@@ -67,24 +112,37 @@ class QuantumMemoryLayer:
         for node_id, _ in sorted_nodes[:to_remove]:
             logger.info(f"Pruning memory from {self.name}: {node_id}")
             del self.nodes[node_id]
+            self._unindex(node_id)
+    
+    def _matches(self, word: str) -> Set[str]:
+        """Ids of nodes whose content contains word"""
+        terms = {word} if len(word) == 1 else {word[i:i + 2] for i in range(len(word) - 1)}
+        postings = sorted((self._postings.get(term, set()) for term in terms), key=len)
+        if not postings[0]:
+            return set()
+        candidates = postings[0].intersection(*postings[1:])
+        if len(word) <= 2:
+            return candidates
+        # Bigrams present in any order don't make a substring; confirm on the few candidates left
+        return {node_id for node_id in candidates if word in self._lowered[node_id]}
     
     def search(self, query: str, top_k: int = 5) -> List[MemoryNode]:
         """
         Search for relevant memories
         Simple keyword-based search (can be enhanced with embeddings)
+        Only nodes in the postings of the query words are scored
         """
         results = []
-        query_lower = query.lower()
         
-        for node in self.nodes.values():
-            # Simple relevance score based on keyword match
-            content_lower = node.content.lower()
-            relevance = 0.0
-            
-            for word in query_lower.split():
-                if word in content_lower:
-                    relevance += 1.0
-            
+        # Simple relevance score based on keyword match
+        hits: Dict[str, float] = {}
+        for word in query.lower().split():
+            for node_id in self._matches(word):
+                hits[node_id] = hits.get(node_id, 0.0) + 1.0
+        
+        for node_id in sorted(hits, key=self._order.__getitem__):
+            relevance = hits[node_id]
+            node = self.nodes[node_id]
             # Boost by importance and access count
             relevance *= node.importance * (1 + node.access_count * 0.05)
             
@@ -242,12 +300,17 @@ class QuantumConsciousnessMemory:
             layers = ["immediate", "short_term", "long_term", "meta"]
         
         all_results = []
+        seen_ids = set()
         
         for layer_name in layers:
             layer = getattr(self, layer_name, None)
             if layer:
                 results = layer.search(query, top_k=top_k)
-                all_results.extend(results)
+                # A node can live in several layers; return it once
+                for node in results:
+                    if node.id not in seen_ids:
+                        seen_ids.add(node.id)
+                        all_results.append(node)
         
         # Sort by importance and return top k
         all_results.sort(key=lambda n: n.importance * (1 + n.access_count * 0.05), reverse=True)
@@ -276,16 +339,16 @@ class QuantumConsciousnessMemory:
         current_tokens = 0
         
         for node in relevant_memories:
-            # Estimate tokens (rough: 1 token ≈ 2 characters for Japanese)
-            estimated_tokens = len(node.content) // 2
+            # Format memory with timestamp and importance
+            time_str = node.timestamp.strftime("%Y-%m-%d %H:%M")
+            line = f"[{time_str}] {node.content}"
+            line_tokens = count_tokens(line)
             
-            if current_tokens + estimated_tokens > max_tokens:
+            if current_tokens + line_tokens > max_tokens:
                 break
             
-            # Format memory with timestamp and importance
-            time_str = node.timestamp.strftime("%Y-%m-%d %H:%M")
-            context_parts.append(f"[{time_str}] {node.content}")
-            current_tokens += estimated_tokens
+            context_parts.append(line)
+            current_tokens += line_tokens
         
         return "\n".join(context_parts)
     
@@ -356,3 +419,7 @@ def get_quantum_memory(session_id: str) -> QuantumConsciousnessMemory:
         logger.info(f"Created quantum memory for session {session_id}")
     return _memory_instances[session_id]
 
+def clear_quantum_memory(session_id: str):
+    """Drop the quantum memory for a session"""
+    if _memory_instances.pop(session_id, None) is not None:
+        logger.info(f"Cleared quantum memory for session {session_id}")
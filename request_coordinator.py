@@ -0,0 +1,133 @@
+"""
+Chat Request Coordinator
+- Idempotent submissions: a duplicate of an in-flight request attaches to the
+  running computation; a duplicate of a recently finished one gets its result
+- Per-session serialization: requests for the same session run strictly in
+  order, with a queue depth limit so a stuck session can't pile up work
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("request_coordinator")
+
+class SessionQueueFull(Exception):
+    """Too many requests are already queued for this session"""
+    pass
+
+class SessionRequestCoordinator:
+    """Coordinates chat requests per session and per idempotency key"""
+
+    def __init__(self, max_queue_depth: int = 3, result_ttl: float = 300, max_results: int = 1000):
+        self.max_queue_depth = max_queue_depth  # Running + waiting requests per session
+        self.result_ttl = result_ttl  # How long finished results answer retries
+        self.max_results = max_results
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._depth: Dict[str, int] = {}
+        # Idempotency keys come from clients, so they are scoped to the session
+        # that sent them; another session reusing a key must not see its result
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._results: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()  # {(session, key): (expires_at, result)}
+        self.stats = {
+            "requests": 0,
+            "attached": 0,
+            "replayed": 0,
+            "rejected": 0,
+            "max_depth_seen": 0
+        }
+
+    def check_capacity(self, session_key: str):
+        """Raise SessionQueueFull if the session's queue is full"""
+        if self._depth.get(session_key, 0) >= self.max_queue_depth:
+            self.stats["rejected"] += 1
+            logger.warning(f"[{session_key}] Request rejected: queue depth {self.max_queue_depth} reached")
+            raise SessionQueueFull(session_key)
+
+    @asynccontextmanager
+    async def session_slot(self, session_key: str):
+        """Hold the session's turn; requests for the same session run in arrival order"""
+        self.check_capacity(session_key)
+        depth = self._depth.get(session_key, 0) + 1
+        self._depth[session_key] = depth
+        self.stats["max_depth_seen"] = max(self.stats["max_depth_seen"], depth)
+        lock = self._locks.setdefault(session_key, asyncio.Lock())
+        try:
+            async with lock:
+                yield
+        finally:
+            self._depth[session_key] -= 1
+            if self._depth[session_key] == 0:
+                # Nobody is holding or waiting for the lock
+                del self._depth[session_key]
+                self._locks.pop(session_key, None)
+
+    def _get_result(self, key: Tuple[str, str]) -> Optional[Any]:
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._results[key]
+            return None
+        return result
+
+    def _on_done(self, key: Tuple[str, str], task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._results[key] = (time.monotonic() + self.result_ttl, task.result())
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    async def run(
+        self,
+        session_key: str,
+        idempotency_key: Optional[str],
+        factory: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Run factory() in the session's turn, deduplicated by idempotency_key
+        within the session
+        The computation runs as its own task, so a client that disconnects
+        (e.g. a PWA timeout) doesn't cancel the work its retry will attach to
+        """
+        self.stats["requests"] += 1
+
+        key = (session_key, idempotency_key) if idempotency_key else None
+        if key is not None:
+            result = self._get_result(key)
+            if result is not None:
+                self.stats["replayed"] += 1
+                logger.info(f"[{session_key}] Replaying finished request {idempotency_key}")
+                return result
+
+            task = self._inflight.get(key)
+            if task is not None:
+                self.stats["attached"] += 1
+                logger.info(f"[{session_key}] Attaching to in-flight request {idempotency_key}")
+                return await asyncio.shield(task)
+
+        self.check_capacity(session_key)
+
+        async def guarded():
+            async with self.session_slot(session_key):
+                return await factory()
+
+        task = asyncio.create_task(guarded())
+        if key is not None:
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "inflight": len(self._inflight),
+            "cached_results": len(self._results),
+            "busy_sessions": len(self._depth)
+        }
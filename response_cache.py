@@ -0,0 +1,210 @@
+"""
+Semantic Response Cache
+Caches chat answers in front of MultiAGIOrchestrator.orchestrate.
+Key: normalized user message + hash of everything else the model sees
+(system prompt and the earlier turns), matched exactly or by embedding
+similarity above a threshold. Follow-ups like "tell me more about that"
+only hit answers given after the same history
+"""
+
+import hashlib
+import logging
+import math
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from llm_gateway import get_llm_gateway
+
+logger = logging.getLogger("response_cache")
+
+Embedder = Callable[[str], Awaitable[List[float]]]
+
+@dataclass
+class CacheEntry:
+    """A cached answer"""
+    message: str  # Normalized user message
+    context_hash: str
+    response: str
+    metadata: Dict
+    expires_at: float
+    embedding: Optional[List[float]] = None
+    hits: int = 0
+    created_at: float = field(default_factory=time.time)
+
+# Explicit back-references skip the cache altogether; other follow-ups ("その2つの違いは？")
+# are kept apart by the history in the context hash
+CONTEXT_REFERENCE_MARKERS = [
+    "先ほど", "さきほど", "さっき", "上記", "続き", "前回", "前の回答", "もっと詳しく",
+    "earlier", "above", "you said", "previous answer", "go on",
+]
+
+def is_cacheable(message: str) -> bool:
+    """Self-contained messages only"""
+    text = normalize_message(message)
+    if len(text) < 4:
+        return False
+    words = set(re.findall(r"[a-z]+", text))
+    for marker in CONTEXT_REFERENCE_MARKERS:
+        if (marker in words) if marker.isascii() and " " not in marker else (marker in text):
+            return False
+    return True
+
+def openai_embedder(model: str = "text-embedding-3-small") -> Embedder:
+    """Embedder backed by the OpenAI embeddings API"""
+    async def embed(text: str) -> List[float]:
+        return await get_llm_gateway().embed(text, model=model, call_site="response_cache_embedding")
+    return embed
+
+def normalize_message(message: str) -> str:
+    """Normalize width, case, whitespace and trailing punctuation"""
+    text = unicodedata.normalize("NFKC", message).lower().strip()
+    text = re.sub(r"\s+", " ", text)
+    return re.sub(r"[?？!！。.、,]+$", "", text)
+
+def hash_context(messages: List[Dict]) -> str:
+    """
+    Hash of the effective prompt without the final user message: every system
+    message and the earlier user/assistant turns, which pronoun follow-ups refer to
+    """
+    context = messages[:-1] if messages and messages[-1].get("role") == "user" else messages
+    text = "\n".join(f"{m.get('role')}\n{m.get('content', '')}" for m in context)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+class SemanticResponseCache:
+    """
+    Two-tier lookup:
+    1. Exact match on (normalized message, context hash)
+    2. Embedding similarity >= threshold among entries with the same context hash
+    Entries expire by TTL; the least recently used entry is evicted when full
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[Embedder] = None,
+        max_entries: int = 1000,
+        ttl: float = 3600,
+        search_ttl: float = 300,
+        similarity_threshold: float = 0.95
+    ):
+        self.embedder = embedder
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.search_ttl = search_ttl  # Answers built from auto-search go stale quickly
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Tuple[str, str], CacheEntry]" = OrderedDict()
+        self.stats = {
+            "lookups": 0,
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "embedding_errors": 0
+        }
+
+    async def _embed(self, text: str) -> Optional[List[float]]:
+        if self.embedder is None:
+            return None
+        try:
+            return await self.embedder(text)
+        except Exception as e:
+            self.stats["embedding_errors"] += 1
+            logger.warning(f"Embedding failed, exact-match only: {e}")
+            return None
+
+    def _expire(self):
+        now = time.time()
+        expired = [key for key, entry in self._entries.items() if entry.expires_at < now]
+        for key in expired:
+            del self._entries[key]
+        self.stats["expirations"] += len(expired)
+
+    async def lookup(self, user_message: str, messages: List[Dict]) -> Tuple[Optional[CacheEntry], Optional[List[float]]]:
+        """
+        Find a cached answer
+
+        Returns:
+            (entry or None, embedding of the message for a later store)
+        """
+        self.stats["lookups"] += 1
+        self._expire()
+
+        key = (normalize_message(user_message), hash_context(messages))
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            self.stats["exact_hits"] += 1
+            return entry, None
+
+        embedding = None
+        candidates = [e for e in self._entries.values() if e.context_hash == key[1] and e.embedding]
+        if candidates:
+            embedding = await self._embed(key[0])
+        if embedding is not None:
+            best, best_score = None, 0.0
+            for candidate in candidates:
+                score = cosine_similarity(embedding, candidate.embedding)
+                if score > best_score:
+                    best, best_score = candidate, score
+            if best is not None and best_score >= self.similarity_threshold:
+                self._entries.move_to_end((best.message, best.context_hash))
+                best.hits += 1
+                self.stats["semantic_hits"] += 1
+                logger.info(f"Semantic cache hit ({best_score:.3f}): {best.message[:50]}")
+                return best, embedding
+
+        self.stats["misses"] += 1
+        return None, embedding
+
+    async def store(
+        self,
+        user_message: str,
+        messages: List[Dict],
+        response: str,
+        metadata: Dict,
+        used_search: bool = False,
+        embedding: Optional[List[float]] = None
+    ):
+        """Cache an answer; answers that used auto-search get the short TTL"""
+        normalized = normalize_message(user_message)
+        if embedding is None:
+            embedding = await self._embed(normalized)
+
+        entry = CacheEntry(
+            message=normalized,
+            context_hash=hash_context(messages),
+            response=response,
+            metadata=metadata,
+            expires_at=time.time() + (self.search_ttl if used_search else self.ttl),
+            embedding=embedding
+        )
+        key = (entry.message, entry.context_hash)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self.stats["stores"] += 1
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get_stats(self) -> Dict:
+        """Hit/miss counters for sizing the cache"""
+        lookups = self.stats["lookups"] or 1
+        hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+        return {
+            **self.stats,
+            "hit_rate": hits / lookups,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries
+        }
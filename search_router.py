@@ -0,0 +1,217 @@
+"""
+Search Decision Router
+Local first-tier classifier in front of AIAutoSearch.should_search:
+obvious messages are settled in microseconds, only the ambiguous middle
+goes to the LLM
+"""
+
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger("search_router")
+
+# Time-sensitive requests: always need fresh information
+# Anchored to information-seeking forms; bare substrings like "レート" or "今日の"
+# also occur in chocolate, newsletters and calendar requests
+TIME_SENSITIVE_PATTERNS = [
+    r"最新", r"の天気", r"天気(は|を教え|予報)", r"株価", r"ニュース(?!レター)", r"速報", r"為替",
+    r"(ドル|円|ユーロ|ポンド|元)の?レート", r"(?<![ァ-ヴー])レート(は|を教え)",
+    r"(今日|明日|今週|今年)の(天気|ニュース|株価|試合|結果)", r"現在の(気温|株価|状況は)",
+    r"営業時間", r"開催日", r"発売日",
+    r"\b(what's|what is|how's|how is) the (latest|weather)\b", r"\bweather (in|for|today|tomorrow|forecast)\b",
+    r"\b(latest|today's|breaking) (news|version|release)\b", r"\bnews (about|on)\b", r"\bstock price",
+]
+
+# Fact-seeking question forms ("いつも", "どこか", "誰か" are not questions)
+FACT_QUESTION_PATTERNS = [
+    r"いつ(?!も|か|で)", r"どこ(?!か|でも)", r"いくら(?!でも)", r"誰(?!か|も|でも)", r"だれ(?!か|も)",
+    r"何時", r"何年", r"何人", r"何円", r"とは[?？]?$", r"って何", r"ってなに", r"\bwho (is|was)\b",
+    r"\bwhat is\b", r"\bwhen (is|was|does|did)\b", r"\bwhere (is|can)\b",
+    r"\bhow much\b",
+]
+
+# Follow-ups whose subject is only a demonstrative: the subject is the previous
+# turn, so a search query built from the message would find nothing useful
+FOLLOW_UP_PATTERNS = [
+    r"^(それ|これ|あれ)(?!ぞれ|で|から|と|に|ほど|まで|だけ)", r"^(その|この|あの)", r"^\d+(番目|つ目)",
+    r"^(and |so )?(what|why|how|who|when|where)('s| is| was| does| did)? (that|this|it)\b",
+    r"^how much (is|was|does|did) (that|this|it)\b", r"\b(more|about) (that|this|it)$",
+]
+
+# Messages at most this long (normalized) can be settled as follow-ups
+FOLLOW_UP_MAX_LENGTH = 30
+
+# Opinion / conversational question forms (no search needed)
+OPINION_QUESTION_PATTERNS = [
+    r"どう思う", r"どうしたら", r"どうすれば", r"おすすめ", r"アドバイス",
+    r"相談", r"手伝って", r"書いて", r"考えて", r"翻訳",
+]
+
+GREETING_KEYWORDS = [
+    "こんにちは", "こんばんは", "おはよう", "はじめまして", "よろしく",
+    "おやすみ", "やあ", "hello", "hi", "hey",
+]
+
+THANKS_KEYWORDS = [
+    "ありがとう", "ありがと", "サンキュー", "助かった", "助かります",
+    "了解", "わかった", "なるほど", "thanks", "thank you", "ok",
+]
+
+# Messages at most this long (normalized) can be settled as small talk
+SMALL_TALK_MAX_LENGTH = 20
+
+class SearchDecisionRouter:
+    """
+    Tiered search decision:
+    1. Per-message decision cache
+    2. Local rule classifier: small talk, opinion requests and demonstrative-only
+       follow-ups first (no search), then time-sensitive and fact-seeking question forms
+    3. LLM fallback (AIAutoSearch.should_search) for everything else
+    """
+
+    def __init__(self, auto_search, cache_size: int = 1000, cache_ttl: float = 3600):
+        self.auto_search = auto_search
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()  # {normalized: (expires_at, decision)}
+        self._time_re = re.compile("|".join(TIME_SENSITIVE_PATTERNS), re.IGNORECASE)
+        self._fact_re = re.compile("|".join(FACT_QUESTION_PATTERNS), re.IGNORECASE)
+        self._opinion_re = re.compile("|".join(OPINION_QUESTION_PATTERNS), re.IGNORECASE)
+        self._follow_up_re = re.compile("|".join(FOLLOW_UP_PATTERNS), re.IGNORECASE)
+        self.stats = {
+            "total": 0,
+            "cache_hits": 0,
+            "local_hits": 0,
+            "llm_fallbacks": 0,
+            "llm_errors": 0,
+            "by_rule": {}
+        }
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        """Normalize width, case and whitespace for rule matching and caching"""
+        text = unicodedata.normalize("NFKC", message).lower().strip()
+        return re.sub(r"\s+", " ", text)
+
+    @staticmethod
+    def _make_query(message: str) -> str:
+        """Turn a message into a compact search query"""
+        query = re.sub(r"[?？!！。、,]+", " ", message).strip()
+        return re.sub(r"\s+", " ", query)[:100]
+
+    @staticmethod
+    def _contains_keyword(text: str, keywords) -> bool:
+        """Substring match for Japanese, whole-word match for short English keywords"""
+        words = set(re.findall(r"[a-z]+", text))
+        for keyword in keywords:
+            if keyword.isascii() and " " not in keyword:
+                if keyword in words:
+                    return True
+            elif keyword in text:
+                return True
+        return False
+
+    def classify_local(self, message: str) -> Optional[Dict]:
+        """
+        First-tier classifier
+        Returns a decision dict, or None if the message is ambiguous
+        """
+        text = self.normalize(message)
+        if not text:
+            return {"should_search": False, "query": "", "rule": "empty"}
+
+        is_question = "?" in text or text.endswith(("か", "の"))
+
+        # Rules that rule a search out go first; a false "search" costs a Google call
+        if len(text) <= SMALL_TALK_MAX_LENGTH and not is_question:
+            if self._contains_keyword(text, THANKS_KEYWORDS):
+                return {"should_search": False, "query": "", "rule": "thanks"}
+            if self._contains_keyword(text, GREETING_KEYWORDS):
+                return {"should_search": False, "query": "", "rule": "greeting"}
+
+        if self._opinion_re.search(text):
+            return {"should_search": False, "query": "", "rule": "opinion_question"}
+
+        # "それって何", "その2つの違いは？", "tell me more about that"
+        if len(text) <= FOLLOW_UP_MAX_LENGTH and self._follow_up_re.search(text.rstrip("?？")):
+            return {"should_search": False, "query": "", "rule": "contextual_follow_up"}
+
+        if self._time_re.search(text):
+            return {"should_search": True, "query": self._make_query(message), "rule": "time_sensitive"}
+
+        if self._fact_re.search(text):
+            return {"should_search": True, "query": self._make_query(message), "rule": "fact_question"}
+
+        # Not sure: let the LLM decide
+        return None
+
+    def _cache_get(self, key: str) -> Optional[Dict]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, decision = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return decision
+
+    def _cache_put(self, key: str, decision: Dict):
+        self._cache[key] = (time.monotonic() + self.cache_ttl, decision)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def should_search(self, user_message: str, session_id: Optional[str] = None) -> Dict:
+        """
+        Drop-in replacement for AIAutoSearch.should_search
+
+        Returns:
+            {"should_search": bool, "query": str, "tier": "cache"|"local"|"llm"}
+        """
+        self.stats["total"] += 1
+        key = self.normalize(user_message)
+
+        cached = self._cache_get(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return {**cached, "tier": "cache"}
+
+        decision = self.classify_local(user_message)
+        if decision is not None:
+            self.stats["local_hits"] += 1
+            rule = decision.pop("rule")
+            self.stats["by_rule"][rule] = self.stats["by_rule"].get(rule, 0) + 1
+            logger.info(f"Local search decision ({rule}): {decision}")
+            self._cache_put(key, decision)
+            return {**decision, "tier": "local"}
+
+        # Ambiguous: ask the LLM
+        self.stats["llm_fallbacks"] += 1
+        result = await self.auto_search.should_search(user_message, session_id=session_id)
+        decision = {
+            "should_search": bool(result.get("should_search", False)),
+            "query": result.get("query", "") or ""
+        }
+        # should_search returns a negative decision on error; don't cache those
+        if "error" in result:
+            self.stats["llm_errors"] += 1
+        else:
+            self._cache_put(key, decision)
+        return {**decision, "tier": "llm"}
+
+    def get_stats(self) -> Dict:
+        """Hit and fallback rates for tuning the local rules"""
+        total = self.stats["total"] or 1
+        return {
+            **self.stats,
+            "by_rule": dict(self.stats["by_rule"]),
+            "cache_hit_rate": self.stats["cache_hits"] / total,
+            "local_hit_rate": self.stats["local_hits"] / total,
+            "llm_fallback_rate": self.stats["llm_fallbacks"] / total,
+            "cache_size": len(self._cache)
+        }
@@ -3,11 +3,11 @@ Oreza Shopping Module
 AI-powered shopping assistant with product search and recommendations
 """
 
-import os
 import logging
 from typing import List, Dict, Optional
 from dataclasses import dataclass
 from google_search import GoogleSearch
+from llm_gateway import get_llm_gateway
 
 logger = logging.getLogger("oreza_shopping")
 
@@ -24,6 +24,46 @@ class ProductCard:
     stock_status: Optional[str] = None
     ai_summary: Optional[Dict] = None  # AI-generated summary
     
+# analyze_product request; shopping_batch.py builds identical requests so its
+# results land under the same LLM result cache keys
+ANALYSIS_MODEL = "gpt-4o-mini"
+ANALYSIS_PARAMS = {"temperature": 0.7}
+
+def analysis_messages(product: ProductCard, user_context: Optional[str] = None) -> List[Dict]:
+    """Chat messages for the AI analysis of a product"""
+    prompt = f"""
+以下の商品について、AIソムリエとして分析してください。
+
+【商品情報】
+タイトル: {product.title}
+価格: {product.price}
+URL: {product.product_url}
+
+【ユーザー情報】
+{user_context or "一般ユーザー"}
+
+【分析項目】
+1. 強み（3点以内）
+2. シルエット・デザイン
+3. 注意点
+4. 向いている人
+5. 向いていない人
+
+JSON形式で返してください：
+{{
+  "strengths": ["強み1", "強み2", "強み3"],
+  "silhouette": "シルエットの説明",
+  "cautions": "注意点",
+  "suitable_for": "向いている人",
+  "not_suitable_for": "向いていない人",
+  "one_line_summary": "一言で商品を表現"
+}}
+"""
+    return [
+        {"role": "system", "content": "あなたは商品分析のプロフェッショナルなAIソムリエです。"},
+        {"role": "user", "content": prompt}
+    ]
+
 class AIShoppingSommelier:
     """
     AI Shopping Sommelier
@@ -93,61 +133,27 @@ class AIShoppingSommelier:
         
         return "価格不明"
     
-    async def analyze_product(self, product: ProductCard, user_context: Optional[str] = None) -> Dict:
+    async def analyze_product(self, product: ProductCard, user_context: Optional[str] = None, session_id: Optional[str] = None) -> Dict:
         """
         AI analysis of a product
         
         Args:
             product: ProductCard object
             user_context: Optional user context (e.g., "30代女性、カジュアル好き")
+            session_id: Session the LLM usage is accounted to
             
         Returns:
             AI-generated analysis with strengths, silhouette, cautions, etc.
         """
         try:
-            from openai import OpenAI
-            client = OpenAI(
-                api_key=self.openai_api_key,
-                base_url="https://api.openai.com/v1"
-            )
-            
-            # Prepare prompt for AI analysis
-            prompt = f"""
-以下の商品について、AIソムリエとして分析してください。
-
-【商品情報】
-タイトル: {product.title}
-価格: {product.price}
-URL: {product.product_url}
-
-【ユーザー情報】
-{user_context or "一般ユーザー"}
-
-【分析項目】
-1. 強み（3点以内）
-2. シルエット・デザイン
-3. 注意点
-4. 向いている人
-5. 向いていない人
-
-JSON形式で返してください：
-{{
-  "strengths": ["強み1", "強み2", "強み3"],
-  "silhouette": "シルエットの説明",
-  "cautions": "注意点",
-  "suitable_for": "向いている人",
-  "not_suitable_for": "向いていない人",
-  "one_line_summary": "一言で商品を表現"
-}}
-"""
-            
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "あなたは商品分析のプロフェッショナルなAIソムリエです。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
+            # Shares the LLM result cache with the offline bulk analysis (shopping_batch.py)
+            response = await get_llm_gateway().chat(
+                analysis_messages(product, user_context),
+                model=ANALYSIS_MODEL,
+                call_site="sommelier_analyze",
+                session_id=session_id,
+                cache=True,
+                **ANALYSIS_PARAMS
             )
             
             import json
@@ -167,24 +173,19 @@ JSON形式で返してください：
                 "one_line_summary": ""
             }
     
-    async def analyze_fashion_fit(self, product: ProductCard, user_profile: Dict) -> Dict:
+    async def analyze_fashion_fit(self, product: ProductCard, user_profile: Dict, session_id: Optional[str] = None) -> Dict:
         """
         Fashion-specific analysis (size, material, fit)
         
         Args:
             product: ProductCard object
             user_profile: User profile with body type, preferences, etc.
+            session_id: Session the LLM usage is accounted to
             
         Returns:
             Fashion-specific analysis
         """
         try:
-            from openai import OpenAI
-            client = OpenAI(
-                api_key=self.openai_api_key,
-                base_url="https://api.openai.com/v1"
-            )
-            
             prompt = f"""
 以下のファッション商品について、サイズ・素材・フィット感を分析してください。
 
@@ -216,12 +217,14 @@ JSON形式で返してください：
 }}
 """
             
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
+            response = await get_llm_gateway().chat(
+                [
                     {"role": "system", "content": "あなたはファッションコンサルタントです。"},
                     {"role": "user", "content": prompt}
                 ],
+                model="gpt-4o-mini",
+                call_site="sommelier_fashion_fit",
+                session_id=session_id,
                 temperature=0.7,
             )
             
@@ -244,23 +247,18 @@ JSON形式で返してください：
                 "styling_tips": []
             }
     
-    async def compare_products(self, products: List[ProductCard]) -> Dict:
+    async def compare_products(self, products: List[ProductCard], session_id: Optional[str] = None) -> Dict:
         """
         Compare multiple products and provide recommendation
         
         Args:
             products: List of ProductCard objects
+            session_id: Session the LLM usage is accounted to
             
         Returns:
             Comparison analysis with recommendation
         """
         try:
-            from openai import OpenAI
-            client = OpenAI(
-                api_key=self.openai_api_key,
-                base_url="https://api.openai.com/v1"
-            )
-            
             # Prepare product list for comparison
             product_list = "\n".join([
                 f"{i+1}. {p.title} - {p.price}"
@@ -287,12 +285,14 @@ JSON形式で返してください：
 }}
 """
             
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
+            response = await get_llm_gateway().chat(
+                [
                     {"role": "system", "content": "あなたは商品比較のエキスパートです。"},
                     {"role": "user", "content": prompt}
                 ],
+                model="gpt-4o-mini",
+                call_site="sommelier_compare",
+                session_id=session_id,
                 temperature=0.7,
             )
             
@@ -0,0 +1,410 @@
+"""
+Shopping Batch
+Offline bulk analysis for the shopping sommelier: reads a JSONL of products,
+submits the analyze_product requests through a batch API, keeps each job's
+state on disk and writes the finished analyses into the LLM result cache,
+where AIShoppingSommelier.analyze_product serves them without a live call
+
+Usage:
+    python shopping_batch.py submit products.jsonl [--user-context "30代女性"] [--wait]
+    python shopping_batch.py collect <job_id> [--wait]
+    python shopping_batch.py status <job_id>
+    python shopping_batch.py list
+
+--backend local answers with placeholder analyses for dry runs; those are
+stored in ./data/llm_cache.local.db, not the live cache, unless
+--cache-path points at the live cache and --allow-live-cache is given
+
+Each products.jsonl line holds ProductCard fields, e.g.
+    {"title": "...", "price": "¥3,990", "image_url": "...", "product_url": "..."}
+plus an optional per-product "user_context"
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import argparse
+import logging
+from dataclasses import fields
+from typing import Callable, Dict, List, Optional
+
+from llm_cache import LLMResultCache, make_key, ttl_for
+from llm_gateway import DEFAULT_BASE_URL
+from shopping import ANALYSIS_MODEL, ANALYSIS_PARAMS, ProductCard, analysis_messages
+
+logger = logging.getLogger("shopping_batch")
+
+CALL_SITE = "sommelier_analyze"
+BATCH_ENDPOINT = "/v1/chat/completions"
+DEFAULT_ROOT = "./data/shopping_batch"
+
+# The cache AIShoppingSommelier.analyze_product reads
+LIVE_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./data/llm_cache.db")
+# Placeholder analyses from the local backend go here, never where users would see them
+LOCAL_CACHE_PATH = "./data/llm_cache.local.db"
+
+# Provider states after which the batch won't change any more
+TERMINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+PRODUCT_FIELDS = {f.name for f in fields(ProductCard)}
+
+class OpenAIBatchBackend:
+    """OpenAI Batch API: half price, results within 24h, separate rate limits from live traffic"""
+
+    name = "openai"
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
+        from openai import AsyncOpenAI
+        self.client = AsyncOpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+            base_url=base_url or os.getenv("LLM_BASE_URL") or DEFAULT_BASE_URL
+        )
+
+    async def submit(self, requests_path: str, metadata: Dict) -> str:
+        with open(requests_path, "rb") as f:
+            upload = await self.client.files.create(file=(os.path.basename(requests_path), f.read()), purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=upload.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+            metadata=metadata
+        )
+        return batch.id
+
+    async def poll(self, batch_id: str) -> Dict:
+        batch = await self.client.batches.retrieve(batch_id)
+        return {
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id
+        }
+
+    async def results(self, batch_id: str, status: Dict) -> List[Dict]:
+        lines = []
+        for file_id in (status.get("output_file_id"), status.get("error_file_id")):
+            if file_id:
+                content = await self.client.files.content(file_id)
+                lines += [json.loads(line) for line in content.text.splitlines() if line.strip()]
+        return lines
+
+def canned_analysis(body: Dict) -> Dict:
+    """Deterministic chat.completion body for LocalBatchBackend"""
+    prompt = body["messages"][-1]["content"]
+    match = re.search(r"タイトル: (.*)", prompt)
+    title = match.group(1).strip() if match else "商品"
+    analysis = {
+        "strengths": [f"{title}の定番デザイン"],
+        "silhouette": "",
+        "cautions": "",
+        "suitable_for": "",
+        "not_suitable_for": "",
+        "one_line_summary": f"{title}（ローカル解析）"
+    }
+    return {
+        "id": f"chatcmpl-local-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": json.dumps(analysis, ensure_ascii=False)},
+            "finish_reason": "stop",
+            "logprobs": None
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
+
+class LocalBatchBackend:
+    """
+    Offline stand-in using the Batch API file formats
+    A batch completes on its first poll, answering every request with responder(body)
+    """
+
+    name = "local"
+
+    def __init__(self, root: str = os.path.join(DEFAULT_ROOT, "local"), responder: Optional[Callable[[Dict], Dict]] = None):
+        self.root = root
+        self.responder = responder or canned_analysis
+
+    def _path(self, batch_id: str, kind: str) -> str:
+        return os.path.join(self.root, f"{batch_id}.{kind}")
+
+    async def submit(self, requests_path: str, metadata: Dict) -> str:
+        os.makedirs(self.root, exist_ok=True)
+        batch_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        shutil.copyfile(requests_path, self._path(batch_id, "input.jsonl"))
+        return batch_id
+
+    async def poll(self, batch_id: str) -> Dict:
+        output_path = self._path(batch_id, "output.jsonl")
+        if not os.path.exists(output_path):
+            with open(self._path(batch_id, "input.jsonl"), encoding="utf-8") as f:
+                requests = [json.loads(line) for line in f if line.strip()]
+            with open(output_path, "w", encoding="utf-8") as f:
+                for request in requests:
+                    line = {
+                        "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": self.responder(request["body"])},
+                        "error": None
+                    }
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        return {"status": "completed", "output_file_id": output_path, "error_file_id": None}
+
+    async def results(self, batch_id: str, status: Dict) -> List[Dict]:
+        with open(status["output_file_id"], encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+def make_backend(name: str, root: str = DEFAULT_ROOT):
+    if name == "openai":
+        return OpenAIBatchBackend()
+    if name == "local":
+        return LocalBatchBackend(os.path.join(root, "local"))
+    raise ValueError(f"Unknown batch backend: {name}")
+
+def default_cache_path(backend: str) -> str:
+    return LOCAL_CACHE_PATH if backend == "local" else LIVE_CACHE_PATH
+
+def is_live_cache(path: str) -> bool:
+    return os.path.abspath(path) == os.path.abspath(LIVE_CACHE_PATH)
+
+def load_products(path: str) -> List[Dict]:
+    """(ProductCard, user_context) per line; lines without a title are skipped"""
+    products = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+                product = ProductCard(**{
+                    "image_url": "",
+                    "product_url": "",
+                    "price": "価格不明",
+                    **{k: v for k, v in data.items() if k in PRODUCT_FIELDS}
+                })
+            except (ValueError, TypeError) as e:
+                logger.warning(f"{path}:{number}: skipped ({e})")
+                continue
+            products.append({"product": product, "user_context": data.get("user_context")})
+    return products
+
+class ShoppingBatchRunner:
+    """
+    Bulk-analysis jobs; each lives in <root>/<job_id>/ as
+    job.json (state), requests.jsonl (batch input) and results.jsonl (raw batch output)
+    """
+
+    def __init__(self, cache: Optional[LLMResultCache], root: str = DEFAULT_ROOT, allow_live_cache: bool = False):
+        self.cache = cache
+        self.root = root
+        self.allow_live_cache = allow_live_cache  # Let local (placeholder) results into the live cache
+
+    def _check_cache(self, backend: str):
+        if backend == "local" and is_live_cache(self.cache.path) and not self.allow_live_cache:
+            raise ValueError(
+                f"Refusing to store local placeholder analyses in the live cache {self.cache.path}; "
+                f"use --cache-path {LOCAL_CACHE_PATH} or pass --allow-live-cache"
+            )
+
+    def _job_dir(self, job_id: str) -> str:
+        return os.path.join(self.root, job_id)
+
+    def load(self, job_id: str) -> Dict:
+        with open(os.path.join(self._job_dir(job_id), "job.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, job: Dict):
+        """Atomic replace so a crash never leaves a half-written state file"""
+        path = os.path.join(self._job_dir(job["job_id"]), "job.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def list_jobs(self) -> List[Dict]:
+        if not os.path.isdir(self.root):
+            return []
+        jobs = []
+        for name in sorted(os.listdir(self.root)):
+            if os.path.exists(os.path.join(self._job_dir(name), "job.json")):
+                jobs.append(self.load(name))
+        return sorted(jobs, key=lambda job: job["created_at"])
+
+    async def submit(self, products_path: str, backend, user_context: Optional[str] = None) -> Dict:
+        """Write the batch input for products not already cached and submit it"""
+        self._check_cache(backend.name)
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        os.makedirs(self._job_dir(job_id), exist_ok=True)
+        job = {
+            "job_id": job_id,
+            "backend": backend.name,
+            "batch_id": None,
+            "status": "preparing",
+            "products_path": os.path.abspath(products_path),
+            "model": ANALYSIS_MODEL,
+            "created_at": time.time(),
+            "submitted_at": None,
+            "finished_at": None,
+            "counts": {"products": 0, "already_cached": 0, "submitted": 0, "stored": 0, "failed": 0}
+        }
+
+        products = load_products(products_path)
+        job["counts"]["products"] = len(products)
+        requests_path = os.path.join(self._job_dir(job_id), "requests.jsonl")
+        with open(requests_path, "w", encoding="utf-8") as f:
+            for index, item in enumerate(products):
+                messages = analysis_messages(item["product"], item["user_context"] or user_context)
+                if await self.cache.get(make_key(ANALYSIS_MODEL, messages, ANALYSIS_PARAMS)) is not None:
+                    job["counts"]["already_cached"] += 1
+                    continue
+                request = {
+                    "custom_id": f"product-{index:06d}",
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": {"model": ANALYSIS_MODEL, "messages": messages, **ANALYSIS_PARAMS}
+                }
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+                job["counts"]["submitted"] += 1
+
+        if job["counts"]["submitted"] == 0:
+            job["status"] = "nothing_to_do"
+            job["finished_at"] = time.time()
+            self.save(job)
+            return job
+
+        self.save(job)
+        job["batch_id"] = await backend.submit(requests_path, {"job_id": job_id})
+        job["status"] = "submitted"
+        job["submitted_at"] = time.time()
+        self.save(job)
+        logger.info(f"[{job_id}] Submitted {job['counts']['submitted']} products as {job['batch_id']}")
+        return job
+
+    async def refresh(self, job_id: str, backend=None) -> Dict:
+        """Poll the batch once; ingest the results when it has finished"""
+        job = self.load(job_id)
+        if job["batch_id"] is None or job["status"] in TERMINAL_STATES | {"ingested"}:
+            return job
+        backend = backend or make_backend(job["backend"], self.root)
+
+        status = await backend.poll(job["batch_id"])
+        job["status"] = status["status"]
+        if job["status"] == "completed":
+            await self._ingest(job, await backend.results(job["batch_id"], status))
+            job["status"] = "ingested"
+        if job["status"] in TERMINAL_STATES | {"ingested"}:
+            job["finished_at"] = time.time()
+        self.save(job)
+        return job
+
+    async def wait(self, job_id: str, backend=None, interval: float = 60.0) -> Dict:
+        """Poll until the job is done"""
+        while True:
+            job = await self.refresh(job_id, backend)
+            if job["batch_id"] is None or job["status"] in TERMINAL_STATES | {"ingested"}:
+                return job
+            logger.info(f"[{job_id}] {job['status']}, checking again in {interval:.0f}s")
+            await asyncio.sleep(interval)
+
+    async def _ingest(self, job: Dict, lines: List[Dict]):
+        """Store each successful analysis under the key analyze_product will look up"""
+        from openai.types.chat import ChatCompletion
+
+        self._check_cache(job["backend"])
+
+        bodies = {}
+        with open(os.path.join(self._job_dir(job["job_id"]), "requests.jsonl"), encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    request = json.loads(line)
+                    bodies[request["custom_id"]] = request["body"]
+
+        ttl = ttl_for(CALL_SITE)
+        with open(os.path.join(self._job_dir(job["job_id"]), "results.jsonl"), "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+                body = bodies.get(line.get("custom_id"))
+                response = line.get("response") or {}
+                try:
+                    if body is None or response.get("status_code") != 200:
+                        raise ValueError(line.get("error") or f"status {response.get('status_code')}")
+                    completion = ChatCompletion.model_validate(response["body"])
+                    choice = completion.choices[0]
+                    # Same rule as the live path: only complete, parseable answers are replayed
+                    if choice.finish_reason != "stop":
+                        raise ValueError(f"finish_reason {choice.finish_reason}")
+                    json.loads(choice.message.content)
+                except Exception as e:
+                    job["counts"]["failed"] += 1
+                    logger.warning(f"[{job['job_id']}] {line.get('custom_id')}: not stored ({e})")
+                    continue
+                params = {k: v for k, v in body.items() if k not in ("model", "messages")}
+                key = make_key(body["model"], body["messages"], params)
+                await self.cache.set(key, CALL_SITE, completion.model_dump_json(), ttl)
+                job["counts"]["stored"] += 1
+
+        # Requests the provider never answered
+        job["counts"]["failed"] += len(set(bodies) - {line.get("custom_id") for line in lines})
+        logger.info(f"[{job['job_id']}] Stored {job['counts']['stored']} analyses, {job['counts']['failed']} failed")
+
+async def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk product analysis for the AI shopping sommelier")
+    parser.add_argument("--root", default=os.getenv("SHOPPING_BATCH_ROOT", DEFAULT_ROOT), help="Job state directory")
+    parser.add_argument(
+        "--cache-path",
+        help=f"Result cache to fill (default: {LIVE_CACHE_PATH}, or {LOCAL_CACHE_PATH} for the local backend)"
+    )
+    parser.add_argument(
+        "--allow-live-cache",
+        action="store_true",
+        help="Allow local backend results into the live cache analyze_product reads"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Submit a products JSONL")
+    submit.add_argument("products")
+    submit.add_argument("--user-context", help="Default user context for products without one")
+    submit.add_argument("--backend", choices=["openai", "local"], default=os.getenv("SHOPPING_BATCH_BACKEND", "openai"))
+    submit.add_argument("--wait", action="store_true", help="Poll until the results are stored")
+    submit.add_argument("--interval", type=float, default=60.0)
+
+    collect = commands.add_parser("collect", help="Poll a job and store finished results")
+    collect.add_argument("job_id")
+    collect.add_argument("--wait", action="store_true")
+    collect.add_argument("--interval", type=float, default=60.0)
+
+    status = commands.add_parser("status", help="Show a job's state")
+    status.add_argument("job_id")
+
+    commands.add_parser("list", help="List jobs")
+
+    args = parser.parse_args(argv)
+    runner = ShoppingBatchRunner(None, args.root, allow_live_cache=args.allow_live_cache)
+    if args.command in ("submit", "collect"):
+        backend_name = args.backend if args.command == "submit" else runner.load(args.job_id)["backend"]
+        runner.cache = LLMResultCache(args.cache_path or default_cache_path(backend_name))
+
+    if args.command == "submit":
+        backend = make_backend(args.backend, args.root)
+        result = await runner.submit(args.products, backend, user_context=args.user_context)
+        if args.wait:
+            result = await runner.wait(result["job_id"], backend, interval=args.interval)
+    elif args.command == "collect":
+        if args.wait:
+            result = await runner.wait(args.job_id, interval=args.interval)
+        else:
+            result = await runner.refresh(args.job_id)
+    elif args.command == "status":
+        result = runner.load(args.job_id)
+    else:
+        result = runner.list_jobs()
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
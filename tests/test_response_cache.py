@@ -0,0 +1,39 @@
+import asyncio
+
+from response_cache import SemanticResponseCache
+
+SYSTEM = {"role": "system", "content": "system prompt"}
+
+def turn(history, message):
+    return [SYSTEM] + history + [{"role": "user", "content": message}]
+
+def test_follow_up_does_not_hit_another_sessions_answer():
+    cache = SemanticResponseCache()
+    session_a = turn([
+        {"role": "user", "content": "おすすめのノートPCは？"},
+        {"role": "assistant", "content": "ThinkPad X1 です"},
+    ], "tell me more about that")
+    session_b = turn([
+        {"role": "user", "content": "京都の観光地は？"},
+        {"role": "assistant", "content": "清水寺です"},
+    ], "tell me more about that")
+
+    async def run():
+        await cache.store("tell me more about that", session_a, "ThinkPad の詳細", {})
+        other, _ = await cache.lookup("tell me more about that", session_b)
+        same, _ = await cache.lookup("tell me more about that", session_a)
+        return other, same
+
+    other, same = asyncio.run(run())
+    assert other is None
+    assert same is not None and same.response == "ThinkPad の詳細"
+
+def test_first_turn_is_shared_across_sessions():
+    cache = SemanticResponseCache()
+
+    async def run():
+        await cache.store("日本の首都は？", turn([], "日本の首都は？"), "東京です", {})
+        return await cache.lookup("日本の首都は", turn([], "日本の首都は"))
+
+    entry, _ = asyncio.run(run())
+    assert entry is not None and entry.response == "東京です"
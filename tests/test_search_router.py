@@ -0,0 +1,47 @@
+import pytest
+
+from search_router import SearchDecisionRouter
+
+router = SearchDecisionRouter(auto_search=None)
+
+# (message, expected should_search, or None for "deferred to the LLM")
+CASES = [
+    # Small talk
+    ("ありがとう！", False),
+    ("こんにちは", False),
+    ("thanks", False),
+    # Opinion / writing requests
+    ("おすすめの本は？", False),
+    ("ニュースレターを書いて", False),
+    # Demonstrative-only follow-ups: the subject is the previous turn
+    ("それって何", False),
+    ("それはいつ発売ですか", False),
+    ("その2つの違いは？", False),
+    ("2番目のやつを詳しく", False),
+    ("tell me more about that", False),
+    ("what does it cost", False),
+    ("what is that?", False),
+    # Time-sensitive
+    ("東京の天気は？", True),
+    ("ドルのレートを教えて", True),
+    ("今日のニュース", True),
+    ("what's the weather in Tokyo", True),
+    ("latest news about OpenAI", True),
+    # Fact questions
+    ("富士山の高さはいくら？", True),
+    ("それぞれの国の首都はどこ？", True),
+    ("what is quantum computing", True),
+    # Not sure: left to the LLM
+    ("the weather is nice", None),
+    ("I have good news", None),
+    ("チョコレートの作り方", None),
+    ("いつもお世話になっています、資料を送ります", None),
+]
+
+@pytest.mark.parametrize("message,expected", CASES)
+def test_classify_local(message, expected):
+    decision = router.classify_local(message)
+    if expected is None:
+        assert decision is None
+    else:
+        assert decision is not None and decision["should_search"] is expected, decision
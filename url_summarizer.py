@@ -7,6 +7,7 @@ import httpx
 import logging
 from bs4 import BeautifulSoup
 from typing import Dict, Optional
+from llm_gateway import get_llm_gateway
 
 logger = logging.getLogger("url_summarizer")
 
@@ -55,7 +56,7 @@ class URLSummarizer:
             logger.error(f"Error fetching URL {url}: {e}")
             return None
     
-    async def summarize_url(self, url: str) -> Dict:
+    async def summarize_url(self, url: str, session_id: Optional[str] = None) -> Dict:
         """
         Fetch URL content and generate AI summary with safety check
         
@@ -74,9 +75,6 @@ class URLSummarizer:
                 }
             
             # Use OpenAI API for summarization
-            from openai import OpenAI
-            client = OpenAI()
-            
             prompt = f"""以下のWebページの内容を要約し、安全性を評価してください。
 
 URL: {url}
@@ -98,9 +96,12 @@ safety判定基準:
 - danger: フィッシング、マルウェア、詐欺の可能性があるサイト
 """
             
-            response = client.chat.completions.create(
+            response = await get_llm_gateway().chat(
+                [{"role": "user", "content": prompt}],
                 model="gpt-4.1-mini",
-                messages=[{"role": "user", "content": prompt}],
+                call_site="summarize_url",
+                session_id=session_id,
+                cache=True,
                 temperature=0.3
             )
             
@@ -0,0 +1,155 @@
+"""
+LLM Usage Tracker
+Token, cost and latency accounting for every gateway call, aggregated per
+call site, per session and per model, with optional per-session token budgets
+"""
+
+import logging
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional
+
+logger = logging.getLogger("usage_tracker")
+
+# USD per 1M tokens (input, output); estimates for the models this app calls
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "text-embedding-3-small": (0.02, 0.0),
+}
+
+UNTAGGED = "untagged"
+
+class TokenBudgetExceeded(Exception):
+    """The session has used up its token budget"""
+    pass
+
+@dataclass
+class UsageCounter:
+    """Aggregated usage for one call site, session or model"""
+    calls: int = 0
+    errors: int = 0
+    cache_hits: int = 0  # Served from the LLM result cache, no tokens billed
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_prompt_tokens: int = 0  # Provider-side prompt cache
+    cost_usd: float = 0.0
+    latency_total: float = 0.0
+    latency_max: float = 0.0
+
+    def add(self, prompt_tokens: int, completion_tokens: int, cached_prompt_tokens: int,
+            cost: float, latency: float, error: bool, cache_hit: bool):
+        self.calls += 1
+        self.errors += int(error)
+        self.cache_hits += int(cache_hit)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_prompt_tokens += cached_prompt_tokens
+        self.cost_usd += cost
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def to_dict(self) -> Dict:
+        return {
+            **asdict(self),
+            "total_tokens": self.total_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "latency_avg": self.latency_total / self.calls if self.calls else 0.0,
+            # Share of prompt tokens served from the provider's prefix cache
+            "cached_share": self.cached_prompt_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        }
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+class UsageTracker:
+    """Per call site / session / model usage counters"""
+
+    def __init__(self, session_token_budget: Optional[int] = None, max_sessions: int = 1000):
+        self.session_token_budget = session_token_budget  # None: unlimited
+        self.max_sessions = max_sessions
+        self.by_call_site: Dict[str, UsageCounter] = {}
+        self.by_model: Dict[str, UsageCounter] = {}
+        self.by_session: "OrderedDict[str, UsageCounter]" = OrderedDict()
+        self.budget_overrides: Dict[str, int] = {}
+        self.budget_rejections = 0
+
+    def budget_for(self, session_id: str) -> Optional[int]:
+        return self.budget_overrides.get(session_id, self.session_token_budget)
+
+    def set_budget(self, session_id: str, tokens: Optional[int]):
+        """Per-session override; None restores the default"""
+        if tokens is None:
+            self.budget_overrides.pop(session_id, None)
+        else:
+            self.budget_overrides[session_id] = tokens
+
+    def check_budget(self, session_id: Optional[str]):
+        """Raise TokenBudgetExceeded before a call if the session is over budget"""
+        if not session_id:
+            return
+        budget = self.budget_for(session_id)
+        if budget is None:
+            return
+        counter = self.by_session.get(session_id)
+        if counter is not None and counter.total_tokens >= budget:
+            self.budget_rejections += 1
+            logger.warning(f"[{session_id}] Token budget exhausted ({counter.total_tokens}/{budget})")
+            raise TokenBudgetExceeded(f"Session {session_id} exceeded its token budget of {budget}")
+
+    def record(
+        self,
+        call_site: Optional[str],
+        session_id: Optional[str],
+        model: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached_prompt_tokens: int = 0,
+        latency: float = 0.0,
+        error: bool = False,
+        cache_hit: bool = False
+    ):
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        values = (prompt_tokens, completion_tokens, cached_prompt_tokens, cost, latency, error, cache_hit)
+
+        self.by_call_site.setdefault(call_site or UNTAGGED, UsageCounter()).add(*values)
+        self.by_model.setdefault(model, UsageCounter()).add(*values)
+        if session_id:
+            counter = self.by_session.get(session_id)
+            if counter is None:
+                counter = self.by_session[session_id] = UsageCounter()
+            self.by_session.move_to_end(session_id)
+            counter.add(*values)
+            while len(self.by_session) > self.max_sessions:
+                self.by_session.popitem(last=False)
+
+    def get_session_usage(self, session_id: str) -> Dict:
+        counter = self.by_session.get(session_id, UsageCounter())
+        budget = self.budget_for(session_id)
+        return {
+            **counter.to_dict(),
+            "budget": budget,
+            "remaining": max(0, budget - counter.total_tokens) if budget is not None else None
+        }
+
+    def get_stats(self) -> Dict:
+        totals = UsageCounter()
+        for counter in self.by_call_site.values():
+            for name, value in asdict(counter).items():
+                if name == "latency_max":
+                    totals.latency_max = max(totals.latency_max, value)
+                else:
+                    setattr(totals, name, getattr(totals, name) + value)
+        return {
+            "totals": totals.to_dict(),
+            "by_call_site": {k: v.to_dict() for k, v in sorted(self.by_call_site.items())},
+            "by_model": {k: v.to_dict() for k, v in sorted(self.by_model.items())},
+            "sessions_tracked": len(self.by_session),
+            "session_token_budget": self.session_token_budget,
+            "budget_rejections": self.budget_rejections
+        }